@@ -0,0 +1,371 @@
+# agentsuite/cache.py - Two-tier cache: in-process LRU (L1) in front of a SQLite store shared by all workers
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+logger = logging.getLogger('agentsuite')
+
+_MISSING = object()
+GENERATION_KEY = "agentsuite_l1_generation"
+GENERATION_CHECK_INTERVAL = 1.0   # Seconds between checks for invalidations made by other workers
+
+class SQLiteCache(BaseCache):
+    """
+    Django cache backend on a local SQLite file, shared by every process on the host.
+    add() and incr() are atomic across processes, so claims and counters stay exact.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.cull_every = params.get("OPTIONS", {}).get("CULL_EVERY", 500)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        # One connection per thread (async views share cache objects across executor threads),
+        # and never one inherited across a fork (gunicorn --preload)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % self.cull_every == 0:
+            self._cull()
+
+    def _cull(self):
+        """Drop expired rows, then the soonest-expiring 1/cull_frequency if still over max_entries"""
+        db = self._db()
+        db.execute("DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        (count,) = db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        if count > self._max_entries:
+            db.execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                "(SELECT key FROM cache_entries ORDER BY expires IS NULL, expires LIMIT ?)",
+                (max(1, count // self._cull_frequency),),
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        # Insert, or take over an expired row - a single statement, so only one caller wins
+        cursor = self._db().execute(
+            "INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), now),
+        )
+        self._wrote()
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db().execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        made = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not made:
+            return {}
+        placeholders = ",".join("?" * len(made))
+        rows = self._db().execute(
+            f"SELECT key, value FROM cache_entries WHERE key IN ({placeholders}) AND (expires IS NULL OR expires > ?)",
+            (*made, time.time()),
+        ).fetchall()
+        return {made[key]: pickle.loads(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._db().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout)),
+        )
+        self._wrote()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db().execute(
+            "UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def delete_prefix(self, prefix, version=None):
+        """Delete every key starting with prefix - returns the number removed"""
+        pattern = self.make_key(prefix, version=version)
+        pattern = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        cursor = self._db().execute("DELETE FROM cache_entries WHERE key LIKE ? ESCAPE '\\'", (pattern,))
+        return cursor.rowcount
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        db = self._db()
+        # BEGIN IMMEDIATE takes the write lock first, so read-modify-write is atomic across processes
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute(
+                "UPDATE cache_entries SET value = ? WHERE key = ?",
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._db().execute("DELETE FROM cache_entries")
+
+class LocalTier:
+    """Bounded LRU of (value, expires_at) shared by all threads of the process"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return _MISSING
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+_stats = defaultdict(lambda: {"l1_hits": 0, "shared_hits": 0, "misses": 0})
+_stats_lock = threading.Lock()
+_invalidation_hooks = []
+
+def get_tier(name, max_entries):
+    """The process-wide L1 for a TieredCache alias (Django builds cache objects per thread)"""
+    tier = _tiers.get(name)
+    if tier is None:
+        with _tiers_lock:
+            tier = _tiers.get(name)
+            if tier is None:
+                tier = _tiers[name] = LocalTier(max_entries)
+    return tier
+
+def _record(family, outcome):
+    with _stats_lock:
+        _stats[family][outcome] += 1
+
+def cache_stats():
+    """Per key-prefix lookups and hit rates for this process since it started"""
+    with _stats_lock:
+        stats = {family: dict(counts) for family, counts in _stats.items()}
+    for counts in stats.values():
+        lookups = counts["l1_hits"] + counts["shared_hits"] + counts["misses"]
+        counts["lookups"] = lookups
+        counts["hit_rate"] = round((counts["l1_hits"] + counts["shared_hits"]) / lookups, 3) if lookups else None
+    return stats
+
+def on_invalidate(hook):
+    """Register hook(prefix) to run whenever keys are invalidated through a TieredCache (usable as a decorator)"""
+    _invalidation_hooks.append(hook)
+    return hook
+
+def _run_invalidation_hooks(prefix):
+    for hook in _invalidation_hooks:
+        try:
+            hook(prefix)
+        except Exception as e:
+            logger.warning(f"Cache invalidation hook {getattr(hook, '__name__', hook)} failed: {str(e)}")
+
+class TieredCache(BaseCache):
+    """
+    Reads of keys under L1_PREFIXES are served from a short-lived in-process LRU, falling
+    back to the shared cache named by LOCATION; writes go through to the shared cache.
+    add/incr/decr always go to the shared cache, so claims and counters stay exact.
+    invalidate()/delete_prefix() bump a shared generation counter that makes every worker drop its L1.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = location
+        self.l1_ttl = options.get("L1_TTL", 10)
+        self.l1_prefixes = tuple(options.get("L1_PREFIXES", ()))
+        self.stats_prefixes = sorted(options.get("STATS_PREFIXES", ()), key=len, reverse=True)
+        self.tier = get_tier(location, options.get("L1_MAX_ENTRIES", 1000))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def family(self, key):
+        """Key prefix that hit-rate statistics are grouped by"""
+        for prefix in self.stats_prefixes:
+            if key.startswith(prefix):
+                return prefix
+        head, sep, _ = key.partition("_")
+        return f"{head}{sep}"
+
+    def _l1_key(self, key, version):
+        return f"{version or self.version}:{key}"
+
+    def _uses_l1(self, key):
+        return bool(self.l1_prefixes) and key.startswith(self.l1_prefixes)
+
+    def _sync_generation(self):
+        """Drop the L1 when another worker invalidated something (checked at most once a second)"""
+        now = time.monotonic()
+        if now - self.tier.checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self.tier.checked_at = now
+        generation = self.shared.get(GENERATION_KEY, 0)
+        if generation != self.tier.generation:
+            if self.tier.generation is not None:
+                self.tier.clear()
+            self.tier.generation = generation
+
+    def get(self, key, default=None, version=None):
+        family = self.family(key)
+        use_l1 = self._uses_l1(key)
+        if use_l1:
+            self._sync_generation()
+            value = self.tier.get(self._l1_key(key, version))
+            if value is not _MISSING:
+                _record(family, "l1_hits")
+                return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            _record(family, "misses")
+            return default
+        _record(family, "shared_hits")
+        if use_l1:
+            self.tier.set(self._l1_key(key, version), value, self.l1_ttl)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        if self._uses_l1(key):
+            ttl = self.l1_ttl if timeout is DEFAULT_TIMEOUT or timeout is None else min(self.l1_ttl, timeout)
+            if ttl > 0:
+                self.tier.set(self._l1_key(key, version), value, ttl)
+            else:
+                self.tier.discard(self._l1_key(key, version))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.tier.discard(self._l1_key(key, version))
+        return self.shared.add(key, value, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.tier.discard(self._l1_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def has_key(self, key, version=None):
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        """Other workers may serve their L1 copy for up to L1_TTL - use invalidate() when that matters"""
+        self.tier.discard(self._l1_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def invalidate(self, key, version=None):
+        """Delete key here, in the shared cache and in every worker's L1"""
+        deleted = self.delete(key, version=version)
+        self._bump_generation()
+        _run_invalidation_hooks(key)
+        return deleted
+
+    def delete_prefix(self, prefix, version=None):
+        """Invalidate every key under prefix in this worker, the shared cache and (via the generation) other workers"""
+        self.tier.discard_prefix(self._l1_key(prefix, version))
+        removed = 0
+        if hasattr(self.shared, "delete_prefix"):
+            removed = self.shared.delete_prefix(prefix, version=version)
+        else:
+            logger.warning(f"Cache '{self.shared_alias}' cannot delete by prefix - {prefix} entries expire on their own")
+        self._bump_generation()
+        _run_invalidation_hooks(prefix)
+        return removed
+
+    def _bump_generation(self):
+        if not self.shared.add(GENERATION_KEY, 1, timeout=None):
+            try:
+                self.shared.incr(GENERATION_KEY)
+            except ValueError:
+                self.shared.add(GENERATION_KEY, 1, timeout=None)
+
+    def clear(self):
+        self.shared.clear()
+        self.tier.clear()
+        self._bump_generation()
+        _run_invalidation_hooks("")
@@ -0,0 +1,144 @@
+# agentsuite/host_governor.py - Per-host concurrency and rate budgets shared by every worker through the cache
+import asyncio
+import math
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager, asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from agentsuite import metrics
+
+logger = logging.getLogger('agentsuite')
+
+GOVERNOR_PREFIX = "host_governor_"
+BACKOFF_BASE = 0.05     # First retry delay; doubles per failed attempt up to BACKOFF_MAX
+BACKOFF_MAX = 2.0
+
+# concurrency - requests in flight to the host across all workers
+# rate        - request starts per second
+# max_wait    - how long a caller queues for a turn before giving up
+DEFAULT_BUDGET = {"concurrency": 3, "rate": 5, "max_wait": 10}
+
+class HostBusy(Exception):
+    """No turn for the host within max_wait (or the caller's deadline)"""
+
+def get_budget(host):
+    """DEFAULT_BUDGET overlaid with AGENTSUITE_HOST_BUDGETS["default"] and then the host's own entry"""
+    budgets = getattr(settings, "AGENTSUITE_HOST_BUDGETS", {})
+    budget = dict(DEFAULT_BUDGET)
+    budget.update(budgets.get("default", {}))
+    budget.update(budgets.get(host, {}))
+    return budget
+
+def rate_window(rate):
+    """(window seconds, starts allowed per window) for a possibly fractional rate"""
+    window = 1 if rate >= 1 else math.ceil(1 / rate)
+    return window, max(1, round(rate * window))
+
+def _slot_key(host, index):
+    return f"{GOVERNOR_PREFIX}{host}_slot_{index}"
+
+def _try_claim_slot(host, budget, token, lease):
+    for index in range(budget["concurrency"]):
+        if cache.add(_slot_key(host, index), token, timeout=lease):
+            return index
+    return None
+
+def _try_take_rate(host, budget):
+    window, allowed = rate_window(budget["rate"])
+    key = f"{GOVERNOR_PREFIX}{host}_rate_{int(time.time() // window)}"
+    if cache.add(key, 1, timeout=window + 1):
+        return True
+    try:
+        return cache.incr(key) <= allowed
+    except ValueError:
+        # The window expired between add and incr
+        return cache.add(key, 1, timeout=window + 1)
+
+def _release_slot(host, index, token):
+    key = _slot_key(host, index)
+    if cache.get(key) == token:
+        cache.delete(key)
+
+def _max_wait(budget, deadline):
+    if deadline is None:
+        return budget["max_wait"]
+    return min(budget["max_wait"], deadline.remaining())
+
+def _backoff(attempt, give_up_at):
+    """
+    Seconds to wait before the next attempt: exponential with jitter, so queued callers
+    spread out instead of hitting the cache in lockstep, and never past give_up_at
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(0.0, min(delay, give_up_at - time.monotonic()))
+
+def _record_wait(host, waited):
+    metrics.observe("http.host_queue_ms", waited * 1000)
+    if waited >= 1:
+        logger.info(f"HOST GOVERNOR: queued {waited:.1f}s for {host}")
+
+@contextmanager
+def host_turn(host, lease=30, deadline=None):
+    """
+    Hold one of the host's concurrency slots for the duration of the block, after
+    taking a rate token. lease bounds how long a crashed worker can keep the slot.
+    Raises HostBusy when no turn comes up in time.
+    """
+    budget = get_budget(host)
+    token = uuid.uuid4().hex
+    lease = int(math.ceil(lease))
+    started = time.monotonic()
+    give_up_at = started + _max_wait(budget, deadline)
+
+    index = None
+    attempt = 0
+    while True:
+        index = _try_claim_slot(host, budget, token, lease)
+        if index is not None:
+            if _try_take_rate(host, budget):
+                break
+            _release_slot(host, index, token)
+        if time.monotonic() >= give_up_at:
+            metrics.incr("http.host_busy")
+            raise HostBusy(f"No request budget for {host} within {time.monotonic() - started:.1f}s")
+        time.sleep(_backoff(attempt, give_up_at))
+        attempt += 1
+
+    _record_wait(host, time.monotonic() - started)
+    try:
+        yield
+    finally:
+        _release_slot(host, index, token)
+
+@asynccontextmanager
+async def ahost_turn(host, lease=30, deadline=None):
+    """Async twin of host_turn"""
+    budget = get_budget(host)
+    token = uuid.uuid4().hex
+    lease = int(math.ceil(lease))
+    started = time.monotonic()
+    give_up_at = started + _max_wait(budget, deadline)
+
+    index = None
+    attempt = 0
+    while True:
+        index = await sync_to_async(_try_claim_slot, thread_sensitive=False)(host, budget, token, lease)
+        if index is not None:
+            if await sync_to_async(_try_take_rate, thread_sensitive=False)(host, budget):
+                break
+            await sync_to_async(_release_slot, thread_sensitive=False)(host, index, token)
+        if time.monotonic() >= give_up_at:
+            metrics.incr("http.host_busy")
+            raise HostBusy(f"No request budget for {host} within {time.monotonic() - started:.1f}s")
+        await asyncio.sleep(_backoff(attempt, give_up_at))
+        attempt += 1
+
+    _record_wait(host, time.monotonic() - started)
+    try:
+        yield
+    finally:
+        await sync_to_async(_release_slot, thread_sensitive=False)(host, index, token)
@@ -0,0 +1,278 @@
+# agentsuite/http_client.py - Process-wide pooled HTTP client for every outbound fetch in the suite
+import asyncio
+import importlib.util
+import logging
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from urllib.parse import urlsplit
+import httpx
+from django.conf import settings
+from agentsuite import metrics
+from agentsuite.host_governor import HostBusy, host_turn, ahost_turn
+
+logger = logging.getLogger('agentsuite')
+
+DEFAULT_TIMEOUT = 15
+DEFAULT_RETRIES = 2
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 4
+
+# Only these are retried: the server never saw the request, or told us to come back later
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+def get_default_timeout():
+    return getattr(settings, "AGENTSUITE_HTTP_TIMEOUT", DEFAULT_TIMEOUT)
+
+def get_default_retries():
+    return getattr(settings, "AGENTSUITE_HTTP_RETRIES", DEFAULT_RETRIES)
+
+def get_max_connections_per_host():
+    return getattr(settings, "AGENTSUITE_HTTP_MAX_CONNECTIONS_PER_HOST", DEFAULT_MAX_CONNECTIONS_PER_HOST)
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+def client_options():
+    """Settings shared by the sync and async clients"""
+    return {
+        "http2": http2_available(),
+        "follow_redirects": True,
+        "timeout": get_default_timeout(),
+        "limits": httpx.Limits(
+            max_connections=getattr(settings, "AGENTSUITE_HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=getattr(settings, "AGENTSUITE_HTTP_MAX_KEEPALIVE", 20),
+        ),
+    }
+
+def host_of(url):
+    return (urlsplit(str(url)).hostname or "").lower()
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter: ~0.5s, 1s, 2s ... capped"""
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+def should_retry(response=None, error=None):
+    if error is not None:
+        return isinstance(error, RETRY_EXCEPTIONS)
+    return response is not None and response.status_code in RETRY_STATUS_CODES
+
+def can_wait(delay, deadline):
+    """deadline is anything with remaining() (e.g. webdoctor.deadline.Deadline)"""
+    return deadline is None or deadline.remaining() > delay
+
+def record_request(method, started, response=None, error=None):
+    elapsed = time.monotonic() - started
+    metrics.incr("http.requests")
+    metrics.observe("http.latency_ms", elapsed * 1000)
+    if response is not None:
+        response.extensions["time_to_headers"] = elapsed
+        metrics.incr(f"http.status.{response.status_code // 100}xx")
+    if error is not None:
+        metrics.incr(f"http.errors.{type(error).__name__}")
+
+def time_to_headers(response):
+    """Seconds from sending the final attempt to its response headers - governor queueing and retries excluded"""
+    return response.extensions.get("time_to_headers")
+
+# ---------------------------------------------------------------------------
+# Sync client (WSGI views, worker threads)
+# ---------------------------------------------------------------------------
+
+_client = None
+_client_lock = threading.Lock()
+_host_slots = {}
+
+def get_client() -> httpx.Client:
+    """The shared httpx.Client - keep-alive pools per origin, HTTP/2 when h2 is installed"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(**client_options())
+                logger.info(f"Shared HTTP client initialized (http2={http2_available()})")
+    return _client
+
+def host_slot(host) -> threading.BoundedSemaphore:
+    """Caps concurrent connections to one host across all threads of the process"""
+    slot = _host_slots.get(host)
+    if slot is None:
+        with _client_lock:
+            slot = _host_slots.setdefault(host, threading.BoundedSemaphore(get_max_connections_per_host()))
+    return slot
+
+@contextmanager
+def hold_host_slot(host, deadline=None):
+    """Hold one of the process's connections to host - raises HostBusy when none frees up before deadline"""
+    slot = host_slot(host)
+    wait = deadline.remaining() if deadline else get_default_timeout()
+    if not slot.acquire(timeout=max(0, wait)):
+        metrics.incr("http.host_busy")
+        raise HostBusy(f"No free connection to {host} within {max(0, wait):.1f}s")
+    try:
+        yield
+    finally:
+        slot.release()
+
+def _send(method, url, stream, retries, deadline, kwargs):
+    client = get_client()
+    retries = get_default_retries() if retries is None else retries
+    kwargs.setdefault("timeout", get_default_timeout())
+    follow_redirects = kwargs.pop("follow_redirects", True)
+
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        response, error = None, None
+        try:
+            response = client.send(client.build_request(method, url, **kwargs), stream=stream, follow_redirects=follow_redirects)
+        except httpx.HTTPError as e:
+            error = e
+        record_request(method, started, response, error)
+
+        delay = retry_delay(attempt)
+        if attempt < retries and should_retry(response, error) and can_wait(delay, deadline):
+            if response is not None:
+                response.close()
+            attempt += 1
+            metrics.incr("http.retries")
+            logger.info(f"HTTP retry {attempt}/{retries} for {method} {url} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if error is not None:
+            raise error
+        return response
+
+def governor_lease(kwargs):
+    """Seconds a host turn may be held: the request timeout plus retry headroom"""
+    timeout = kwargs.get("timeout", get_default_timeout())
+    return (timeout if isinstance(timeout, (int, float)) else get_default_timeout()) + RETRY_BACKOFF_MAX * 2
+
+def request(method, url, *, retries=None, deadline=None, governor_host=None, **kwargs) -> httpx.Response:
+    """
+    One request through the shared client. kwargs are httpx request options
+    (params, headers, json, data, timeout, follow_redirects). Connection failures
+    and 429/502/503/504 are retried with backoff, never past deadline.
+
+    Every request first takes a turn from the host governor - governor_host names the
+    site being loaded when that differs from the URL's host (e.g. PageSpeed tests).
+    Raises HostBusy when the host's budget, or this process's connections to the
+    host, have no room in time.
+    """
+    host = host_of(url)
+    with host_turn(governor_host or host, lease=governor_lease(kwargs), deadline=deadline), hold_host_slot(host, deadline):
+        return _send(method, url, False, retries, deadline, kwargs)
+
+def get(url, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+def head(url, **kwargs) -> httpx.Response:
+    return request("HEAD", url, **kwargs)
+
+@contextmanager
+def stream(method, url, *, retries=None, deadline=None, governor_host=None, **kwargs):
+    """Streamed request (iter_bytes()); the host's turn is held until the body is closed"""
+    host = host_of(url)
+    with host_turn(governor_host or host, lease=governor_lease(kwargs), deadline=deadline), hold_host_slot(host, deadline):
+        response = _send(method, url, True, retries, deadline, kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+
+# ---------------------------------------------------------------------------
+# Async client (ASGI views) - one per event loop, since pools are bound to their loop
+# ---------------------------------------------------------------------------
+
+_async_clients = weakref.WeakKeyDictionary()
+_async_host_slots = weakref.WeakKeyDictionary()
+
+def get_async_client() -> httpx.AsyncClient:
+    """Shared httpx.AsyncClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(**client_options())
+        _async_clients[loop] = client
+        _async_host_slots[loop] = {}
+    return client
+
+def async_host_slot(host) -> asyncio.Semaphore:
+    slots = _async_host_slots.setdefault(asyncio.get_running_loop(), {})
+    if host not in slots:
+        slots[host] = asyncio.Semaphore(get_max_connections_per_host())
+    return slots[host]
+
+@asynccontextmanager
+async def ahold_host_slot(host, deadline=None):
+    """Async twin of hold_host_slot"""
+    slot = async_host_slot(host)
+    wait = deadline.remaining() if deadline else get_default_timeout()
+    try:
+        await asyncio.wait_for(slot.acquire(), timeout=max(0, wait))
+    except asyncio.TimeoutError:
+        metrics.incr("http.host_busy")
+        raise HostBusy(f"No free connection to {host} within {max(0, wait):.1f}s")
+    try:
+        yield
+    finally:
+        slot.release()
+
+async def _asend(method, url, stream, retries, deadline, kwargs):
+    client = get_async_client()
+    retries = get_default_retries() if retries is None else retries
+    kwargs.setdefault("timeout", get_default_timeout())
+    follow_redirects = kwargs.pop("follow_redirects", True)
+
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        response, error = None, None
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream, follow_redirects=follow_redirects)
+        except httpx.HTTPError as e:
+            error = e
+        record_request(method, started, response, error)
+
+        delay = retry_delay(attempt)
+        if attempt < retries and should_retry(response, error) and can_wait(delay, deadline):
+            if response is not None:
+                await response.aclose()
+            attempt += 1
+            metrics.incr("http.retries")
+            logger.info(f"HTTP retry {attempt}/{retries} for {method} {url} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        if error is not None:
+            raise error
+        return response
+
+async def arequest(method, url, *, retries=None, deadline=None, governor_host=None, **kwargs) -> httpx.Response:
+    """Async twin of request"""
+    host = host_of(url)
+    async with ahost_turn(governor_host or host, lease=governor_lease(kwargs), deadline=deadline), ahold_host_slot(host, deadline):
+        return await _asend(method, url, False, retries, deadline, kwargs)
+
+async def aget(url, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+async def ahead(url, **kwargs) -> httpx.Response:
+    return await arequest("HEAD", url, **kwargs)
+
+@asynccontextmanager
+async def astream(method, url, *, retries=None, deadline=None, governor_host=None, **kwargs):
+    """Async twin of stream (aiter_bytes())"""
+    host = host_of(url)
+    async with ahost_turn(governor_host or host, lease=governor_lease(kwargs), deadline=deadline), ahold_host_slot(host, deadline):
+        response = await _asend(method, url, True, retries, deadline, kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
@@ -0,0 +1,100 @@
+# agentsuite/metrics.py - Lightweight counters for comparing code paths, buffered per process and flushed to the cache
+import logging
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from agentsuite.write_behind import BackgroundWorker
+
+logger = logging.getLogger('agentsuite')
+
+# One key per metric, so workers never rewrite each other's entries:
+#   METRICS_KEY_PREFIX + name   -> the counter (incremented by flushes)
+#   METRICS_SLOT_PREFIX + n     -> a metric name, written once by whoever claimed slot n
+METRICS_KEY_PREFIX = "agentsuite_metric_"
+METRICS_INDEXED_PREFIX = "agentsuite_metric_indexed_"
+METRICS_SLOT_PREFIX = "agentsuite_metric_slot_"
+METRICS_SEQ_KEY = "agentsuite_metric_slot_seq"
+FLUSH_INTERVAL = 10     # Seconds - also the most counts a crashed worker can lose
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_indexed = set()
+
+def get_flush_interval():
+    return getattr(settings, "AGENTSUITE_METRICS_FLUSH_INTERVAL", FLUSH_INTERVAL)
+
+def incr(name, amount=1):
+    """Add to a counter - in memory only, the background flusher writes it (never raises)"""
+    try:
+        with _pending_lock:
+            _pending[name] += amount
+        flusher.ensure_started()
+    except Exception as e:
+        logger.debug(f"Metric {name} not recorded: {str(e)}")
+
+def observe(name, value):
+    """Record one sample: keeps count and sum so averages can be derived"""
+    incr(f"{name}.count")
+    incr(f"{name}.sum", int(round(value)))
+
+def _index(name):
+    """Give the metric a slot so snapshot() can list it (once - add() decides which worker does it)"""
+    if name in _indexed:
+        return
+    if cache.add(f"{METRICS_INDEXED_PREFIX}{name}", True, timeout=None):
+        slot = 1 if cache.add(METRICS_SEQ_KEY, 1, timeout=None) else cache.incr(METRICS_SEQ_KEY)
+        cache.set(f"{METRICS_SLOT_PREFIX}{slot}", name, timeout=None)
+    _indexed.add(name)
+
+def flush():
+    """Add this process's pending counts to the shared counters - returns the number of metrics written"""
+    with _flush_lock:
+        with _pending_lock:
+            if not _pending:
+                return 0
+            batch = dict(_pending)
+            _pending.clear()
+
+        failed = {}
+        for name, amount in batch.items():
+            key = f"{METRICS_KEY_PREFIX}{name}"
+            try:
+                _index(name)
+                if not cache.add(key, amount, timeout=None):
+                    cache.incr(key, amount)
+            except Exception as e:
+                failed[name] = amount
+                logger.debug(f"Metric {name} not flushed: {str(e)}")
+
+        if failed:
+            # Keep them for the next flush
+            with _pending_lock:
+                _pending.update(failed)
+        return len(batch) - len(failed)
+
+flusher = BackgroundWorker("agentsuite-metrics", flush, get_flush_interval)
+
+def snapshot(prefix=""):
+    """Current value of every known metric (optionally filtered by prefix), this worker's pending counts included"""
+    flush()
+    slots = cache.get(METRICS_SEQ_KEY, 0)
+    found = cache.get_many([f"{METRICS_SLOT_PREFIX}{slot}" for slot in range(1, slots + 1)])
+    names = sorted(name for name in found.values() if name.startswith(prefix))
+    values = cache.get_many([f"{METRICS_KEY_PREFIX}{name}" for name in names])
+    result = {name: values.get(f"{METRICS_KEY_PREFIX}{name}", 0) for name in names}
+
+    # Derive averages for observed series
+    for name in names:
+        if name.endswith(".count") and result.get(name):
+            base = name[:-len(".count")]
+            result[f"{base}.avg"] = round(result.get(f"{base}.sum", 0) / result[name], 1)
+    return result
+
+def record_turn(backend, latency, api_calls, outcome="ok"):
+    """Per-turn latency and OpenAI request count, per conversation backend"""
+    incr(f"turns.{backend}.{outcome}")
+    observe(f"turns.{backend}.latency_ms", latency * 1000)
+    observe(f"turns.{backend}.api_calls", api_calls)
+    logger.info(f"TURN METRICS: backend={backend} outcome={outcome} latency={latency:.2f}s api_calls={api_calls}")
@@ -0,0 +1,155 @@
+# agentsuite/ratelimit.py - Sliding-window rate limits shared by every worker through the cache
+import logging
+import math
+import time
+from functools import wraps
+from asgiref.sync import sync_to_async, iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from agentsuite import metrics
+
+logger = logging.getLogger('agentsuite')
+
+RATE_LIMIT_PREFIX = "ratelimit_"
+LIMITED_MESSAGE = "Too many requests. Please wait a moment before trying again."
+
+def get_cache():
+    """AGENTSUITE_RATELIMIT_CACHE names the cache alias - it must be shared by all workers to limit across them"""
+    return caches[getattr(settings, "AGENTSUITE_RATELIMIT_CACHE", "default")]
+
+def client_ip(request):
+    """Client IP address (first X-Forwarded-For hop behind the proxy)"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+def _count(store, key, window):
+    """Atomically add one hit to the window's counter and return the new count"""
+    if store.add(key, 1, timeout=window * 2):
+        return 1
+    try:
+        return store.incr(key)
+    except ValueError:
+        # The counter expired between add and incr
+        store.add(key, 1, timeout=window * 2)
+        return 1
+
+def hit(scope, ident, limit, window):
+    """
+    Record one request for ident in scope. Returns (allowed, retry_after seconds).
+    Sliding window: this window's count plus the previous window's count weighted by
+    how much of it still overlaps the last `window` seconds. Rejected hits are not counted.
+    """
+    store = get_cache()
+    now = time.time()
+    index = int(now // window)
+    elapsed = (now % window) / window
+    key = f"{RATE_LIMIT_PREFIX}{scope}_{ident}_{index}"
+
+    current = _count(store, key, window)
+    previous = store.get(f"{RATE_LIMIT_PREFIX}{scope}_{ident}_{index - 1}", 0)
+    if previous * (1 - elapsed) + current <= limit:
+        return True, 0
+
+    try:
+        store.decr(key)
+    except ValueError:
+        pass
+    if current > limit or not previous:
+        retry_after = window * (1 - elapsed)
+    else:
+        # Wait until enough of the previous window has slid out
+        retry_after = window * (1 - (limit - current) / previous - elapsed)
+    return False, max(1, math.ceil(retry_after))
+
+def limited_response(retry_after):
+    response = JsonResponse({'error': LIMITED_MESSAGE}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def check(request, scope, limit, window):
+    """None when the request may proceed, else the 429 response"""
+    ip = client_ip(request)
+    allowed, retry_after = hit(scope, ip, limit, window)
+    if allowed:
+        return None
+    metrics.incr("ratelimit.limited")
+    logger.warning(f"Rate limit exceeded for {ip} on {scope} (retry in {retry_after}s)")
+    return limited_response(retry_after)
+
+def rate_limit(max_requests=10, window=60, scope=None):
+    """
+    Per-IP rate limiting decorator (works on sync and async views). Views sharing a
+    scope share one budget; by default each view has its own.
+    """
+    def decorator(view_func):
+        name = scope or view_func.__name__
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                limited = await sync_to_async(check, thread_sensitive=False)(request, name, max_requests, window)
+                if limited:
+                    return limited
+                return await view_func(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limited = check(request, name, max_requests, window)
+            if limited:
+                return limited
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def route_limit(path, method):
+    """
+    (prefix, limit) for the longest AGENTSUITE_RATE_LIMITS prefix matching path, or None.
+    Each entry is {"requests": n, "window": seconds, "methods": [...]}; None exempts the prefix.
+    """
+    routes = getattr(settings, "AGENTSUITE_RATE_LIMITS", {})
+    for prefix in sorted(routes, key=len, reverse=True):
+        if path.startswith(prefix):
+            limit = routes[prefix]
+            if limit is None:
+                return None
+            methods = limit.get("methods")
+            if methods and method not in methods:
+                return None
+            return prefix, limit
+    return None
+
+def check_route(request):
+    matched = route_limit(request.path, request.method)
+    if matched is None:
+        return None
+    prefix, limit = matched
+    return check(request, f"route{prefix.replace('/', '_')}", limit["requests"], limit["window"])
+
+class RateLimitMiddleware:
+    """Applies AGENTSUITE_RATE_LIMITS to apps whose views carry no @rate_limit of their own"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        limited = check_route(request)
+        if limited:
+            return limited
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        limited = await sync_to_async(check_route, thread_sensitive=False)(request)
+        if limited:
+            return limited
+        return await self.get_response(request)
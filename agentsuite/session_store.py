@@ -0,0 +1,112 @@
+# agentsuite/session_store.py - Session engine: compact payloads in the shared cache, written only when changed
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+from django.core.cache.backends.base import InvalidCacheKey
+
+logger = logging.getLogger('agentsuite')
+
+KEY_PREFIX = "agentsuite_session_"
+SESSION_HISTORY_MAX = 20
+
+def get_history_limit():
+    """Most history entries a stored conversation keeps (older ones are dropped, oldest first)"""
+    return getattr(settings, "AGENTSUITE_SESSION_HISTORY_MAX", SESSION_HISTORY_MAX)
+
+def cap_histories(data):
+    """Ring-buffer every {"history": [...]} value in the session, counting dropped entries in history_offset"""
+    limit = get_history_limit()
+    for value in data.values():
+        if not isinstance(value, dict) or not isinstance(value.get("history"), list):
+            continue
+        dropped = len(value["history"]) - limit
+        if dropped > 0:
+            value["history"] = value["history"][-limit:]
+            if "history_offset" in value:
+                value["history_offset"] += dropped
+
+def encode_payload(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+def decode_payload(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+class SessionStore(CacheSessionStore):
+    """
+    Sessions in the shared cache as zlib-compressed compact JSON. save() skips the write
+    when the encoded session is byte-for-byte what was loaded, and a session that is only
+    read gets its expiry pushed out at most every quarter of SESSION_COOKIE_AGE.
+    """
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._stored_blob = None
+        self._refresh_due = False
+        super().__init__(session_key)
+
+    def refresh_interval(self, data):
+        # Expiry from the decoded payload - self.get() here would re-enter load()
+        return self.get_expiry_age(expiry=data.get("_session_expiry")) / 4
+
+    def load(self):
+        try:
+            stored = self._cache.get(self.cache_key)
+        except (InvalidCacheKey, sqlite3.Error) as e:
+            logger.warning(f"Session cache read failed: {str(e)}")
+            stored = None
+        if stored is None:
+            self._session_key = None
+            return {}
+        try:
+            saved_at, blob = stored
+            data = decode_payload(blob)
+        except (TypeError, ValueError, zlib.error) as e:
+            logger.warning(f"Discarding undecodable session: {str(e)}")
+            self._session_key = None
+            return {}
+
+        self._stored_blob = blob
+        if time.time() - saved_at > self.refresh_interval(data):
+            # Only read this request - still save once so an active session does not expire
+            self._refresh_due = True
+            self.modified = True
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        cap_histories(data)
+        blob = encode_payload(data)
+
+        if must_create:
+            func = self._cache.add
+        elif blob == self._stored_blob and not self._refresh_due:
+            logger.debug(f"Session unchanged - write skipped ({len(blob)} bytes)")
+            return
+        elif self._cache.has_key(self.cache_key):
+            func = self._cache.set
+        else:
+            raise UpdateError
+
+        result = func(self.cache_key, (time.time(), blob), self.get_expiry_age())
+        if must_create and not result:
+            raise CreateError
+        self._stored_blob = blob
+        self._refresh_due = False
+
+    # The cache engine's async methods would bypass the encoding above
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+    async def acreate(self):
+        return await sync_to_async(self.create)()
@@ -66,6 +66,7 @@ MIDDLEWARE = [
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # ✅ required before CommonMiddleware
     "django.middleware.common.CommonMiddleware",
+    "agentsuite.ratelimit.RateLimitMiddleware",  # ✅ after CORS so 429s still carry CORS headers
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
@@ -105,6 +106,28 @@ DATABASES = {
     }
 }
 
+# ✅ CACHE: per-worker LRU in front of a SQLite file shared by all workers (agentsuite.cache), so
+# tool results, rate-limit counters and job state are common to every gunicorn worker and survive reloads
+CACHES = {
+    "default": {
+        "BACKEND": "agentsuite.cache.TieredCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": 1000,
+            "L1_TTL": 10,
+            # Only read-mostly results go in the L1 - claims, counters and job state are always read shared
+            "L1_PREFIXES": ["tool_"],
+            "STATS_PREFIXES": ["tool_speed_", "tool_plugins_", "ratelimit_", "host_governor_", "speed_job_", "agentsuite_metric_"],
+        },
+    },
+    "shared": {
+        "BACKEND": "agentsuite.cache.SQLiteCache",
+        "LOCATION": os.getenv("AGENTSUITE_CACHE_PATH", str(BASE_DIR / "cache.sqlite3")),
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 50000},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -189,6 +212,34 @@ if not all([EMAIL_HOST_USER, EMAIL_HOST_PASSWORD]):
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
 
+# ✅ WEBDOCTOR CONVERSATION BACKEND: "assistants" (threads + runs) or "chat" (single Chat Completions request)
+WEBDOCTOR_AGENT_BACKEND = os.getenv("WEBDOCTOR_AGENT_BACKEND", "assistants")
+WEBDOCTOR_CHAT_MODEL = os.getenv("WEBDOCTOR_CHAT_MODEL", "gpt-4o")
+# Seconds a chat turn may take before Shirley gives up and answers with a fallback (widget aborts at 30s)
+WEBDOCTOR_TURN_DEADLINE = float(os.getenv("WEBDOCTOR_TURN_DEADLINE", "25"))
+
+# Shared outbound HTTP client (agentsuite.http_client)
+AGENTSUITE_HTTP_TIMEOUT = float(os.getenv("AGENTSUITE_HTTP_TIMEOUT", "15"))
+AGENTSUITE_HTTP_RETRIES = int(os.getenv("AGENTSUITE_HTTP_RETRIES", "2"))
+AGENTSUITE_HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("AGENTSUITE_HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+# Politeness budgets per scanned site, shared by all workers (agentsuite.host_governor);
+# add entries keyed by host name to override "default" for a specific site
+AGENTSUITE_HOST_BUDGETS = {
+    "default": {"concurrency": 3, "rate": 5, "max_wait": 10},
+}
+# Per-IP request limits by URL prefix (agentsuite.ratelimit.RateLimitMiddleware) for apps
+# without their own @rate_limit; the longest matching prefix wins and None exempts it
+AGENTSUITE_RATELIMIT_CACHE = os.getenv("AGENTSUITE_RATELIMIT_CACHE", "default")
+AGENTSUITE_RATE_LIMITS = {
+    "/content-strategy/": {"requests": 10, "window": 60, "methods": ["POST"]},
+    "/tools/api/": {"requests": 20, "window": 60},
+    "/barista-assistant/api/": {"requests": 30, "window": 60},
+    "/api/": {"requests": 30, "window": 60},
+    # Stripe retries webhooks in bursts from a few IPs
+    "/barista-assistant/api/webhook/": None,
+    "/api/webhook/": None,
+}
+
 CORS_ALLOWED_ORIGINS = [
     "https://showcase.techwithwayne.com",
     "https://apps.techwithwayne.com",
@@ -211,8 +262,11 @@ SECURE_HSTS_SECONDS = 31536000  # 1 year
 SECURE_SSL_REDIRECT = not DEBUG  # redirect only if in prod
 
 # ✅ SESSION CONFIGURATION
+# Compact sessions in the shared cache, written only when they change (agentsuite.session_store)
+SESSION_ENGINE = "agentsuite.session_store"
 SESSION_COOKIE_AGE = 3600  # 1 hour
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False  # the engine refreshes expiry of read-only sessions itself
+AGENTSUITE_SESSION_HISTORY_MAX = int(os.getenv("AGENTSUITE_SESSION_HISTORY_MAX", "20"))
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 # ✅ Logging for production diagnostics
@@ -251,6 +305,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'agentsuite': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': True,
+        },
         'django': {
             'handlers': ['file'],
             'level': 'ERROR',
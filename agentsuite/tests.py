@@ -0,0 +1,306 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+import httpx
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.test import SimpleTestCase, override_settings
+from django.urls import path
+from agentsuite import host_governor, http_client, metrics, ratelimit
+from agentsuite.session_store import SessionStore
+
+def count_visit(request):
+    request.session["visits"] = request.session.get("visits", 0) + 1
+    return JsonResponse({"visits": request.session["visits"]})
+
+urlpatterns = [
+    path("visit/", count_visit),
+]
+
+class SharedCacheTestCase(SimpleTestCase):
+    """Runs against the real cache stack, on a throwaway SQLite file"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(CACHES={
+            "default": {
+                "BACKEND": "agentsuite.cache.TieredCache",
+                "LOCATION": "shared",
+                "OPTIONS": {"L1_PREFIXES": ["tool_"]},
+            },
+            "shared": {
+                "BACKEND": "agentsuite.cache.SQLiteCache",
+                "LOCATION": f"{directory}/cache.sqlite3",
+            },
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # The per-process L1 tier outlives the SQLite file - empty it for the next test
+        self.addCleanup(lambda: caches["default"].clear())
+
+class SessionStoreTests(SharedCacheTestCase):
+
+    def test_round_trip_keeps_session_key(self):
+        session = SessionStore()
+        session["conversation"] = {"history": [], "stage": "initial"}
+        session.save()
+        key = session.session_key
+
+        reloaded = SessionStore(key)
+        self.assertEqual(reloaded["conversation"]["stage"], "initial")
+        reloaded["conversation"]["stage"] = "clarifying"
+        reloaded.modified = True
+        reloaded.save()
+
+        self.assertEqual(reloaded.session_key, key)
+        self.assertEqual(SessionStore(key)["conversation"]["stage"], "clarifying")
+
+    def test_unchanged_session_is_not_rewritten(self):
+        session = SessionStore()
+        session["visits"] = 1
+        session.save()
+
+        reloaded = SessionStore(session.session_key)
+        reloaded["visits"] = 1
+        with mock.patch.object(caches["default"], "set") as cache_set:
+            reloaded.save()
+        cache_set.assert_not_called()
+
+    def test_history_is_capped_as_ring_buffer(self):
+        session = SessionStore()
+        session["conversation"] = {"history": list(range(30)), "history_offset": 2}
+        with self.settings(AGENTSUITE_SESSION_HISTORY_MAX=20):
+            session.save()
+
+        stored = SessionStore(session.session_key)["conversation"]
+        self.assertEqual(stored["history"], list(range(10, 30)))
+        self.assertEqual(stored["history_offset"], 12)
+
+    @override_settings(ROOT_URLCONF=__name__, SESSION_ENGINE="agentsuite.session_store")
+    def test_session_cookie_is_stable_across_requests(self):
+        cookies = set()
+        for visit in range(1, 5):
+            response = self.client.post("/visit/")
+            self.assertEqual(response.json()["visits"], visit)
+            cookies.add(self.client.cookies["sessionid"].value)
+        self.assertEqual(len(cookies), 1)
+
+class MetricsTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics._pending.clear()
+        metrics._indexed.clear()
+        patcher = mock.patch.object(metrics.flusher, "ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_increments_stay_in_process_until_flushed(self):
+        with mock.patch.object(caches["default"], "incr") as cache_incr, \
+                mock.patch.object(caches["default"], "add") as cache_add:
+            for _ in range(50):
+                metrics.incr("turns.chat.ok")
+        cache_incr.assert_not_called()
+        cache_add.assert_not_called()
+
+        self.assertEqual(metrics.flush(), 1)
+        self.assertEqual(metrics.snapshot(), {"turns.chat.ok": 50})
+
+    def test_flushes_from_several_workers_add_up(self):
+        metrics.observe("latency_ms", 100)
+        metrics.flush()
+        metrics._indexed.clear()  # A second worker has not indexed anything yet
+        metrics.observe("latency_ms", 300)
+        metrics.incr("tool.hits")
+
+        self.assertEqual(metrics.snapshot("latency"), {"latency_ms.count": 2, "latency_ms.sum": 400, "latency_ms.avg": 200.0})
+        self.assertEqual(metrics.snapshot()["tool.hits"], 1)
+
+@override_settings(AGENTSUITE_HOST_BUDGETS={"example.com": {"concurrency": 1, "rate": 100, "max_wait": 0.3}})
+class HostGovernorTests(SharedCacheTestCase):
+
+    def test_busy_host_backs_off_then_gives_up(self):
+        with mock.patch.object(host_governor, "_try_claim_slot", wraps=host_governor._try_claim_slot) as claim:
+            with host_governor.host_turn("example.com"):
+                with self.assertRaises(host_governor.HostBusy):
+                    with host_governor.host_turn("example.com"):
+                        pass
+        # Backing off between attempts, not spinning on the cache
+        self.assertLessEqual(claim.call_count, 8)
+
+        with host_governor.host_turn("example.com"):
+            pass  # The slot was released
+
+    def test_backoff_grows_and_stops_at_the_deadline(self):
+        far = host_governor.time.monotonic() + 60
+        self.assertLessEqual(host_governor._backoff(0, far), host_governor.BACKOFF_BASE)
+        self.assertGreaterEqual(host_governor._backoff(5, far), host_governor.BACKOFF_BASE * 16)
+        self.assertLessEqual(host_governor._backoff(20, far), host_governor.BACKOFF_MAX)
+        self.assertEqual(host_governor._backoff(3, host_governor.time.monotonic() - 1), 0.0)
+
+class HttpClientRetryTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.statuses = []
+        self.attempts = 0
+        client = httpx.Client(transport=httpx.MockTransport(self.respond))
+        self.addCleanup(client.close)
+        for patcher in (mock.patch.object(http_client, "_client", client),
+                        mock.patch.object(http_client, "retry_delay", return_value=0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def respond(self, request):
+        self.attempts += 1
+        status = self.statuses.pop(0)
+        if status is None:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(status, request=request)
+
+    def test_unavailable_host_is_retried(self):
+        self.statuses = [503, None, 200]
+        response = http_client.get("https://retry.example/")
+        self.assertEqual((response.status_code, self.attempts), (200, 3))
+        self.assertIsNotNone(http_client.time_to_headers(response))
+
+    def test_server_errors_and_spent_retries_are_not_retried(self):
+        self.statuses = [500]
+        self.assertEqual(http_client.get("https://retry.example/").status_code, 500)
+
+        self.statuses = [None, None]
+        with self.assertRaises(httpx.ConnectError):
+            http_client.get("https://retry.example/", retries=1)
+        self.assertEqual(self.attempts, 3)
+
+    def test_no_retry_past_the_deadline(self):
+        self.statuses = [503, 200]
+        deadline = mock.Mock(remaining=mock.Mock(return_value=0))
+        self.assertEqual(http_client.get("https://retry.example/", deadline=deadline).status_code, 503)
+        self.assertEqual(self.attempts, 1)
+
+@override_settings(AGENTSUITE_HTTP_MAX_CONNECTIONS_PER_HOST=1, AGENTSUITE_HTTP_TIMEOUT=0.1)
+class HostSlotTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(http_client._host_slots.pop, "slots.example", None)
+
+    def test_full_host_raises_busy_instead_of_blocking(self):
+        with http_client.hold_host_slot("slots.example"):
+            started = time.monotonic()
+            with self.assertRaises(http_client.HostBusy):
+                with http_client.hold_host_slot("slots.example"):
+                    pass
+            self.assertLess(time.monotonic() - started, 1)
+
+        with http_client.hold_host_slot("slots.example"):
+            pass  # The slot was released
+
+    def test_async_slot_waits_no_longer_than_the_deadline(self):
+        deadline = mock.Mock(remaining=mock.Mock(return_value=0.05))
+
+        async def contend():
+            async with http_client.ahold_host_slot("slots.example"):
+                with self.assertRaises(http_client.HostBusy):
+                    async with http_client.ahold_host_slot("slots.example", deadline):
+                        pass
+            async with http_client.ahold_host_slot("slots.example", deadline):
+                return True
+
+        self.assertTrue(asyncio.run(contend()))
+
+class SQLiteCacheTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = caches["shared"]
+
+    def later(self, seconds):
+        return mock.patch("agentsuite.cache.time.time", return_value=time.time() + seconds)
+
+    def test_add_claims_a_key_once(self):
+        self.assertTrue(self.cache.add("claim", "first"))
+        self.assertFalse(self.cache.add("claim", "second"))
+        self.assertEqual(self.cache.get("claim"), "first")
+
+    def test_add_takes_over_an_expired_key(self):
+        self.cache.add("claim", "first", timeout=10)
+        with self.later(11):
+            self.assertIsNone(self.cache.get("claim"))
+            self.assertTrue(self.cache.add("claim", "second", timeout=10))
+            self.assertEqual(self.cache.get("claim"), "second")
+
+    def test_entries_expire_and_none_timeout_does_not(self):
+        self.cache.set("short", 1, timeout=5)
+        self.cache.set("forever", 2, timeout=None)
+        with self.later(3600):
+            self.assertFalse(self.cache.has_key("short"))
+            self.assertEqual(self.cache.get_many(["short", "forever"]), {"forever": 2})
+
+    def test_incr_needs_a_live_key(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr("counter")
+        self.cache.set("counter", 1, timeout=5)
+        with self.later(6), self.assertRaises(ValueError):
+            self.cache.incr("counter")
+
+    def test_concurrent_incr_loses_no_counts(self):
+        self.cache.add("counter", 0, timeout=None)
+
+        def bump():
+            for _ in range(50):
+                self.cache.incr("counter")
+
+        workers = [threading.Thread(target=bump) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get("counter"), 400)
+
+class RateLimitWindowTests(SharedCacheTestCase):
+    window_start = 60 * 1_000_000.0
+
+    def hit_at(self, offset, limit=4, window=60):
+        with mock.patch("agentsuite.ratelimit.time.time", return_value=self.window_start + offset):
+            return ratelimit.hit("test", "10.0.0.1", limit, window)
+
+    def test_limit_within_one_window(self):
+        for _ in range(4):
+            self.assertEqual(self.hit_at(0), (True, 0))
+        self.assertEqual(self.hit_at(0), (False, 60))
+        self.assertEqual(self.hit_at(45), (False, 15))
+
+    def test_previous_window_counts_by_its_remaining_overlap(self):
+        for _ in range(4):
+            self.hit_at(0)
+        # Half-way into the next window the previous 4 weigh as 2
+        self.assertEqual(self.hit_at(90), (True, 0))
+        self.assertEqual(self.hit_at(90), (True, 0))
+        # 4 * 0.5 + 3 > 4 - allowed again once a quarter more of the old window has slid out
+        self.assertEqual(self.hit_at(90), (False, 15))
+        self.assertEqual(self.hit_at(105), (True, 0))
+
+    def test_rejected_hits_are_not_counted(self):
+        for _ in range(4):
+            self.hit_at(0)
+        for _ in range(10):
+            self.assertFalse(self.hit_at(30)[0])
+        # The previous window still holds 4, weighted 0.75 - room for exactly one more
+        self.assertEqual(self.hit_at(75), (True, 0))
+        self.assertFalse(self.hit_at(75)[0])
+
+    def test_two_windows_later_the_budget_is_whole(self):
+        for _ in range(4):
+            self.hit_at(0)
+        for _ in range(4):
+            self.assertEqual(self.hit_at(120), (True, 0))
+
+    def test_fractional_rates_use_a_longer_window(self):
+        self.assertEqual(host_governor.rate_window(5), (1, 5))
+        self.assertEqual(host_governor.rate_window(0.5), (2, 1))
+        self.assertEqual(host_governor.rate_window(0.3), (4, 1))
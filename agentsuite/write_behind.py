@@ -0,0 +1,54 @@
+# agentsuite/write_behind.py - Per-process background worker for write-behind buffers and periodic jobs
+import atexit
+import logging
+import threading
+from django.db import connection as db_connection
+
+logger = logging.getLogger('agentsuite')
+
+class BackgroundWorker:
+    """
+    One daemon thread per process that runs job() every interval() seconds, or as soon
+    as wake() is called. With flush_at_exit, job() runs once more at interpreter exit so
+    graceful worker restarts (gunicorn max_requests, reloads) write what is still pending.
+    """
+
+    def __init__(self, name, job, interval, flush_at_exit=True):
+        self.name = name
+        self.job = job
+        self.interval = interval      # Callable - settings are read on every wait
+        self.wake_requested = threading.Event()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        if flush_at_exit:
+            atexit.register(self.run_at_exit)
+
+    def wake(self):
+        """Run the job now instead of at the end of the current interval"""
+        self.wake_requested.set()
+
+    def ensure_started(self):
+        """Start the thread once per process (again if it died)"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self.thread.start()
+
+    def _loop(self):
+        while True:
+            self.wake_requested.wait(self.interval())
+            self.wake_requested.clear()
+            try:
+                self.job()
+            except Exception as e:
+                logger.error(f"{self.name}: background job failed: {str(e)}")
+            finally:
+                db_connection.close()
+
+    def run_at_exit(self):
+        try:
+            self.job()
+        except Exception as e:
+            logger.error(f"{self.name}: final flush failed: {str(e)}")
@@ -2,7 +2,7 @@
 # Correct admin configuration using actual field names
 
 from django.contrib import admin
-from .models import Conversation, Message, UserInteraction
+from .models import Conversation, Message, UserInteraction, SpeedMeasurement
 
 class MessageInline(admin.TabularInline):
     model = Message
@@ -39,4 +39,11 @@ class UserInteractionAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         if obj:  # Editing an existing object
             return self.readonly_fields + ['issue_description']
-        return self.readonly_fields
\ No newline at end of file
+        return self.readonly_fields
+
+@admin.register(SpeedMeasurement)
+class SpeedMeasurementAdmin(admin.ModelAdmin):
+    list_display = ['id', 'url', 'strategy', 'score', 'lcp_ms', 'ttfb_ms', 'measured_at']
+    list_filter = ['strategy', 'measured_at']
+    ordering = ['-measured_at']
+    search_fields = ['url', 'url_hash']
@@ -1,21 +1,61 @@
 import os
 import json
 import re
-import requests
+import httpx
 import time
-import hashlib
 import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import lru_cache
 from typing import Dict, Any, Optional
 from django.conf import settings
-from django.core.mail import send_mail
-from django.core.cache import cache
+from django.db import transaction, connection as db_connection
 from django.utils import timezone
-from openai import OpenAI
-from webdoctor.models import UserInteraction, DiagnosticReport
+from openai import OpenAI, DefaultHttpxClient, NotFoundError, BadRequestError
+from agentsuite import http_client
+from webdoctor.models import UserInteraction
+from webdoctor.outbox import enqueue_report
+from agentsuite import metrics
+from webdoctor.summary import record_prompt_size
+from webdoctor.deadline import DeadlineExceeded, bounded_timeout
+from webdoctor.jobs import measure_speed_shared, get_speed_job_wait
+from webdoctor.tool_cache import speed_cache, plugin_cache
+from webdoctor.plugin_detector import ComponentScanner
+from webdoctor.page_weight import estimate_page_weight, get_estimate_budget
+from webdoctor.speed_history import record_measurements, speed_history
 
 logger = logging.getLogger('webdoctor')
 
+# Per-thread / per-task OpenAI request counter (see count_api_calls)
+_api_call_counter = ContextVar("webdoctor_api_call_counter", default=None)
+
+def _count_api_request(request):
+    counter = _api_call_counter.get()
+    if counter is not None:
+        counter["calls"] += 1
+
+async def _acount_api_request(request):
+    _count_api_request(request)
+
+@contextmanager
+def count_api_calls():
+    """Count the OpenAI HTTP requests (retries included) made by this thread or task"""
+    counter = {"calls": 0}
+    token = _api_call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _api_call_counter.reset(token)
+
+def get_openai_api_key():
+    api_key = os.getenv("OPENAI_API_KEY", getattr(settings, "OPENAI_API_KEY", None))
+    if not api_key:
+        raise ValueError("No OpenAI API key found")
+    return api_key
+
 class OpenAIClientManager:
     """Singleton OpenAI client manager"""
     _instance = None
@@ -28,14 +68,11 @@ class OpenAIClientManager:
     
     def get_client(self):
         if self._client is None:
-            api_key = os.getenv("OPENAI_API_KEY", getattr(settings, "OPENAI_API_KEY", None))
-            if not api_key:
-                raise ValueError("No OpenAI API key found")
-            
             self._client = OpenAI(
-                api_key=api_key,
+                api_key=get_openai_api_key(),
                 timeout=30.0,
-                max_retries=3
+                max_retries=3,
+                http_client=DefaultHttpxClient(event_hooks={"request": [_count_api_request]})
             )
             logger.info("OpenAI client initialized successfully")
         
@@ -48,6 +85,15 @@ def get_openai_client():
     """Get cached OpenAI client"""
     return client_manager.get_client()
 
+def bounded_client(client, deadline):
+    """
+    Client whose next request cannot outlive the turn deadline. Retries are
+    disabled under a deadline - the budget is shorter than the retry backoff.
+    """
+    if deadline is None:
+        return client
+    return client.with_options(timeout=deadline.timeout(30.0), max_retries=0)
+
 # ENHANCED TOOL DEFINITIONS WITH VALIDATION
 send_email_diagnostic_tool = {
     "type": "function",
@@ -106,7 +152,7 @@ measure_speed_tool = {
     "type": "function",
     "function": {
         "name": "measure_speed",
-        "description": "Check a website's performance using Google's PageSpeed API.",
+        "description": "Check a website's mobile and desktop performance using Google's PageSpeed API. Results include recent past scores for trend questions.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -147,28 +193,7 @@ SHIRLEY_TOOLS = [
     get_plugin_list_tool
 ]
 
-# ENHANCED ASSISTANT MANAGEMENT
-@lru_cache(maxsize=1)
-def get_assistant_id():
-    """Cached assistant ID retrieval"""
-    assistant_id = os.getenv("OPENAI_ASSISTANT_ID", getattr(settings, "OPENAI_ASSISTANT_ID", None))
-    
-    if not assistant_id:
-        logger.info("Creating new Shirley assistant...")
-        assistant_id = create_shirley_assistant()
-        logger.info(f"Created assistant: {assistant_id}")
-    
-    return assistant_id
-
-def create_shirley_assistant():
-    """Create assistant with SESSION-ONLY instructions (NO DATABASE DEPENDENCIES)"""
-    client = get_openai_client()
-    
-    try:
-        assistant = client.beta.assistants.create(
-            name="Shirley - WebDoctor AI",
-            model="gpt-4o",
-            instructions="""
+SHIRLEY_INSTRUCTIONS = """
 You are Shirley, a friendly website doctor. 
 
 CRITICAL: You are a SESSION-BASED assistant. You have NO memory of previous conversations or database records. Each conversation is completely independent and starts fresh.
@@ -210,7 +235,30 @@ STAGE PROGRESSION RULES:
 
 NEVER SKIP THE CLARIFYING STAGE. NEVER ASSUME YOU KNOW ENOUGH.
 ALWAYS ASK AT LEAST 2 QUESTIONS BEFORE OFFERING REPORTS.
-            """,
+"""
+
+# ENHANCED ASSISTANT MANAGEMENT
+@lru_cache(maxsize=1)
+def get_assistant_id():
+    """Cached assistant ID retrieval"""
+    assistant_id = os.getenv("OPENAI_ASSISTANT_ID", getattr(settings, "OPENAI_ASSISTANT_ID", None))
+    
+    if not assistant_id:
+        logger.info("Creating new Shirley assistant...")
+        assistant_id = create_shirley_assistant()
+        logger.info(f"Created assistant: {assistant_id}")
+    
+    return assistant_id
+
+def create_shirley_assistant():
+    """Create assistant with SESSION-ONLY instructions (NO DATABASE DEPENDENCIES)"""
+    client = get_openai_client()
+    
+    try:
+        assistant = client.beta.assistants.create(
+            name="Shirley - WebDoctor AI",
+            model="gpt-4o",
+            instructions=SHIRLEY_INSTRUCTIONS,
             tools=SHIRLEY_TOOLS,
             metadata={"project": "webdoctor", "version": "4.0", "database_independent": "true"},
             temperature=0.3,
@@ -316,18 +364,22 @@ def validate_tool_arguments(function_name: str, arguments: Dict[str, Any]) -> Di
     
     return arguments
 
-def handle_tool_call(tool_call) -> Dict[str, Any]:
+def parse_tool_arguments(tool_call) -> Dict[str, Any]:
+    """Decode and validate a tool call's JSON arguments (raises JSONDecodeError/ValueError)"""
+    raw_args = tool_call.function.arguments.strip() if tool_call.function.arguments else ""
+    if not raw_args:
+        raise json.JSONDecodeError("Empty tool_call.function.arguments", doc="", pos=0)
+
+    arguments = json.loads(raw_args)
+    return validate_tool_arguments(tool_call.function.name, arguments)
+
+def handle_tool_call(tool_call, deadline=None) -> Dict[str, Any]:
     """Enhanced tool call handler with validation and hardened JSON parsing"""
     function_name = tool_call.function.name
 
     try:
         # Safely extract and validate arguments
-        raw_args = tool_call.function.arguments.strip() if tool_call.function.arguments else ""
-        if not raw_args:
-            raise json.JSONDecodeError("Empty tool_call.function.arguments", doc="", pos=0)
-
-        arguments = json.loads(raw_args)
-        validated_args = validate_tool_arguments(function_name, arguments)
+        validated_args = parse_tool_arguments(tool_call)
 
         logger.info(f"Executing tool: {function_name}")
 
@@ -337,9 +389,10 @@ def handle_tool_call(tool_call) -> Dict[str, Any]:
         elif function_name == "recommend_fixes":
             return handle_recommend_fixes(validated_args)
         elif function_name == "measure_speed":
-            return handle_measure_speed(validated_args)
+            # Shared background job - concurrent requests for the same site run one test
+            return measure_speed_shared(validated_args["url"], bounded_timeout(deadline, get_speed_job_wait()))
         elif function_name == "get_plugin_list":
-            return handle_get_plugin_list(validated_args)
+            return handle_get_plugin_list(validated_args, deadline=deadline)
         else:
             logger.error(f"Unknown function: {function_name}")
             return {"error": f"Unknown function: {function_name}"}
@@ -367,14 +420,33 @@ def handle_send_email_diagnostic(arguments: Dict[str, str]) -> Dict[str, Any]:
     
     try:
         # Create interaction record - THIS IS THE ONLY DATABASE WRITE DURING CONVERSATION
-        interaction = UserInteraction.objects.create(
-            name=name,
-            email=email,
-            issue_description=issue
-        )
-        
-        # Generate comprehensive report
-        report_content = f"""
+        with transaction.atomic():
+            interaction = UserInteraction.objects.create(
+                name=name,
+                email=email,
+                issue_description=issue
+            )
+            enqueue_report(
+                interaction, email, issue, diagnostic_report_content(name, issue),
+                subject=f'Website Diagnostic Report for {name}',
+            )
+        logger.info(f"DATABASE INTERACTION: Report queued for {email}")
+
+        return {
+            "message": "Great! Your diagnostic report is on its way to your email. Check your inbox (and spam folder) in the next few minutes.",
+            "success": True
+        }
+
+    except Exception as e:
+        logger.error(f"Database error for {email}: {str(e)}")
+        return {
+            "error": "I'm having trouble processing your request right now. Please try again in a moment.",
+            "success": False
+        }
+
+def diagnostic_report_content(name: str, issue: str) -> str:
+    """Body of the emailed diagnostic report"""
+    return f"""
 Website Diagnostic Report for {name}
 
 Issue Summary: {issue}
@@ -406,46 +478,6 @@ Shirley - Your Website Doctor
 TechWithWayne Digital Solutions
         """.strip()
         
-        # Save report
-        report = DiagnosticReport.objects.create(
-            user_interaction=interaction,
-            user_email=email,
-            issue_details=issue,
-            report_content=report_content
-        )
-        
-        # Send email with error handling
-        try:
-            send_mail(
-                subject=f'Website Diagnostic Report for {name}',
-                message=report_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[email],
-                fail_silently=False,
-            )
-            
-            report.mark_email_sent()
-            logger.info(f"DATABASE INTERACTION: Email sent successfully to {email}")
-            
-            return {
-                "message": "Great! Your diagnostic report has been sent to your email. Check your inbox (and spam folder) in the next few minutes.",
-                "success": True
-            }
-            
-        except Exception as email_error:
-            logger.error(f"Email failed to {email}: {str(email_error)}")
-            return {
-                "error": "I created your report but had trouble sending the email. Please check your email address and try again.",
-                "success": False
-            }
-            
-    except Exception as e:
-        logger.error(f"Database error for {email}: {str(e)}")
-        return {
-            "error": "I'm having trouble processing your request right now. Please try again in a moment.",
-            "success": False
-        }
-
 def handle_recommend_fixes(arguments: Dict[str, str]) -> Dict[str, Any]:
     """Enhanced fix recommendations - NO DATABASE DEPENDENCY"""
     category = arguments["category"]
@@ -530,171 +562,248 @@ def handle_recommend_fixes(arguments: Dict[str, str]) -> Dict[str, Any]:
         "count": len(recommendations)
     }
 
-def handle_measure_speed(arguments: Dict[str, str]) -> Dict[str, Any]:
-    """Enhanced speed measurement with caching - NO DATABASE DEPENDENCY"""
-    url = arguments["url"]
-    
-    # Check cache first
-    cache_key = f"speed_test_{hashlib.md5(url.encode()).hexdigest()}"
-    cached_result = cache.get(cache_key)
-    if cached_result:
-        logger.info(f"Using cached speed data for {url} (NO DATABASE)")
-        return cached_result
-    
+PAGESPEED_API_URL = "https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
+PLUGIN_SCAN_CHUNK_SIZE = 16384
+PLUGIN_SCAN_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; WebDoctor/1.0; +https://techwithwayne.com)'
+}
+
+# Fields repeated for the secondary strategy in a speed result
+PAGESPEED_SUMMARY_KEYS = ('performance_score', 'fcp', 'lcp', 'cls', 'tbt', 'ttfb')
+
+def pagespeed_params(url: str, strategy: str = 'mobile') -> Dict[str, str]:
+    return {
+        'url': url,
+        'category': 'performance',
+        'strategy': strategy
+    }
+
+def pagespeed_assessment(score: float) -> str:
+    if score >= 90:
+        return "Excellent performance! Your site is fast."
+    elif score >= 70:
+        return "Good performance with room for improvement."
+    elif score >= 50:
+        return "Moderate performance. Consider optimization."
+    return "Poor performance. Immediate optimization needed."
+
+def summarize_pagespeed_result(result: Dict[str, Any], url: str, strategy: str = 'mobile') -> Dict[str, Any]:
+    """Pull the headline metrics and an assessment out of a PageSpeed API response"""
+    lighthouse = result.get('lighthouseResult', {})
+    audits = lighthouse.get('audits', {})
+
+    # Extract comprehensive metrics
+    summary = {
+        'performance_score': round(
+            lighthouse.get('categories', {}).get('performance', {}).get('score', 0) * 100, 1
+        ),
+        'fcp': audits.get('first-contentful-paint', {}).get('displayValue', 'N/A'),
+        'lcp': audits.get('largest-contentful-paint', {}).get('displayValue', 'N/A'),
+        'cls': audits.get('cumulative-layout-shift', {}).get('displayValue', 'N/A'),
+        'tbt': audits.get('total-blocking-time', {}).get('displayValue', 'N/A'),
+        'fid': audits.get('max-potential-fid', {}).get('displayValue', 'N/A'),
+        'ttfb': audits.get('server-response-time', {}).get('displayValue', 'N/A'),
+        'strategy': strategy,
+        'tested_url': url,
+        'test_timestamp': timezone.now().isoformat()
+    }
+
+    # Add performance assessment
+    summary['assessment'] = pagespeed_assessment(summary['performance_score'])
+    return summary
+
+def pagespeed_numbers(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Numeric Lighthouse values (ms, unitless CLS) for the measurement history"""
+    lighthouse = result.get('lighthouseResult', {})
+    audits = lighthouse.get('audits', {})
+
+    def numeric(audit, scale=1):
+        value = audits.get(audit, {}).get('numericValue')
+        return round(value * scale) if isinstance(value, (int, float)) else None
+
+    return {
+        'score': round(lighthouse.get('categories', {}).get('performance', {}).get('score', 0) * 100, 1),
+        'fcp_ms': numeric('first-contentful-paint'),
+        'lcp_ms': numeric('largest-contentful-paint'),
+        'cls': audits.get('cumulative-layout-shift', {}).get('numericValue'),
+        'tbt_ms': numeric('total-blocking-time'),
+        'ttfb_ms': numeric('server-response-time'),
+    }
+
+def format_seconds(ms):
+    return f"{ms / 1000:.1f} s" if ms is not None else 'N/A'
+
+def format_millis(ms):
+    return f"{ms:,} ms" if ms is not None else 'N/A'
+
+def result_from_measurements(rows: Dict[str, Any], url: str) -> Dict[str, Any]:
+    """Speed result (same shape as a live test) rebuilt from stored SpeedMeasurement rows"""
+    summaries = {}
+    for strategy, row in rows.items():
+        summaries[strategy] = {
+            'performance_score': row.score,
+            'fcp': format_seconds(row.fcp_ms),
+            'lcp': format_seconds(row.lcp_ms),
+            'cls': f"{row.cls:.3f}" if row.cls is not None else 'N/A',
+            'tbt': format_millis(row.tbt_ms),
+            'ttfb': format_millis(row.ttfb_ms),
+            'strategy': strategy,
+            'measured_at': row.measured_at.isoformat(),
+        }
+
+    primary_strategy = 'mobile' if 'mobile' in summaries else next(iter(summaries))
+    result = {
+        **summaries.pop(primary_strategy),
+        'fid': 'N/A',
+        'tested_url': url,
+        'test_timestamp': timezone.now().isoformat(),
+        'from_history': True,
+    }
+    result['assessment'] = pagespeed_assessment(result['performance_score'])
+    result.update(summaries)
+    result['history'] = speed_history(url)
+    return result
+
+
+def run_pagespeed(url: str, strategy: str, deadline=None):
+    """One PageSpeed test - (summary, numbers) or ({"error": ...}, None)"""
     try:
         # Enhanced API call with timeout
-        api_url = f"https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
-        params = {
-            'url': url,
-            'category': 'performance',
-            'strategy': 'mobile'  # Mobile-first testing
-        }
-        
-        response = requests.get(api_url, params=params, timeout=30)
+        response = http_client.get(PAGESPEED_API_URL, params=pagespeed_params(url, strategy), timeout=bounded_timeout(deadline, 30), deadline=deadline, governor_host=http_client.host_of(url))
         response.raise_for_status()
         
-        result = response.json()
-        lighthouse = result.get('lighthouseResult', {})
-        
-        # Extract comprehensive metrics
-        metrics = {
-            'performance_score': round(
-                lighthouse.get('categories', {}).get('performance', {}).get('score', 0) * 100, 1
-            ),
-            'fcp': lighthouse.get('audits', {}).get('first-contentful-paint', {}).get('displayValue', 'N/A'),
-            'lcp': lighthouse.get('audits', {}).get('largest-contentful-paint', {}).get('displayValue', 'N/A'),
-            'cls': lighthouse.get('audits', {}).get('cumulative-layout-shift', {}).get('displayValue', 'N/A'),
-            'tbt': lighthouse.get('audits', {}).get('total-blocking-time', {}).get('displayValue', 'N/A'),
-            'fid': lighthouse.get('audits', {}).get('max-potential-fid', {}).get('displayValue', 'N/A'),
-            'tested_url': url,
-            'test_timestamp': timezone.now().isoformat()
-        }
-        
-        # Add performance assessment
-        score = metrics['performance_score']
-        if score >= 90:
-            assessment = "Excellent performance! Your site is fast."
-        elif score >= 70:
-            assessment = "Good performance with room for improvement."
-        elif score >= 50:
-            assessment = "Moderate performance. Consider optimization."
-        else:
-            assessment = "Poor performance. Immediate optimization needed."
-        
-        metrics['assessment'] = assessment
-        
-        # Cache result for 1 hour
-        cache.set(cache_key, metrics, timeout=3600)
+        data = response.json()
+        summary = summarize_pagespeed_result(data, url, strategy)
         
-        logger.info(f"Speed test completed for {url}: {score}/100 (NO DATABASE)")
-        return metrics
+        logger.info(f"Speed test ({strategy}) completed for {url}: {summary['performance_score']}/100")
+        return summary, pagespeed_numbers(data)
         
-    except requests.exceptions.Timeout:
-        logger.error(f"Speed test timeout for {url}")
-        return {"error": "Speed test timed out. The website might be very slow or unreachable."}
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Speed test request failed for {url}: {str(e)}")
-        return {"error": "Unable to test website speed. Please check the URL and try again."}
+    except http_client.HostBusy:
+        logger.warning(f"Speed test queued too long for {url}")
+        return {"error": "This website is busy with other scans right now. Please try again in a minute.", "transient": True}, None
+    except httpx.TimeoutException:
+        logger.error(f"Speed test ({strategy}) timeout for {url}")
+        return {"error": "Speed test timed out. The website might be very slow or unreachable."}, None
+    except httpx.HTTPError as e:
+        logger.error(f"Speed test ({strategy}) request failed for {url}: {str(e)}")
+        return {"error": "Unable to test website speed. Please check the URL and try again."}, None
     except Exception as e:
-        logger.error(f"Speed test failed for {url}: {str(e)}")
-        return {"error": "Speed test failed due to technical issues."}
+        logger.error(f"Speed test ({strategy}) failed for {url}: {str(e)}")
+        return {"error": "Speed test failed due to technical issues."}, None
+
+_pagespeed_executor = None
+_pagespeed_executor_lock = threading.Lock()
+
+def get_pagespeed_executor() -> ThreadPoolExecutor:
+    """Runs the desktop test while the calling thread runs the mobile one"""
+    global _pagespeed_executor
+    if _pagespeed_executor is None:
+        with _pagespeed_executor_lock:
+            if _pagespeed_executor is None:
+                _pagespeed_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "WEBDOCTOR_PAGESPEED_WORKERS", 4),
+                    thread_name_prefix="webdoctor-pagespeed"
+                )
+    return _pagespeed_executor
 
-def handle_get_plugin_list(arguments: Dict[str, str]) -> Dict[str, Any]:
-    """Enhanced plugin detection with caching - NO DATABASE DEPENDENCY"""
-    url = arguments["url"]
+def fetch_pagespeed_result(url: str, deadline=None) -> Dict[str, Any]:
+    """
+    Mobile and desktop PageSpeed tests run concurrently - uncached, errors come back as {"error": ...}.
+    Mobile leads the result (desktop nested under "desktop"); both are stored in the measurement history.
+    """
+    desktop_future = get_pagespeed_executor().submit(run_pagespeed, url, "desktop", deadline)
+    mobile, mobile_numbers = run_pagespeed(url, "mobile", deadline)
+    try:
+        desktop, desktop_numbers = desktop_future.result(timeout=bounded_timeout(deadline, 35))
+    except Exception as e:
+        logger.warning(f"Desktop speed test for {url} did not finish: {str(e)}")
+        desktop, desktop_numbers = {"error": "Desktop speed test did not finish in time."}, None
+
+    numbers = {strategy: found for strategy, found in (("mobile", mobile_numbers), ("desktop", desktop_numbers)) if found}
+    if not numbers:
+        return mobile
+    record_measurements(url, numbers)
+
+    primary, secondary = (mobile, desktop) if mobile_numbers else (desktop, mobile)
+    result = dict(primary)
+    if "error" not in secondary:
+        result[secondary['strategy']] = {key: secondary[key] for key in PAGESPEED_SUMMARY_KEYS}
+    result['history'] = speed_history(url)
+    return result
+
+def fetch_speed_result(url: str, deadline=None) -> Dict[str, Any]:
+    """PageSpeed result for url, falling back to a local page-weight estimate when PageSpeed fails"""
+    result = fetch_pagespeed_result(url, deadline)
+    if "error" not in result or result.get("transient"):
+        return result
+    
+    budget = min(get_estimate_budget(), deadline.remaining()) if deadline else get_estimate_budget()
+    if budget < 1:
+        return result
+    
+    estimate = estimate_page_weight(url, budget=budget)
+    if "error" in estimate:
+        return result
     
-    # Check cache first
-    cache_key = f"plugins_{hashlib.md5(url.encode()).hexdigest()}"
-    cached_result = cache.get(cache_key)
-    if cached_result:
-        logger.info(f"Using cached plugin data for {url} (NO DATABASE)")
-        return cached_result
+    metrics.incr("speed.estimate_fallback")
+    estimate["note"] = "Google PageSpeed was unavailable, so this is a quick local estimate from page weight and server response time."
+    return estimate
+
+def handle_measure_speed(arguments: Dict[str, str], deadline=None) -> Dict[str, Any]:
+    """Enhanced speed measurement with caching - NO DATABASE DEPENDENCY"""
+    return speed_cache.fetch(arguments["url"], fetch_speed_result, deadline=deadline)
+
+def build_plugin_report(found: Dict[str, Any], url: str) -> Dict[str, Any]:
+    """Plugin report from detected components (see webdoctor.plugin_detector)"""
+    # Sort plugins by type and name
+    plugins = sorted(found["plugin"].values(), key=lambda x: (x['type'], x['name']))
+    themes = sorted(found["theme"].values(), key=lambda x: x['name'])
     
+    return {
+        'plugins': plugins,
+        'plugin_count': len(plugins),
+        'themes': themes,
+        'scanned_url': url,
+        'scan_timestamp': timezone.now().isoformat()
+    }
+
+def fetch_plugin_report(url: str, deadline=None) -> Dict[str, Any]:
+    """Scan url for WordPress plugins - uncached, errors come back as {"error": ...}"""
     try:
-        # Enhanced request with headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (compatible; WebDoctor/1.0; +https://techwithwayne.com)'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        html = response.text
-        
-        # Enhanced plugin detection
-        plugin_patterns = [
-            r'/wp-content/plugins/([^/]+)/',
-            r'wp-content/plugins/([^/\'"]+)',
-            r'plugins/([^/\'"]+)'
-        ]
-        
-        plugin_slugs = set()
-        for pattern in plugin_patterns:
-            matches = re.findall(pattern, html, re.IGNORECASE)
-            plugin_slugs.update(matches)
-        
-        # Enhanced plugin name mapping
-        slug_to_info = {
-            'elementor': {'name': 'Elementor', 'type': 'Page Builder'},
-            'woocommerce': {'name': 'WooCommerce', 'type': 'E-commerce'},
-            'wordpress-seo': {'name': 'Yoast SEO', 'type': 'SEO'},
-            'contact-form-7': {'name': 'Contact Form 7', 'type': 'Forms'},
-            'jetpack': {'name': 'Jetpack', 'type': 'Security & Performance'},
-            'akismet': {'name': 'Akismet', 'type': 'Spam Protection'},
-            'wp-super-cache': {'name': 'WP Super Cache', 'type': 'Caching'},
-            'all-in-one-seo-pack': {'name': 'All in One SEO', 'type': 'SEO'},
-            'gravityforms': {'name': 'Gravity Forms', 'type': 'Forms'},
-            'wpforms-lite': {'name': 'WPForms', 'type': 'Forms'},
-            'google-analytics-for-wordpress': {'name': 'MonsterInsights', 'type': 'Analytics'},
-            'updraftplus': {'name': 'UpdraftPlus', 'type': 'Backup'},
-            'wordfence': {'name': 'Wordfence Security', 'type': 'Security'},
-            'really-simple-ssl': {'name': 'Really Simple SSL', 'type': 'Security'},
-            'duplicate-post': {'name': 'Duplicate Post', 'type': 'Content Management'},
-        }
-        
-        # Build plugin list with metadata
-        plugins = []
-        for slug in plugin_slugs:
-            if slug in slug_to_info:
-                plugins.append({
-                    'name': slug_to_info[slug]['name'],
-                    'type': slug_to_info[slug]['type'],
-                    'slug': slug
-                })
-            else:
-                # Clean up slug for display
-                display_name = slug.replace('-', ' ').replace('_', ' ').title()
-                plugins.append({
-                    'name': display_name,
-                    'type': 'Unknown',
-                    'slug': slug
-                })
-        
-        # Sort plugins by type and name
-        plugins.sort(key=lambda x: (x['type'], x['name']))
-        
-        result = {
-            'plugins': plugins,
-            'plugin_count': len(plugins),
-            'scanned_url': url,
-            'scan_timestamp': timezone.now().isoformat()
-        }
-        
-        # Cache result for 6 hours
-        cache.set(cache_key, result, timeout=21600)
+        # Stream the page and stop once enough of it has been scanned
+        with http_client.stream("GET", url, headers=PLUGIN_SCAN_HEADERS, timeout=bounded_timeout(deadline, 15), deadline=deadline) as response:
+            response.raise_for_status()
+            
+            scanner = ComponentScanner(response.encoding)
+            for chunk in response.iter_bytes(PLUGIN_SCAN_CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    break
+                if deadline and deadline.expired():
+                    scanner.stop("deadline")
+                    break
+            
+            result = build_plugin_report(scanner.finish(), url)
         
-        logger.info(f"Found {len(plugins)} plugins on {url} (NO DATABASE)")
+        logger.info(f"Found {result['plugin_count']} plugins on {url} (NO DATABASE)")
         return result
         
-    except requests.exceptions.Timeout:
+    except http_client.HostBusy:
+        logger.warning(f"Plugin scan queued too long for {url}")
+        return {"error": "This website is busy with other scans right now. Please try again in a minute.", "transient": True}
+    except httpx.TimeoutException:
         logger.error(f"Plugin scan timeout for {url}")
         return {"error": "Plugin scan timed out. The website might be slow to respond."}
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Plugin scan request failed for {url}: {str(e)}")
         return {"error": "Unable to scan website. Please check the URL and try again."}
     except Exception as e:
         logger.error(f"Plugin scan failed for {url}: {str(e)}")
         return {"error": "Plugin scan failed due to technical issues."}
 
+def handle_get_plugin_list(arguments: Dict[str, str], deadline=None) -> Dict[str, Any]:
+    """Enhanced plugin detection with caching - NO DATABASE DEPENDENCY"""
+    return plugin_cache.fetch(arguments["url"], fetch_plugin_report, deadline=deadline)
+
 # In your ai_agent.py file, find the get_stage_specific_prompt function
 # and update the "offered_report" section:
 
@@ -742,6 +851,105 @@ Respond: {{"response": "brief form encouragement", "next_stage": "hybrid_closing
     else:
         return "Continue conversation naturally based on session state only."
 
+# ✅ LOCAL RESPONSE ENGINE - turns where force_stage_logic overrides the model anyway
+# Report offers (user hasn't agreed yet), per category
+LOCAL_OFFER_TEMPLATES = {
+    "Performance": [
+        "I can put together a free diagnostic report on your site's speed with the fixes that will make the biggest difference. Would you like me to send it?",
+        "Slow sites usually come down to a handful of fixable things. Want me to email you a free report covering exactly what to check?",
+    ],
+    "Design/Layout": [
+        "I can send you a free diagnostic report with the layout and display fixes I'd start with. Would you like it?",
+        "Want me to email you a free report that walks through the design issues and how to fix them?",
+    ],
+    "Functionality": [
+        "I can send you a free diagnostic report on what's likely breaking and how to fix it. Would you like that?",
+        "Want a free report with step-by-step checks for the features that aren't working?",
+    ],
+    "Access/Errors": [
+        "I can email you a free diagnostic report covering these errors and how to get rid of them. Would you like it?",
+        "Want me to send a free report with the checks that usually clear up errors like these?",
+    ],
+    "Update/Plugin": [
+        "I can send you a free diagnostic report on safely sorting out your updates and plugins. Would you like it?",
+        "Want a free report with a safe update and plugin clean-up plan?",
+    ],
+    "Security/Hack": [
+        "I can send you a free diagnostic report with the security steps to take right away. Would you like it?",
+        "Security issues shouldn't wait. Want me to email you a free report with the clean-up and hardening steps?",
+    ],
+    "Hosting/DNS": [
+        "I can email you a free diagnostic report on the hosting and DNS checks to run. Would you like it?",
+        "Want a free report listing the hosting and DNS settings to verify?",
+    ],
+    "default": [
+        "Would you like me to send you a free diagnostic report with the fixes I'd recommend?",
+        "I can email you a free diagnostic report with everything we covered and next steps. Want it?",
+    ],
+}
+
+# Form encouragement once the user has agreed to the report, per category
+LOCAL_CLOSING_TEMPLATES = {
+    "Performance": [
+        "Perfect! Fill in the form below and I'll send your speed diagnostic report right over.",
+        "Great! Just pop your details into the form and your performance report is on its way.",
+    ],
+    "Security/Hack": [
+        "Good call. Fill in the form below and I'll send your security report right away.",
+        "Great! Add your details in the form and I'll get the security steps over to you.",
+    ],
+    "default": [
+        "Perfect! Please fill out the form that just appeared so I can send your report.",
+        "Great! Just fill in your details in the form below and I'll get that report right over to you.",
+        "Excellent! The form is ready - once you fill it out, I'll send your personalized diagnostic report.",
+    ],
+}
+
+# Stage -> minimum session clarifications at which the LLM may be skipped
+LOCAL_RESPONSE_POLICY = {
+    "offered_report": 2,
+    "hybrid_closing": 0,
+}
+
+def get_local_response_policy() -> Dict[str, int]:
+    return getattr(settings, "WEBDOCTOR_LOCAL_RESPONSE_POLICY", LOCAL_RESPONSE_POLICY)
+
+def get_local_response(stage: str, clarifications: int, category: Optional[str], user_message: str) -> Optional[Dict[str, Any]]:
+    """
+    Answer a turn from the template pools without calling OpenAI.
+    Returns None when the policy doesn't cover this session state or the
+    user asked something that needs a real answer.
+    """
+    min_clarifications = get_local_response_policy().get(stage)
+    if min_clarifications is None or clarifications < min_clarifications:
+        return None
+
+    # A question deserves the model - only canned-flow replies are short-circuited
+    if "?" in user_message:
+        return None
+
+    next_stage, next_clarifications = force_stage_logic(stage, clarifications, user_message, "")
+
+    if next_stage == "hybrid_closing":
+        pool = LOCAL_CLOSING_TEMPLATES.get(category) or LOCAL_CLOSING_TEMPLATES["default"]
+    elif next_stage == "offered_report":
+        pool = LOCAL_OFFER_TEMPLATES.get(category) or LOCAL_OFFER_TEMPLATES["default"]
+    else:
+        return None
+
+    response_text = random.choice(pool)
+    logger.info(f"LOCAL RESPONSE: {stage} -> {next_stage} answered without OpenAI")
+
+    return {
+        "response": response_text,
+        "next_stage": next_stage,
+        "category": category,
+        "clarifications": next_clarifications,
+        "typing_delay": max(3, min(8, len(response_text) // 25)),
+        "processing_time": 0,
+        "local": True
+    }
+
 def convert_plain_text_to_json(text: str, stage: str, category: Optional[str], clarifications: int) -> Dict[str, Any]:
     """Convert plain text response to valid JSON format - SESSION-BASED"""
     logger.warning(f"Converting plain text to JSON (SESSION-BASED): {text[:100]}...")
@@ -814,6 +1022,77 @@ def extract_json_from_text(text: str) -> Dict[str, Any]:
     json_text = text[start_idx:end_idx]
     return json.loads(json_text)
 
+class ResponseTextStreamer:
+    """
+    Incrementally decode the "response" string out of a JSON reply that is
+    still being streamed, so partial text can be shown before the JSON closes
+    """
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    _FIELD_START = re.compile(r'"response"\s*:\s*"')
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None  # Index of the next undecoded char inside the string value
+        self.finished = False
+
+    def feed(self, delta: str) -> str:
+        """Add a raw JSON chunk and return newly decoded response text"""
+        if self.finished or not delta:
+            return ""
+        self.buffer += delta
+
+        if self.position is None:
+            match = self._FIELD_START.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        i = self.position
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self.finished = True
+                i += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                i += 1
+                continue
+
+            # Escape sequence - wait for the rest of it if the chunk split it
+            if i + 1 >= len(self.buffer):
+                break
+            code = self.buffer[i + 1]
+            if code == 'u':
+                if i + 6 > len(self.buffer):
+                    break
+                try:
+                    code_point = int(self.buffer[i + 2:i + 6], 16)
+                except ValueError:
+                    code_point = 0xFFFD
+                if 0xD800 <= code_point < 0xDC00:
+                    # High surrogate - combine with the low half (e.g. emoji)
+                    if i + 12 > len(self.buffer):
+                        break
+                    try:
+                        low = int(self.buffer[i + 8:i + 12], 16)
+                    except ValueError:
+                        low = 0
+                    if self.buffer[i + 6:i + 8] == '\\u' and 0xDC00 <= low < 0xE000:
+                        code_point = 0x10000 + ((code_point - 0xD800) << 10) + (low - 0xDC00)
+                        i += 6
+                    else:
+                        code_point = 0xFFFD
+                decoded.append(chr(code_point))
+                i += 6
+            else:
+                decoded.append(self._ESCAPES.get(code, code))
+                i += 2
+
+        self.position = i
+        return "".join(decoded)
+
 def validate_assistant_response(parsed_json: Dict[str, Any], input_clarifications: int) -> Dict[str, Any]:
     """Validate and sanitize assistant response - SESSION-BASED"""
     required_fields = ['response', 'next_stage', 'category', 'clarifications']
@@ -850,39 +1129,296 @@ def validate_assistant_response(parsed_json: Dict[str, Any], input_clarification
     
     return parsed_json
 
-def get_agent_response(history, stage, category, clarifications, lang='en', request=None):
+RUN_ACTIVE_STATUSES = ['queued', 'in_progress', 'requires_action']
+
+def get_message_text(message_obj) -> Optional[str]:
+    """Extract the text of an assistant message (None if it has no text block)"""
+    if not message_obj or not message_obj.content:
+        return None
+    text_block = getattr(message_obj.content[0], "text", None)
+    return text_block.value if text_block else None
+
+# Per-tool wall-clock budgets (seconds), measured from dispatch
+TOOL_TIMEOUTS = {
+    "send_email_diagnostic": 20,
+    "recommend_fixes": 5,
+    "measure_speed": 35,
+    "get_plugin_list": 20,
+}
+DEFAULT_TOOL_TIMEOUT = 20
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """Process-wide bounded pool shared by every run's tool calls"""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "WEBDOCTOR_TOOL_WORKERS", 8),
+                    thread_name_prefix="webdoctor-tool"
+                )
+    return _tool_executor
+
+def get_tool_timeout(function_name: str) -> float:
+    timeouts = {**TOOL_TIMEOUTS, **getattr(settings, "WEBDOCTOR_TOOL_TIMEOUTS", {})}
+    return timeouts.get(function_name, DEFAULT_TOOL_TIMEOUT)
+
+def run_tool_call_in_worker(tool_call, deadline=None) -> Dict[str, Any]:
+    """Executor entry point - pool threads must not keep DB connections open"""
+    try:
+        return handle_tool_call(tool_call, deadline=deadline)
+    finally:
+        db_connection.close()
+
+def collect_tool_outputs(tool_calls, deadline=None) -> list:
+    """
+    Run the requested tools concurrently and build ONE submit_tool_outputs payload.
+    Each tool gets its own timeout (capped by the turn deadline); a tool that
+    overruns reports an error instead of holding up the others.
+    """
+    dispatched_at = time.monotonic()
+    executor = get_tool_executor()
+    pending = [(tool_call, executor.submit(run_tool_call_in_worker, tool_call, deadline)) for tool_call in tool_calls]
+
+    tool_outputs = []
+    for tool_call, future in pending:
+        function_name = tool_call.function.name
+        remaining = get_tool_timeout(function_name) - (time.monotonic() - dispatched_at)
+        if deadline:
+            remaining = min(remaining, deadline.remaining())
+        try:
+            output = future.result(timeout=max(0, remaining))
+        except FuturesTimeoutError:
+            future.cancel()
+            logger.error(f"Tool {function_name} timed out after {get_tool_timeout(function_name)}s")
+            output = {"error": f"{function_name} took too long to respond. Please try again later."}
+        except Exception as e:
+            logger.error(f"Tool {function_name} crashed: {str(e)}")
+            output = {"error": "Tool execution failed"}
+
+        tool_outputs.append({
+            "tool_call_id": tool_call.id,
+            "output": json.dumps(output)
+        })
+
+    logger.info(f"Ran {len(tool_calls)} tool call(s) concurrently in {time.monotonic() - dispatched_at:.2f}s")
+    return tool_outputs
+
+def stream_run(client, thread_id: str, assistant_id: str, on_text_delta=None, deadline=None, **run_options):
+    """
+    Drive a run with the Assistants streaming event API.
+    Tool calls are answered inline and the call returns as soon as the run
+    reaches a terminal state. Returns (run, raw_text).
+    Raises DeadlineExceeded once the turn deadline passes.
+    """
+    run = None
+    raw_text = None
+
+    stream = bounded_client(client, deadline).beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        tool_choice="auto",
+        response_format={"type": "json_object"},
+        stream=True,
+        **run_options
+    )
+
+    try:
+        while stream is not None:
+            next_stream = None
+            with stream:
+                for event in stream:
+                    if deadline:
+                        deadline.check()
+
+                    if event.event == 'thread.message.delta':
+                        if on_text_delta:
+                            for block in event.data.delta.content or []:
+                                text = getattr(block, "text", None)
+                                if text and text.value:
+                                    on_text_delta(text.value)
+
+                    elif event.event == 'thread.message.completed':
+                        raw_text = get_message_text(event.data)
+
+                    elif event.event == 'thread.run.requires_action':
+                        run = event.data
+                        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                        tool_outputs = collect_tool_outputs(tool_calls, deadline=deadline)
+                        next_stream = bounded_client(client, deadline).beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs,
+                            stream=True
+                        )
+                        break
+
+                    elif event.event.startswith('thread.run.'):
+                        run = event.data
+
+                    elif event.event == 'error':
+                        raise RuntimeError(f"Assistant stream error: {event.data}")
+
+            stream = next_stream
+
+    except Exception as e:
+        # Stream broke after the run started - let the polling path finish the same run
+        if run is not None:
+            logger.warning(f"Run stream interrupted ({str(e)}), falling back to polling run {run.id}")
+            return poll_run(client, thread_id, run, deadline=deadline), raw_text
+        raise
+
+    return run, raw_text
+
+def poll_run(client, thread_id: str, run, max_polls: int = 50, deadline=None):
+    """Legacy polling loop - returns the final run, or None on timeout (DeadlineExceeded past the deadline)"""
+    poll_count = 0
+
+    while run.status in RUN_ACTIVE_STATUSES and poll_count < max_polls:
+        if deadline:
+            deadline.check()
+            time.sleep(min(2, deadline.remaining()))
+            deadline.check()
+        else:
+            time.sleep(2)
+        poll_count += 1
+
+        run = bounded_client(client, deadline).beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+        if run.status == 'requires_action':
+            tool_outputs = collect_tool_outputs(run.required_action.submit_tool_outputs.tool_calls, deadline=deadline)
+            run = bounded_client(client, deadline).beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run.id,
+                tool_outputs=tool_outputs
+            )
+
+    if poll_count >= max_polls:
+        return None
+
+    return run
+
+def find_active_run(client, thread_id: str, deadline=None):
+    """The thread's newest run if it is still going (e.g. started by a stream that broke), else None"""
+    runs = bounded_client(client, deadline).beta.threads.runs.list(thread_id=thread_id, limit=1)
+    for run in runs.data:
+        if run.status in RUN_ACTIVE_STATUSES:
+            return run
+    return None
+
+def execute_run(client, thread_id: str, assistant_id: str, on_text_delta=None, deadline=None, **run_options):
+    """
+    Run the assistant on a thread - streamed when enabled, polled otherwise.
+    Returns (run, raw_text); run is None on timeout and raw_text is None when
+    the reply still has to be fetched from the thread.
+    Raises DeadlineExceeded when the turn deadline passes first.
+    """
+    if getattr(settings, "WEBDOCTOR_STREAM_RUNS", True):
+        try:
+            return stream_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options)
+        except (NotFoundError, BadRequestError, DeadlineExceeded):
+            raise  # Thread is gone or busy / out of time - polling would fail the same way
+        except Exception as e:
+            if deadline and deadline.expired():
+                raise DeadlineExceeded(str(e)) from e
+            logger.warning(f"Streaming run failed, falling back to polling: {str(e)}")
+
+            # The stream may have broken after creating the run - a second one would be rejected (or answer twice)
+            run = find_active_run(client, thread_id, deadline=deadline)
+            if run is not None:
+                logger.info(f"Resuming active run {run.id} by polling")
+                return poll_run(client, thread_id, run, deadline=deadline), None
+
+    run = bounded_client(client, deadline).beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        tool_choice="auto",
+        response_format={"type": "json_object"},
+        **run_options
+    )
+    return poll_run(client, thread_id, run, deadline=deadline), None
+
+def thread_message(msg) -> Optional[Dict[str, str]]:
+    """Convert a session history entry into a thread message (None if empty)"""
+    content = msg.get("content", "")
+    if not content.strip():
+        return None
+    return {
+        "role": msg.get("role", "user"),
+        "content": content[:1500]  # Limit length
+    }
+
+def session_seed_messages(history):
+    """Thread messages a new session thread starts with - the history before the newest entry"""
+    return [m for m in (thread_message(msg) for msg in history[-8:-1]) if m]  # Limit to last 8 messages
+
+def create_session_thread(client, history, deadline=None) -> str:
+    """Create a thread seeded with the earlier session history in ONE request"""
+    seed_messages = session_seed_messages(history)
+    client = bounded_client(client, deadline)
+    thread = client.beta.threads.create(messages=seed_messages) if seed_messages else client.beta.threads.create()
+    logger.info(f"SESSION THREAD: created {thread.id} seeded with {len(seed_messages)} messages")
+    return thread.id
+
+def get_agent_response(history, stage, category, clarifications, lang='en', request=None, on_text_delta=None, thread_id=None,
+                       summary=None, summarized_tokens=0, deadline=None, thread_sync=None):
     """
     Main agent response function - COMPLETELY SESSION-BASED
     NO DATABASE DEPENDENCIES during conversation flow
+
+    on_text_delta: optional callback receiving raw reply chunks as they stream in
+    thread_id: the session's persistent OpenAI thread (Assistants backend only);
+               a replacement is returned in the result when one had to be created
+    thread_sync: {"pending", "messages"} - trailing history entries the thread is missing and the
+                 messages already on it; a completed turn returns the new count as "thread_messages"
+    summary: rolling summary of the turns already folded out of history (see webdoctor.summary)
+    summarized_tokens: what those folded turns would have cost replayed verbatim (for logging)
+    deadline: webdoctor.deadline.Deadline for the turn; model calls, tools and HTTP requests
+              are bounded by it and a fallback is returned (run cancelled) once it passes
+
+    The conversation backend is chosen per deployment with WEBDOCTOR_AGENT_BACKEND.
+    Latency and OpenAI request counts are recorded per backend for comparison.
+    Turns covered by LOCAL_RESPONSE_POLICY are answered locally (see get_local_response).
     """
+    from webdoctor.backends import get_conversation_backend
+
     start_time = time.time()
-    processing_time = 0  # ✅ Initialize to prevent UnboundLocalError
-    assistant_msg = {}  # ✅ Initialize to prevent UnboundLocalError
 
-    try:
-        assistant_id = get_assistant_id()
-        client = get_openai_client()
+    # Canned-flow turns never reach the model
+    user_message = history[-1].get("content", "") if history else ""
+    local_response = get_local_response(stage, clarifications, category, user_message)
+    if local_response:
+        metrics.record_turn("local", time.time() - start_time, 0)
+        return local_response
 
-        # Get the latest user message for stage logic
-        user_message = ""
-        if history:
-            user_message = history[-1].get("content", "")
+    backend = get_conversation_backend()
 
-        logger.info(f"SESSION-BASED PROCESSING: stage={stage}, clarifications={clarifications}, history_length={len(history)}")
+    with count_api_calls() as api_calls:
+        result = generate_agent_reply(backend, history, stage, category, clarifications, on_text_delta, thread_id,
+                                      summary, summarized_tokens, deadline, thread_sync)
 
-        # Create thread
-        thread = client.beta.threads.create()
+    outcome = "fallback" if result.get("fallback") else "ok"
+    metrics.record_turn(backend.name, time.time() - start_time, api_calls["calls"], outcome)
+    return result
 
-        # Build session-based system message
-        stage_prompt = get_stage_specific_prompt(stage, clarifications, category)
-        
-        system_message = f"""SESSION-BASED CONVERSATION (NO DATABASE HISTORY)
+def build_system_message(history, stage, category, clarifications, summary=None):
+    """Per-turn session prompt - returns (system_message, summary_section)"""
+    # Build session-based system message
+    stage_prompt = get_stage_specific_prompt(stage, clarifications, category)
+
+    # Older turns travel as a compact summary instead of verbatim history
+    summary_section = f"\nEARLIER IN THIS SESSION (summary):\n{summary}\n" if summary else ""
+
+    system_message = f"""SESSION-BASED CONVERSATION (NO DATABASE HISTORY)
 
 CURRENT SESSION STATE:
 - Stage: {stage}
 - Session Clarifications: {clarifications}
 - Session History Length: {len(history)}
-
+{summary_section}
 This is a fresh session. You have NO access to previous conversations or database records.
 Every conversation starts completely new. You MUST ask clarifying questions regardless.
 
@@ -892,160 +1428,149 @@ CRITICAL: Respond ONLY with valid JSON:
 {{"response": "your message", "next_stage": "proper_stage", "category": "category_or_null", "clarifications": {clarifications}}}
 
 NEVER use "stage_will_be_set_by_system"."""
-        
-        # Add conversation history (session-based only)
-        for msg in history[-8:]:  # Limit to last 8 messages in this session
-            if not msg.get("content", "").strip():
-                continue
-            client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role=msg.get("role", "user"),
-                content=msg["content"][:1500]  # Limit length
-            )
+    return system_message, summary_section
 
-        # Add system message
-        client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user", 
-            content=system_message
-        )
+def generate_agent_reply(backend, history, stage, category, clarifications, on_text_delta=None, thread_id=None,
+                         summary=None, summarized_tokens=0, deadline=None, thread_sync=None):
+    """Build the stage prompt, run one backend turn and enforce session stage rules"""
+    start_time = time.time()
 
-        # Create run
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id,
-            tool_choice="auto",
-            response_format={"type": "json_object"}
-        )
+    try:
+        logger.info(f"SESSION-BASED PROCESSING: backend={backend.name}, stage={stage}, clarifications={clarifications}, history_length={len(history)}")
 
-        # Poll run with timeout
-        max_polls = 50
-        poll_count = 0
+        system_message, summary_section = build_system_message(history, stage, category, clarifications, summary)
+        record_prompt_size(history, system_message, summary_section, summarized_tokens)
 
-        while run.status in ['queued', 'in_progress', 'requires_action'] and poll_count < max_polls:
-            time.sleep(2)
-            poll_count += 1
-
-            run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-            if run.status == 'requires_action':
-                tool_outputs = []
-                for tool_call in run.required_action.submit_tool_outputs.tool_calls:
-                    output = handle_tool_call(tool_call)
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps(output)
-                    })
-                run = client.beta.threads.runs.submit_tool_outputs(
-                    thread_id=thread.id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
+        turn = backend.run_turn(history, system_message, on_text_delta=on_text_delta, thread_id=thread_id, deadline=deadline,
+                                thread_sync=thread_sync)
+        return interpret_backend_turn(turn, history, stage, category, clarifications, thread_id, start_time)
 
-        # Handle timeout
-        if poll_count >= max_polls:
-            logger.error("Assistant run timed out")
-            return create_fallback_response("I'm taking longer than usual. Please try again.", stage, category, clarifications)
+    except DeadlineExceeded:
+        logger.warning(f"TURN DEADLINE: gave up after {time.time() - start_time:.2f}s")
+        keep_session_thread(thread_id)
+        return create_fallback_response("I'm taking longer than usual. Please try again.", stage, category, clarifications, thread_id)
+    except Exception as e:
+        processing_time = time.time() - start_time
+        logger.error(f"Session-based agent response failed after {processing_time:.2f}s: {str(e)}")
+        keep_session_thread(thread_id)
+        return create_fallback_response("I'm experiencing technical difficulties. Please try again.", stage, category, clarifications, thread_id)
 
-        if run.status == 'failed':
-            logger.error(f"Assistant run failed: {run.last_error}")
-            return create_fallback_response("I'm having technical difficulties. Please try again.", stage, category, clarifications)
+def interpret_backend_turn(turn, history, stage, category, clarifications, thread_id, start_time):
+    """Turn a backend result into the session reply: parse JSON, enforce stage rules, map failures to fallbacks"""
+    assistant_msg = {}  # ✅ Initialize to prevent UnboundLocalError
 
-        # Get response
-        messages = client.beta.threads.messages.list(thread_id=thread.id)
-        if not messages.data:
-            logger.error("No assistant messages returned")
-            return create_fallback_response("I didn't get a proper response. Please try again.", stage, category, clarifications)
+    # Get the latest user message for stage logic
+    user_message = ""
+    if history:
+        user_message = history[-1].get("content", "")
 
-        # Parse response with multiple fallback strategies
-        try:
-            message_obj = messages.data[0]
-            if not message_obj.content or not message_obj.content[0].text:
-                raise ValueError("No content in assistant message")
-            
-            raw_text = message_obj.content[0].text.value.strip()
-            logger.debug(f"Raw session-based response: {raw_text[:200]}...")
+    thread_id = turn.get("thread_id") or thread_id
+    raw_text = turn.get("raw_text")
 
-            assistant_msg = None
-            
-            # Try direct JSON parsing
+    if turn["status"] in ("timeout", "deadline"):
+        return create_fallback_response("I'm taking longer than usual. Please try again.", stage, category, clarifications, thread_id)
+    if turn["status"] == "failed":
+        return create_fallback_response("I'm having technical difficulties. Please try again.", stage, category, clarifications, thread_id)
+    if turn["status"] == "empty":
+        return create_fallback_response("I didn't get a proper response. Please try again.", stage, category, clarifications, thread_id)
+
+    # Parse response with multiple fallback strategies
+    try:
+        if not raw_text:
+            raise ValueError("No content in assistant message")
+
+        raw_text = raw_text.strip()
+        logger.debug(f"Raw session-based response: {raw_text[:200]}...")
+
+        assistant_msg = None
+        
+        # Try direct JSON parsing
+        try:
+            assistant_msg = json.loads(raw_text)
+            logger.info("Session-based JSON parsed successfully")
+        except json.JSONDecodeError:
+            pass
+        
+        # Try extracting JSON from formatted text
+        if assistant_msg is None:
             try:
-                assistant_msg = json.loads(raw_text)
-                logger.info("Session-based JSON parsed successfully")
+                assistant_msg = extract_json_from_text(raw_text)
+                logger.info("Session-based JSON extracted successfully")
             except json.JSONDecodeError:
                 pass
-            
-            # Try extracting JSON from formatted text
-            if assistant_msg is None:
-                try:
-                    assistant_msg = extract_json_from_text(raw_text)
-                    logger.info("Session-based JSON extracted successfully")
-                except json.JSONDecodeError:
-                    pass
-            
-            # Final fallback: convert plain text
-            if assistant_msg is None:
-                logger.warning("Session-based JSON parsing failed, using fallback conversion")
-                assistant_msg = convert_plain_text_to_json(raw_text, stage, category, clarifications)
-
-            # Validate response structure
-            assistant_msg = validate_assistant_response(assistant_msg, clarifications)
-
-            # ENFORCE session-based stage logic (override AI decisions)
-            forced_stage, forced_clarifications = force_stage_logic(stage, clarifications, user_message, assistant_msg["response"])
-            assistant_msg["next_stage"] = forced_stage
-            assistant_msg["clarifications"] = forced_clarifications
-
-            # Session-based safety check: prevent early report offering
-            if stage in ["initial", "clarifying"] and clarifications < 2:
-                forbidden_phrases = ["diagnostic report", "send you", "free report", "email you", "would you like a report"]
-                if any(phrase in assistant_msg["response"].lower() for phrase in forbidden_phrases):
-                    logger.warning("SESSION SAFETY: Assistant mentioned report too early - overriding")
-                    
-                    # Provide appropriate clarifying question based on session count
-                    if clarifications == 0:
-                        assistant_msg["response"] = "I understand you're having an issue. When did you first notice this problem?"
-                    elif clarifications == 1:
-                        assistant_msg["response"] = "Thanks for that information. Does this issue happen on all pages, or just specific ones?"
-                    
-                    assistant_msg["category"] = None
-                    assistant_msg["next_stage"] = "clarifying"
+        
+        # Final fallback: convert plain text
+        if assistant_msg is None:
+            logger.warning("Session-based JSON parsing failed, using fallback conversion")
+            assistant_msg = convert_plain_text_to_json(raw_text, stage, category, clarifications)
+
+        # Validate response structure
+        assistant_msg = validate_assistant_response(assistant_msg, clarifications)
+
+        # ENFORCE session-based stage logic (override AI decisions)
+        forced_stage, forced_clarifications = force_stage_logic(stage, clarifications, user_message, assistant_msg["response"])
+        assistant_msg["next_stage"] = forced_stage
+        assistant_msg["clarifications"] = forced_clarifications
+
+        # Session-based safety check: prevent early report offering
+        if stage in ["initial", "clarifying"] and clarifications < 2:
+            forbidden_phrases = ["diagnostic report", "send you", "free report", "email you", "would you like a report"]
+            if any(phrase in assistant_msg["response"].lower() for phrase in forbidden_phrases):
+                logger.warning("SESSION SAFETY: Assistant mentioned report too early - overriding")
+                
+                # Provide appropriate clarifying question based on session count
+                if clarifications == 0:
+                    assistant_msg["response"] = "I understand you're having an issue. When did you first notice this problem?"
+                elif clarifications == 1:
+                    assistant_msg["response"] = "Thanks for that information. Does this issue happen on all pages, or just specific ones?"
+                
+                assistant_msg["category"] = None
+                assistant_msg["next_stage"] = "clarifying"
 
-        except Exception as e:
-            logger.error(f"Session-based response processing failed: {str(e)}")
-            return create_fallback_response("I had trouble processing my response. Please try again.", stage, category, clarifications)
+    except Exception as e:
+        logger.error(f"Session-based response processing failed: {str(e)}")
+        return create_fallback_response("I had trouble processing my response. Please try again.", stage, category, clarifications, thread_id)
 
-        response_text = assistant_msg.get("response", "").strip()
-        if not response_text:
-            logger.error("Empty response from assistant")
-            return create_fallback_response("I couldn't generate a proper response. Please try again.", stage, category, clarifications)
+    response_text = assistant_msg.get("response", "").strip()
+    if not response_text:
+        logger.error("Empty response from assistant")
+        return create_fallback_response("I couldn't generate a proper response. Please try again.", stage, category, clarifications, thread_id)
 
-        typing_delay = max(3, min(8, len(response_text) // 25))
-        processing_time = time.time() - start_time
-        
-        logger.info(f"SESSION-BASED Response: {processing_time:.2f}s - {stage} -> {assistant_msg.get('next_stage')} (session clarifications: {clarifications} -> {assistant_msg.get('clarifications')})")
+    typing_delay = max(3, min(8, len(response_text) // 25))
+    processing_time = time.time() - start_time
+    
+    logger.info(f"SESSION-BASED Response: {processing_time:.2f}s - {stage} -> {assistant_msg.get('next_stage')} (session clarifications: {clarifications} -> {assistant_msg.get('clarifications')})")
 
-        return {
-            "response": response_text,
-            "next_stage": assistant_msg.get("next_stage", stage),
-            "category": assistant_msg.get("category") if assistant_msg.get("category") != "None" else None,
-            "clarifications": assistant_msg.get("clarifications", clarifications),
-            "typing_delay": typing_delay,
-            "processing_time": processing_time
-        }
+    return {
+        "response": response_text,
+        "next_stage": assistant_msg.get("next_stage", stage),
+        "category": assistant_msg.get("category") if assistant_msg.get("category") != "None" else None,
+        "clarifications": assistant_msg.get("clarifications", clarifications),
+        "typing_delay": typing_delay,
+        "processing_time": processing_time,
+        "thread_id": thread_id,
+        "thread_messages": turn.get("thread_messages")
+    }
 
+def keep_session_thread(thread_id):
+    """Mark the session's thread as in use when a turn falls back before the backend could"""
+    if not thread_id:
+        return
+    from webdoctor.threads import touch_thread
+    try:
+        touch_thread(thread_id)
     except Exception as e:
-        processing_time = time.time() - start_time
-        logger.error(f"Session-based agent response failed after {processing_time:.2f}s: {str(e)}")
-        return create_fallback_response("I'm experiencing technical difficulties. Please try again.", stage, category, clarifications)
+        logger.warning(f"SESSION THREAD: could not touch {thread_id}: {str(e)}")
 
-def create_fallback_response(message, stage, category, clarifications):
-    """Create fallback response for errors - SESSION-BASED"""
+def create_fallback_response(message, stage, category, clarifications, thread_id=None):
+    """Create fallback response for errors - SESSION-BASED (the session keeps its thread)"""
     return {
         "response": message,
         "next_stage": stage,
         "category": category,
         "clarifications": clarifications,
         "typing_delay": 4,
-        "processing_time": 0
+        "processing_time": 0,
+        "fallback": True,
+        "thread_id": thread_id
     }
\ No newline at end of file
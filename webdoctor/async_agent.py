@@ -0,0 +1,316 @@
+# webdoctor/async_agent.py - ASGI variant of the agent turn built on AsyncOpenAI and the shared async HTTP client
+import asyncio
+import json
+import logging
+import time
+import weakref
+from typing import Dict, Any
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, NotFoundError, BadRequestError
+from agentsuite import http_client
+from agentsuite import metrics
+from webdoctor.ai_agent import (
+    _acount_api_request, get_openai_api_key, count_api_calls, get_local_response,
+    build_system_message, interpret_backend_turn, create_fallback_response, keep_session_thread,
+    parse_tool_arguments, run_tool_call_in_worker, get_tool_timeout, get_message_text, session_seed_messages,
+    PLUGIN_SCAN_HEADERS, PLUGIN_SCAN_CHUNK_SIZE, build_plugin_report, fetch_plugin_report,
+    RUN_ACTIVE_STATUSES,
+)
+from webdoctor.summary import record_prompt_size
+from webdoctor.deadline import DeadlineExceeded, bounded_timeout
+from webdoctor.jobs import ameasure_speed_shared, get_speed_job_wait
+from webdoctor.tool_cache import plugin_cache
+from webdoctor.plugin_detector import ComponentScanner
+
+logger = logging.getLogger('webdoctor')
+
+# The async client holds connection pools bound to the loop that created it, so keep
+# one per event loop (a single one for the whole process under an ASGI server)
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """AsyncOpenAI client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=get_openai_api_key(),
+            timeout=30.0,
+            max_retries=3,
+            http_client=DefaultAsyncHttpxClient(event_hooks={"request": [_acount_api_request]})
+        )
+        _async_openai_clients[loop] = client
+        logger.info("Async OpenAI client initialized successfully")
+    return client
+
+async def ahandle_measure_speed(arguments: Dict[str, str], deadline=None) -> Dict[str, Any]:
+    """Async twin of the measure_speed tool path: join the shared background job without blocking the loop"""
+    return await ameasure_speed_shared(arguments["url"], bounded_timeout(deadline, get_speed_job_wait()))
+
+async def afetch_plugin_report(url: str, deadline=None) -> Dict[str, Any]:
+    """Async twin of fetch_plugin_report"""
+    try:
+        async with http_client.astream("GET", url, headers=PLUGIN_SCAN_HEADERS, timeout=bounded_timeout(deadline, 15), deadline=deadline) as response:
+            response.raise_for_status()
+
+            scanner = ComponentScanner(response.encoding)
+            async for chunk in response.aiter_bytes(PLUGIN_SCAN_CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    break
+                if deadline and deadline.expired():
+                    scanner.stop("deadline")
+                    break
+
+            result = build_plugin_report(scanner.finish(), url)
+
+        logger.info(f"Found {result['plugin_count']} plugins on {url} (NO DATABASE)")
+        return result
+
+    except http_client.HostBusy:
+        logger.warning(f"Plugin scan queued too long for {url}")
+        return {"error": "This website is busy with other scans right now. Please try again in a minute.", "transient": True}
+    except httpx.TimeoutException:
+        logger.error(f"Plugin scan timeout for {url}")
+        return {"error": "Plugin scan timed out. The website might be slow to respond."}
+    except httpx.HTTPError as e:
+        logger.error(f"Plugin scan request failed for {url}: {str(e)}")
+        return {"error": "Unable to scan website. Please check the URL and try again."}
+    except Exception as e:
+        logger.error(f"Plugin scan failed for {url}: {str(e)}")
+        return {"error": "Plugin scan failed due to technical issues."}
+
+async def ahandle_get_plugin_list(arguments: Dict[str, str], deadline=None) -> Dict[str, Any]:
+    """Async twin of handle_get_plugin_list - stale entries are refreshed on a worker thread"""
+    return await plugin_cache.afetch(arguments["url"], afetch_plugin_report, fetch_plugin_report, deadline=deadline)
+
+# Tools that only wait on HTTP run on the event loop; the rest (DB, SMTP) go to a worker thread
+ASYNC_TOOL_HANDLERS = {
+    "measure_speed": ahandle_measure_speed,
+    "get_plugin_list": ahandle_get_plugin_list,
+}
+
+async def ahandle_tool_call(tool_call, deadline=None) -> Dict[str, Any]:
+    """Async tool call handler - same validation and error shapes as handle_tool_call"""
+    function_name = tool_call.function.name
+    handler = ASYNC_TOOL_HANDLERS.get(function_name)
+    if handler is None:
+        return await sync_to_async(run_tool_call_in_worker, thread_sensitive=False)(tool_call, deadline)
+
+    try:
+        validated_args = parse_tool_arguments(tool_call)
+        logger.info(f"Executing tool (async): {function_name}")
+        return await handler(validated_args, deadline=deadline)
+
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error in {function_name}: {str(e)}")
+        return {"error": "Invalid function arguments"}
+    except ValueError as e:
+        logger.error(f"Validation error in {function_name}: {str(e)}")
+        return {"error": str(e)}
+    except Exception as e:
+        logger.error(f"Unexpected error in {function_name}: {str(e)}")
+        return {"error": "Tool execution failed"}
+
+async def arun_tool_call(tool_call, deadline=None) -> Dict[str, Any]:
+    """One tool call under its per-tool timeout (capped by the turn deadline)"""
+    function_name = tool_call.function.name
+    timeout = get_tool_timeout(function_name)
+    if deadline:
+        timeout = min(timeout, deadline.remaining())
+    try:
+        return await asyncio.wait_for(ahandle_tool_call(tool_call, deadline), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Tool {function_name} timed out after {get_tool_timeout(function_name)}s")
+        return {"error": f"{function_name} took too long to respond. Please try again later."}
+    except Exception as e:
+        logger.error(f"Tool {function_name} crashed: {str(e)}")
+        return {"error": "Tool execution failed"}
+
+async def acollect_tool_outputs(tool_calls, deadline=None) -> list:
+    """Run the requested tools concurrently and build ONE submit_tool_outputs payload"""
+    dispatched_at = time.monotonic()
+    outputs = await asyncio.gather(*(arun_tool_call(tool_call, deadline) for tool_call in tool_calls))
+
+    logger.info(f"Ran {len(tool_calls)} tool call(s) concurrently (async) in {time.monotonic() - dispatched_at:.2f}s")
+    return [
+        {"tool_call_id": tool_call.id, "output": json.dumps(output)}
+        for tool_call, output in zip(tool_calls, outputs)
+    ]
+
+async def astream_run(client, thread_id: str, assistant_id: str, on_text_delta=None, deadline=None, **run_options):
+    """Async twin of stream_run - returns (run, raw_text), DeadlineExceeded once the turn deadline passes"""
+    run = None
+    raw_text = None
+
+    stream = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        tool_choice="auto",
+        response_format={"type": "json_object"},
+        stream=True,
+        **run_options
+    )
+
+    try:
+        while stream is not None:
+            next_stream = None
+            async with stream:
+                async for event in stream:
+                    if deadline:
+                        deadline.check()
+
+                    if event.event == 'thread.message.delta':
+                        if on_text_delta:
+                            for block in event.data.delta.content or []:
+                                text = getattr(block, "text", None)
+                                if text and text.value:
+                                    on_text_delta(text.value)
+
+                    elif event.event == 'thread.message.completed':
+                        raw_text = get_message_text(event.data)
+
+                    elif event.event == 'thread.run.requires_action':
+                        run = event.data
+                        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                        next_stream = await client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=await acollect_tool_outputs(tool_calls, deadline=deadline),
+                            stream=True
+                        )
+                        break
+
+                    elif event.event.startswith('thread.run.'):
+                        run = event.data
+
+                    elif event.event == 'error':
+                        raise RuntimeError(f"Assistant stream error: {event.data}")
+
+            stream = next_stream
+
+    except Exception as e:
+        if run is not None:
+            logger.warning(f"Run stream interrupted ({str(e)}), falling back to polling run {run.id}")
+            return await apoll_run(client, thread_id, run, deadline=deadline), raw_text
+        raise
+
+    return run, raw_text
+
+async def apoll_run(client, thread_id: str, run, max_polls: int = 50, deadline=None):
+    """Async twin of poll_run - sleeps without holding a worker (DeadlineExceeded past the deadline)"""
+    poll_count = 0
+
+    while run.status in RUN_ACTIVE_STATUSES and poll_count < max_polls:
+        if deadline:
+            deadline.check()
+            await asyncio.sleep(min(2, deadline.remaining()))
+            deadline.check()
+        else:
+            await asyncio.sleep(2)
+        poll_count += 1
+
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+        if run.status == 'requires_action':
+            run = await client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run.id,
+                tool_outputs=await acollect_tool_outputs(run.required_action.submit_tool_outputs.tool_calls, deadline=deadline)
+            )
+
+    if poll_count >= max_polls:
+        return None
+
+    return run
+
+async def afind_active_run(client, thread_id: str):
+    """Async twin of find_active_run"""
+    runs = await client.beta.threads.runs.list(thread_id=thread_id, limit=1)
+    for run in runs.data:
+        if run.status in RUN_ACTIVE_STATUSES:
+            return run
+    return None
+
+async def aexecute_run(client, thread_id: str, assistant_id: str, on_text_delta=None, deadline=None, **run_options):
+    """Async twin of execute_run - callers bound it with webdoctor.deadline.with_deadline"""
+    if getattr(settings, "WEBDOCTOR_STREAM_RUNS", True):
+        try:
+            return await astream_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options)
+        except (NotFoundError, BadRequestError):
+            raise
+        except Exception as e:
+            logger.warning(f"Streaming run failed, falling back to polling: {str(e)}")
+
+            run = await afind_active_run(client, thread_id)
+            if run is not None:
+                logger.info(f"Resuming active run {run.id} by polling")
+                return await apoll_run(client, thread_id, run, deadline=deadline), None
+
+    run = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        tool_choice="auto",
+        response_format={"type": "json_object"},
+        **run_options
+    )
+    return await apoll_run(client, thread_id, run, deadline=deadline), None
+
+async def acreate_session_thread(client, history) -> str:
+    """Async twin of create_session_thread"""
+    seed_messages = session_seed_messages(history)
+    thread = await client.beta.threads.create(messages=seed_messages) if seed_messages else await client.beta.threads.create()
+    logger.info(f"SESSION THREAD: created {thread.id} seeded with {len(seed_messages)} messages")
+    return thread.id
+
+async def aget_agent_response(history, stage, category, clarifications, lang='en', request=None, on_text_delta=None,
+                              thread_id=None, summary=None, summarized_tokens=0, deadline=None, thread_sync=None):
+    """
+    Async twin of get_agent_response for ASGI views.
+    Waiting on OpenAI and the HTTP tools yields the event loop instead of a worker thread.
+    """
+    from webdoctor.backends import get_conversation_backend
+
+    start_time = time.time()
+
+    user_message = history[-1].get("content", "") if history else ""
+    local_response = get_local_response(stage, clarifications, category, user_message)
+    if local_response:
+        await sync_to_async(metrics.record_turn)("local", time.time() - start_time, 0)
+        return local_response
+
+    backend = get_conversation_backend()
+
+    with count_api_calls() as api_calls:
+        result = await agenerate_agent_reply(backend, history, stage, category, clarifications, on_text_delta, thread_id,
+                                             summary, summarized_tokens, deadline, thread_sync)
+
+    outcome = "fallback" if result.get("fallback") else "ok"
+    await sync_to_async(metrics.record_turn)(backend.name, time.time() - start_time, api_calls["calls"], outcome)
+    return result
+
+async def agenerate_agent_reply(backend, history, stage, category, clarifications, on_text_delta=None, thread_id=None,
+                                summary=None, summarized_tokens=0, deadline=None, thread_sync=None):
+    """Async twin of generate_agent_reply"""
+    start_time = time.time()
+
+    try:
+        logger.info(f"SESSION-BASED PROCESSING (async): backend={backend.name}, stage={stage}, clarifications={clarifications}, history_length={len(history)}")
+
+        system_message, summary_section = build_system_message(history, stage, category, clarifications, summary)
+        await sync_to_async(record_prompt_size)(history, system_message, summary_section, summarized_tokens)
+
+        turn = await backend.arun_turn(history, system_message, on_text_delta=on_text_delta, thread_id=thread_id, deadline=deadline,
+                                       thread_sync=thread_sync)
+        return interpret_backend_turn(turn, history, stage, category, clarifications, thread_id, start_time)
+
+    except DeadlineExceeded:
+        logger.warning(f"TURN DEADLINE: gave up after {time.time() - start_time:.2f}s")
+        await sync_to_async(keep_session_thread)(thread_id)
+        return create_fallback_response("I'm taking longer than usual. Please try again.", stage, category, clarifications, thread_id)
+    except Exception as e:
+        processing_time = time.time() - start_time
+        logger.error(f"Session-based agent response failed after {processing_time:.2f}s: {str(e)}")
+        await sync_to_async(keep_session_thread)(thread_id)
+        return create_fallback_response("I'm experiencing technical difficulties. Please try again.", stage, category, clarifications, thread_id)
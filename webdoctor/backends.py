@@ -0,0 +1,341 @@
+# webdoctor/backends.py - Pluggable conversation backends behind get_agent_response
+import logging
+from types import SimpleNamespace
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai import NotFoundError, BadRequestError, APITimeoutError
+from webdoctor.ai_agent import (
+    SHIRLEY_INSTRUCTIONS, SHIRLEY_TOOLS, get_assistant_id, get_openai_client, bounded_client,
+    execute_run, get_message_text, collect_tool_outputs, thread_message, create_session_thread, session_seed_messages,
+)
+from webdoctor.async_agent import (
+    get_async_openai_client, aexecute_run, acollect_tool_outputs, acreate_session_thread,
+)
+from webdoctor.deadline import DeadlineExceeded, with_deadline
+from webdoctor.threads import touch_thread, discard_thread, cancel_active_run_later, register_prewarmed_thread
+
+logger = logging.getLogger('webdoctor')
+
+class ConversationBackend:
+    """
+    One way of turning (history, per-turn system message) into Shirley's raw JSON reply.
+
+    run_turn() returns a dict with:
+        status   - "completed", "timeout", "failed", "empty" or "deadline"
+        raw_text - the model's reply text (None unless completed)
+        thread_id - server-side conversation handle to keep in the session, if any
+        thread_messages - messages on that thread after a completed turn (threaded backends only)
+
+    deadline (webdoctor.deadline.Deadline) bounds every call made for the turn.
+    thread_sync ({"pending", "messages"}) says how many trailing history entries the
+    session's thread is still missing and how many messages it already holds.
+    """
+    name = "base"
+
+    def run_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        raise NotImplementedError
+
+    async def arun_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        """Async variant for ASGI views - backends without one run the sync turn in a worker thread"""
+        return await sync_to_async(self.run_turn, thread_sensitive=False)(
+            history, system_message, on_text_delta=on_text_delta, thread_id=thread_id, deadline=deadline,
+            thread_sync=thread_sync
+        )
+
+    def prewarm(self):
+        """Do the per-session setup ahead of the first message - returns a thread_id to keep, if any"""
+        get_openai_client()
+        return None
+
+    def deadline_result(self, thread_id=None):
+        logger.warning("TURN DEADLINE: backend turn abandoned")
+        return {"status": "deadline", "raw_text": None, "thread_id": thread_id}
+
+class AssistantsBackend(ConversationBackend):
+    """Assistants API: persistent thread per session, server-side runs"""
+    name = "assistants"
+
+    def sync_state(self, history, thread_id, thread_sync):
+        """(entries to append, messages already on the thread) - a new thread is seeded with all but the newest"""
+        if not thread_id:
+            return history[-1:], len(session_seed_messages(history))
+        thread_sync = thread_sync or {}
+        pending = min(thread_sync.get("pending", 1), len(history))
+        on_thread = thread_sync.get("messages", max(0, len(history) - 1))
+        return (history[-pending:] if pending > 0 else []), on_thread
+
+    def build_run_options(self, history, system_message, pending, on_thread):
+        """
+        Run options appending the history entries the thread is missing (local and fallback
+        replies never reached it). The stage prompt rides on the run as additional
+        instructions so it never piles up in the thread.
+        Returns (run_options, messages on the thread once the run starts).
+        """
+        run_options = {"additional_instructions": system_message}
+        additional_messages = [m for m in (thread_message(msg) for msg in pending) if m]
+        if additional_messages:
+            run_options["additional_messages"] = additional_messages
+        on_thread += len(additional_messages)
+        # Only the thread's tail that is still verbatim session history - folded turns live in the summary
+        run_options["truncation_strategy"] = {"type": "last_messages", "last_messages": max(1, min(len(history), on_thread))}
+        return run_options, on_thread
+
+    def check_run(self, run, thread_id):
+        """Map a finished (or timed-out) run to a failure result, or None when it completed"""
+        if run is None:
+            logger.error("Assistant run timed out")
+            return {"status": "timeout", "raw_text": None, "thread_id": thread_id}
+
+        if run.status == 'failed':
+            logger.error(f"Assistant run failed: {run.last_error}")
+            return {"status": "failed", "raw_text": None, "thread_id": thread_id}
+        return None
+
+    def prewarm(self):
+        """Resolve the assistant and create the session's (empty) thread before the first message"""
+        get_assistant_id()
+        thread_id = create_session_thread(get_openai_client(), [])
+        register_prewarmed_thread(thread_id)
+        return thread_id
+
+    def run_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        assistant_id = get_assistant_id()
+        client = get_openai_client()
+        run_options, on_thread = self.build_run_options(history, system_message, *self.sync_state(history, thread_id, thread_sync))
+
+        if not thread_id:
+            thread_id = create_session_thread(client, history, deadline=deadline)
+
+        # Drive the run (streamed events, polling fallback)
+        try:
+            try:
+                run, raw_text = execute_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options)
+            except (NotFoundError, BadRequestError) as thread_error:
+                # Thread was deleted/expired or still has a stuck run - start over on a fresh one
+                logger.warning(f"SESSION THREAD: {thread_id} unusable ({str(thread_error)}), creating a new thread")
+                discard_thread(thread_id)
+                thread_id = create_session_thread(client, history, deadline=deadline)
+                run_options, on_thread = self.build_run_options(history, system_message, *self.sync_state(history, None, None))
+                run, raw_text = execute_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options)
+        except DeadlineExceeded:
+            # Out of time - stop the run burning tokens after the client has gone
+            cancel_active_run_later(thread_id)
+            touch_thread(thread_id)  # The session keeps the thread - don't let the sweeper take it
+            return self.deadline_result(thread_id)
+
+        touch_thread(thread_id)
+
+        failure = self.check_run(run, thread_id)
+        if failure:
+            return failure
+
+        # Get response (already captured from the event stream when streaming)
+        if raw_text is None:
+            messages = bounded_client(client, deadline).beta.threads.messages.list(thread_id=thread_id, limit=1)
+            if not messages.data:
+                logger.error("No assistant messages returned")
+                return {"status": "empty", "raw_text": None, "thread_id": thread_id}
+            raw_text = get_message_text(messages.data[0])
+
+        # The run added the assistant's reply
+        return {"status": "completed", "raw_text": raw_text, "thread_id": thread_id, "thread_messages": on_thread + 1}
+
+    async def arun_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        assistant_id = await sync_to_async(get_assistant_id, thread_sensitive=False)()
+        client = get_async_openai_client()
+        run_options, on_thread = self.build_run_options(history, system_message, *self.sync_state(history, thread_id, thread_sync))
+
+        if not thread_id:
+            thread_id = await with_deadline(acreate_session_thread(client, history), deadline)
+
+        try:
+            try:
+                run, raw_text = await with_deadline(
+                    aexecute_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options),
+                    deadline
+                )
+            except (NotFoundError, BadRequestError) as thread_error:
+                logger.warning(f"SESSION THREAD: {thread_id} unusable ({str(thread_error)}), creating a new thread")
+                await sync_to_async(discard_thread)(thread_id)
+                thread_id = await with_deadline(acreate_session_thread(client, history), deadline)
+                run_options, on_thread = self.build_run_options(history, system_message, *self.sync_state(history, None, None))
+                run, raw_text = await with_deadline(
+                    aexecute_run(client, thread_id, assistant_id, on_text_delta=on_text_delta, deadline=deadline, **run_options),
+                    deadline
+                )
+        except DeadlineExceeded:
+            cancel_active_run_later(thread_id)
+            await sync_to_async(touch_thread)(thread_id)
+            return self.deadline_result(thread_id)
+
+        await sync_to_async(touch_thread)(thread_id)
+
+        failure = self.check_run(run, thread_id)
+        if failure:
+            return failure
+
+        if raw_text is None:
+            messages = await client.beta.threads.messages.list(thread_id=thread_id, limit=1)
+            if not messages.data:
+                logger.error("No assistant messages returned")
+                return {"status": "empty", "raw_text": None, "thread_id": thread_id}
+            raw_text = get_message_text(messages.data[0])
+
+        # The run added the assistant's reply
+        return {"status": "completed", "raw_text": raw_text, "thread_id": thread_id, "thread_messages": on_thread + 1}
+
+class ChatCompletionsBackend(ConversationBackend):
+    """
+    Single-request backend: the session history is replayed into one Chat
+    Completions call (plus one more per round of tool calls). No threads or runs.
+    """
+    name = "chat"
+    max_tool_rounds = 4
+
+    def get_model(self):
+        return getattr(settings, "WEBDOCTOR_CHAT_MODEL", "gpt-4o")
+
+    def build_messages(self, history, system_message):
+        messages = [{"role": "system", "content": SHIRLEY_INSTRUCTIONS}]
+        messages += [m for m in (thread_message(msg) for msg in history[-8:]) if m]
+        messages.append({"role": "system", "content": system_message})
+        return messages
+
+    def completion_options(self, messages):
+        return {
+            "model": self.get_model(),
+            "messages": messages,
+            "tools": SHIRLEY_TOOLS,
+            "tool_choice": "auto",
+            "response_format": {"type": "json_object"},
+            "temperature": 0.3,
+            "stream": True,
+        }
+
+    def consume_chunk(self, chunk, content_parts, tool_calls, on_text_delta=None):
+        """Fold one streamed chunk into the reply text and the tool call fragments"""
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+
+        if delta.content:
+            content_parts.append(delta.content)
+            if on_text_delta:
+                on_text_delta(delta.content)
+
+        # Tool calls arrive in fragments keyed by index
+        for fragment in delta.tool_calls or []:
+            call = tool_calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": ""})
+            if fragment.id:
+                call["id"] = fragment.id
+            if fragment.function and fragment.function.name:
+                call["name"] += fragment.function.name
+            if fragment.function and fragment.function.arguments:
+                call["arguments"] += fragment.function.arguments
+
+    def assemble_completion(self, content_parts, tool_calls):
+        """Returns (content, tool_calls) with tool calls in index order"""
+        ordered_calls = [
+            SimpleNamespace(id=call["id"], function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+            for _, call in sorted(tool_calls.items())
+        ]
+        return "".join(content_parts), ordered_calls
+
+    def stream_completion(self, client, messages, on_text_delta=None, deadline=None):
+        """One streamed completion - returns (content, tool_calls)"""
+        try:
+            stream = bounded_client(client, deadline).chat.completions.create(**self.completion_options(messages))
+
+            content_parts = []
+            tool_calls = {}
+            with stream:
+                for chunk in stream:
+                    if deadline:
+                        deadline.check()  # Leaving the block closes the stream and stops generation
+                    self.consume_chunk(chunk, content_parts, tool_calls, on_text_delta)
+        except APITimeoutError as e:
+            if deadline and deadline.expired():
+                raise DeadlineExceeded(str(e)) from e
+            raise
+        return self.assemble_completion(content_parts, tool_calls)
+
+    async def astream_completion(self, client, messages, on_text_delta=None):
+        """Async twin of stream_completion"""
+        stream = await client.chat.completions.create(**self.completion_options(messages))
+
+        content_parts = []
+        tool_calls = {}
+        async with stream:
+            async for chunk in stream:
+                self.consume_chunk(chunk, content_parts, tool_calls, on_text_delta)
+        return self.assemble_completion(content_parts, tool_calls)
+
+    def final_result(self, content):
+        if not content.strip():
+            logger.error("No completion content returned")
+            return {"status": "empty", "raw_text": None, "thread_id": None}
+        return {"status": "completed", "raw_text": content, "thread_id": None}
+
+    def append_tool_round(self, messages, content, tool_calls, tool_outputs):
+        """Add the assistant's tool request and the tool results to the conversation"""
+        messages.append({
+            "role": "assistant",
+            "content": content or None,
+            "tool_calls": [
+                {"id": call.id, "type": "function", "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                for call in tool_calls
+            ]
+        })
+        for output in tool_outputs:
+            messages.append({"role": "tool", "tool_call_id": output["tool_call_id"], "content": output["output"]})
+
+    def tool_rounds_exhausted(self):
+        logger.error(f"Chat completion still calling tools after {self.max_tool_rounds} rounds")
+        return {"status": "timeout", "raw_text": None, "thread_id": None}
+
+    def run_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        client = get_openai_client()
+        messages = self.build_messages(history, system_message)
+
+        try:
+            for _ in range(self.max_tool_rounds + 1):
+                content, tool_calls = self.stream_completion(client, messages, on_text_delta=on_text_delta, deadline=deadline)
+                if not tool_calls:
+                    return self.final_result(content)
+                self.append_tool_round(messages, content, tool_calls, collect_tool_outputs(tool_calls, deadline=deadline))
+        except DeadlineExceeded:
+            return self.deadline_result(thread_id)
+
+        return self.tool_rounds_exhausted()
+
+    async def arun_turn(self, history, system_message, on_text_delta=None, thread_id=None, deadline=None, thread_sync=None):
+        try:
+            return await with_deadline(self.arun_tool_rounds(history, system_message, on_text_delta, deadline), deadline)
+        except DeadlineExceeded:
+            return self.deadline_result(thread_id)
+
+    async def arun_tool_rounds(self, history, system_message, on_text_delta=None, deadline=None):
+        client = get_async_openai_client()
+        messages = self.build_messages(history, system_message)
+
+        for _ in range(self.max_tool_rounds + 1):
+            content, tool_calls = await self.astream_completion(client, messages, on_text_delta=on_text_delta)
+            if not tool_calls:
+                return self.final_result(content)
+            self.append_tool_round(messages, content, tool_calls, await acollect_tool_outputs(tool_calls, deadline=deadline))
+
+        return self.tool_rounds_exhausted()
+
+CONVERSATION_BACKENDS = {
+    AssistantsBackend.name: AssistantsBackend,
+    ChatCompletionsBackend.name: ChatCompletionsBackend,
+}
+
+def get_conversation_backend(name=None) -> ConversationBackend:
+    """Backend selected by WEBDOCTOR_AGENT_BACKEND (defaults to the Assistants API)"""
+    name = name or getattr(settings, "WEBDOCTOR_AGENT_BACKEND", AssistantsBackend.name)
+    backend_class = CONVERSATION_BACKENDS.get(name)
+    if backend_class is None:
+        logger.error(f"Unknown WEBDOCTOR_AGENT_BACKEND '{name}', using assistants")
+        backend_class = AssistantsBackend
+    return backend_class()
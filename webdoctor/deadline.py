@@ -0,0 +1,53 @@
+# webdoctor/deadline.py - Per-turn time budget passed down from the view to every outbound call
+import asyncio
+import time
+from django.conf import settings
+
+# The widget aborts requests after 30s; finish (or give up) comfortably before that
+DEFAULT_TURN_DEADLINE = 25
+
+def get_turn_deadline_seconds():
+    return getattr(settings, "WEBDOCTOR_TURN_DEADLINE", DEFAULT_TURN_DEADLINE)
+
+class DeadlineExceeded(Exception):
+    """The turn ran out of time - stop work and answer with a fallback"""
+
+class Deadline:
+    """Absolute point in time (monotonic clock) by which a chat turn must be answered"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_turn(cls):
+        return cls(get_turn_deadline_seconds())
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """Raise DeadlineExceeded once the budget is spent"""
+        if self.expired():
+            raise DeadlineExceeded(f"Turn deadline of {self.seconds}s exceeded")
+
+    def timeout(self, cap):
+        """Timeout for one blocking call: never longer than cap or the time left"""
+        self.check()
+        return min(cap, self.remaining())
+
+def bounded_timeout(deadline, cap):
+    """cap when there is no deadline, otherwise whatever is left of it (up to cap)"""
+    return deadline.timeout(cap) if deadline else cap
+
+async def with_deadline(awaitable, deadline):
+    """Await under the turn deadline - raises DeadlineExceeded (cancelling the work) when it passes"""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Turn deadline of {deadline.seconds}s exceeded")
@@ -0,0 +1,259 @@
+# webdoctor/jobs.py - Background speed-test jobs with in-flight deduplication (singleflight)
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection as db_connection
+from django.utils import timezone
+from webdoctor.utils import normalize_url, canonical_url
+from webdoctor.tool_cache import speed_cache
+from webdoctor.page_weight import estimate_page_weight, get_estimate_budget
+from webdoctor.speed_history import latest_measurements, get_history_reuse_seconds
+
+logger = logging.getLogger('webdoctor')
+
+SPEED_JOB_PREFIX = "speed_job_"
+SPEED_JOB_INFLIGHT_PREFIX = "speed_job_inflight_"
+SPEED_JOB_TTL = 3600         # How long finished jobs stay queryable
+SPEED_JOB_INFLIGHT_TTL = 90  # Upper bound on one PageSpeed call, in case a worker dies mid-job
+JOB_POLL_INTERVAL = 0.5
+
+JOB_FINISHED_STATUSES = ("done", "failed")
+
+def get_speed_job_wait():
+    """Seconds the assistant tool path waits on a shared speed job before answering without it"""
+    return getattr(settings, "WEBDOCTOR_SPEED_JOB_WAIT", 30)
+
+_job_executor = None
+_executor_lock = threading.Lock()
+
+# canonical URL -> job_id, job_id -> Future, for jobs running in this process
+_inflight = {}
+_futures = {}
+_inflight_lock = threading.Lock()
+
+def get_job_executor() -> ThreadPoolExecutor:
+    global _job_executor
+    if _job_executor is None:
+        with _executor_lock:
+            if _job_executor is None:
+                _job_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "WEBDOCTOR_SPEED_JOB_WORKERS", 4),
+                    thread_name_prefix="webdoctor-speed-job"
+                )
+    return _job_executor
+
+def _url_hash(url):
+    return hashlib.md5(url.encode()).hexdigest()
+
+def _inflight_key(url):
+    """Claim key shared by every variant of a URL (www., tracking parameters, ...)"""
+    return f"{SPEED_JOB_INFLIGHT_PREFIX}{_url_hash(canonical_url(url))}"
+
+def get_job(job_id):
+    """Current record of a speed job (None when unknown or expired)"""
+    return cache.get(f"{SPEED_JOB_PREFIX}{job_id}")
+
+def _save_job(job):
+    cache.set(f"{SPEED_JOB_PREFIX}{job['job_id']}", job, timeout=SPEED_JOB_TTL)
+
+def _new_job(url, status="pending", result=None):
+    return {
+        "job_id": uuid.uuid4().hex,
+        "url": url,
+        "status": status,
+        "submitted_at": timezone.now().isoformat(),
+        "finished_at": timezone.now().isoformat() if status in JOB_FINISHED_STATUSES else None,
+        "result": result,
+    }
+
+def _run_speed_job(job_id, url):
+    """Executor entry point: run the PageSpeed test and publish the result"""
+    from webdoctor.ai_agent import fetch_speed_result
+
+    job = get_job(job_id) or _new_job(url)
+    job["job_id"] = job_id
+    try:
+        job["status"] = "running"
+        _save_job(job)
+
+        result = fetch_speed_result(url)
+        speed_cache.set(url, result)
+        job["status"] = "failed" if "error" in result else "done"
+        job["result"] = result
+    except Exception as e:
+        logger.error(f"SPEED JOB {job_id} crashed for {url}: {str(e)}")
+        job["status"] = "failed"
+        job["result"] = {"error": "Speed test failed due to technical issues."}
+    finally:
+        job["finished_at"] = timezone.now().isoformat()
+        _save_job(job)
+        cache.delete(_inflight_key(url))
+        with _inflight_lock:
+            _inflight.pop(canonical_url(url), None)
+            _futures.pop(job_id, None)
+        db_connection.close()
+
+    logger.info(f"SPEED JOB {job_id} {job['status']} for {url}")
+    return job
+
+def submit_speed_job(url):
+    """
+    Start a speed test for url in the background, or attach to the one already
+    running for the same page (www. and tracking-parameter variants included).
+    Returns the job record.
+    """
+    from webdoctor.ai_agent import fetch_speed_result, result_from_measurements
+
+    url = normalize_url(url)
+
+    # A cached result (even a stale one, refreshed in the background) needs no job at all;
+    # a recent failure is answered from the negative cache instead of re-testing a dead site
+    cached_result, state = speed_cache.lookup(url, refresh=fetch_speed_result)
+    if state != "miss":
+        job = _new_job(url, status="failed" if state == "negative" else "done", result=cached_result)
+        _save_job(job)
+        return job
+
+    # Tested recently by any worker (and the cache entry is gone) - answer from the stored measurements
+    recent = latest_measurements(url, max_age=get_history_reuse_seconds())
+    if recent:
+        result = result_from_measurements(recent, url)
+        speed_cache.set(url, result)
+        job = _new_job(url, status="done", result=result)
+        _save_job(job)
+        logger.info(f"SPEED JOB: answered {url} from stored measurements")
+        return job
+
+    key = canonical_url(url)
+    inflight_key = _inflight_key(url)
+    with _inflight_lock:
+        # Same process: attach to the running job
+        job_id = _inflight.get(key)
+        if job_id:
+            job = get_job(job_id)
+            if job:
+                logger.info(f"SPEED JOB: attached to in-flight job {job_id} for {url}")
+                return job
+
+        # Another process may own the test - claim the URL atomically. The record is saved
+        # first so a claim whose job cannot be found really is a dead one.
+        job = _new_job(url)
+        _save_job(job)
+        if not cache.add(inflight_key, job["job_id"], timeout=SPEED_JOB_INFLIGHT_TTL):
+            owner_id = cache.get(inflight_key)
+            other = get_job(owner_id) if owner_id else None
+            if other and other["status"] not in JOB_FINISHED_STATUSES:
+                logger.info(f"SPEED JOB: attached to in-flight job {other['job_id']} for {url}")
+                return other
+
+            # The claim outlived its job - release it only if it still names that job,
+            # then race for it again like any other submitter
+            if owner_id and cache.get(inflight_key) == owner_id:
+                cache.delete(inflight_key)
+            if not cache.add(inflight_key, job["job_id"], timeout=SPEED_JOB_INFLIGHT_TTL):
+                winner = get_job(cache.get(inflight_key) or "")
+                if winner:
+                    logger.info(f"SPEED JOB: attached to in-flight job {winner['job_id']} for {url}")
+                    return winner
+
+        _inflight[key] = job["job_id"]
+        _futures[job["job_id"]] = get_job_executor().submit(_run_speed_job, job["job_id"], url)
+
+    logger.info(f"SPEED JOB {job['job_id']} submitted for {url}")
+    return job
+
+def wait_for_speed_job(job_id, timeout):
+    """Block up to timeout seconds for a job to finish - returns its latest record"""
+    with _inflight_lock:
+        future = _futures.get(job_id)
+
+    if future is not None:
+        try:
+            return future.result(timeout=max(0, timeout))
+        except FuturesTimeoutError:
+            return get_job(job_id)
+
+    # Owned by another process (or already finished) - watch the shared record
+    deadline = time.monotonic() + timeout
+    job = get_job(job_id)
+    while job and job["status"] not in JOB_FINISHED_STATUSES and time.monotonic() < deadline:
+        time.sleep(min(JOB_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+        job = get_job(job_id)
+    return job
+
+async def await_speed_job(job_id, timeout):
+    """Async twin of wait_for_speed_job"""
+    with _inflight_lock:
+        future = _futures.get(job_id)
+
+    if future is not None:
+        try:
+            # shield: a caller timing out must not cancel the shared job
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=max(0, timeout))
+        except asyncio.TimeoutError:
+            return await cache.aget(f"{SPEED_JOB_PREFIX}{job_id}")
+
+    deadline = time.monotonic() + timeout
+    job = await cache.aget(f"{SPEED_JOB_PREFIX}{job_id}")
+    while job and job["status"] not in JOB_FINISHED_STATUSES and time.monotonic() < deadline:
+        await asyncio.sleep(min(JOB_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+        job = await cache.aget(f"{SPEED_JOB_PREFIX}{job_id}")
+    return job
+
+def speed_job_tool_result(job, estimate=None):
+    """What the assistant sees: the test result, or a note that it is still running (with a quick estimate if one was made)"""
+    if job and job["status"] in JOB_FINISHED_STATUSES:
+        return job["result"]
+    running = {
+        "status": "running",
+        "job_id": job["job_id"] if job else None,
+        "message": "The speed test is still running. Let the user know results will be ready shortly."
+    }
+    if estimate and "error" not in estimate:
+        running["message"] = ("The full speed test is still running. Share this quick local estimate "
+                              "and let the user know the detailed results will be ready shortly.")
+        return {**estimate, **running}
+    return running
+
+def split_speed_wait(timeout):
+    """(seconds to wait for PageSpeed, seconds left for a local estimate if it is not done by then)"""
+    budget = min(get_estimate_budget(), timeout)
+    return timeout - budget, budget
+
+def measure_speed_shared(url, timeout):
+    """
+    Tool path: submit (or join) the speed job for url and wait for it; if it is not
+    done in time, answer with a quick page-weight estimate instead (within timeout overall)
+    """
+    job = submit_speed_job(url)
+    if job["status"] in JOB_FINISHED_STATUSES:
+        return job["result"]
+
+    job_wait, estimate_budget = split_speed_wait(timeout)
+    job = wait_for_speed_job(job["job_id"], job_wait)
+    if job and job["status"] in JOB_FINISHED_STATUSES:
+        return job["result"]
+    estimate = estimate_page_weight(url, budget=estimate_budget) if estimate_budget >= 1 else None
+    return speed_job_tool_result(job, estimate)
+
+async def ameasure_speed_shared(url, timeout):
+    """Async twin of measure_speed_shared"""
+    job = await sync_to_async(submit_speed_job)(url)
+    if job["status"] in JOB_FINISHED_STATUSES:
+        return job["result"]
+
+    job_wait, estimate_budget = split_speed_wait(timeout)
+    job = await await_speed_job(job["job_id"], job_wait)
+    if job and job["status"] in JOB_FINISHED_STATUSES:
+        return job["result"]
+    estimate = None
+    if estimate_budget >= 1:
+        estimate = await sync_to_async(estimate_page_weight, thread_sensitive=False)(url, budget=estimate_budget)
+    return speed_job_tool_result(job, estimate)
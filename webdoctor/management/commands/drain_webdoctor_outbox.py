@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from webdoctor.outbox import drain_outbox, pending_count, OUTBOX_BATCH_SIZE
+
+class Command(BaseCommand):
+    help = "Send queued diagnostic report emails (retrying failed ones with backoff)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help=f"Reports sent per SMTP connection (default: {OUTBOX_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep draining until interrupted instead of exiting after one pass",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds between passes with --loop (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox(batch_size=options["batch_size"])
+            if sent or failed or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Sent {sent} report(s), {failed} failed, {pending_count()} still queued"
+                ))
+            if not options["loop"]:
+                return
+            # A full batch means more are probably due - go again right away
+            if sent + failed < options["batch_size"]:
+                time.sleep(options["interval"])
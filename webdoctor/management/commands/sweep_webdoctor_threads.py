@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from webdoctor.threads import sweep_abandoned_threads, sweep_prewarmed_threads, get_thread_idle_ttl
+
+class Command(BaseCommand):
+    help = "Delete OpenAI threads left behind by abandoned chat sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-idle",
+            type=int,
+            default=None,
+            help="Seconds of inactivity before a thread is deleted (default: WEBDOCTOR_THREAD_IDLE_TTL)",
+        )
+
+    def handle(self, *args, **options):
+        max_idle = options["max_idle"] if options["max_idle"] is not None else get_thread_idle_ttl()
+        prewarmed = sweep_prewarmed_threads()
+        deleted = sweep_abandoned_threads(max_idle=max_idle)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} abandoned thread(s) idle for more than {max_idle}s and {prewarmed} unused pre-warmed thread(s)"
+        ))
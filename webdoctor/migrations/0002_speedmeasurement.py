@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webdoctor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeedMeasurement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=32)),
+                ('url', models.URLField(max_length=500)),
+                ('strategy', models.CharField(choices=[('mobile', 'Mobile'), ('desktop', 'Desktop')], max_length=7)),
+                ('measured_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('score', models.FloatField()),
+                ('fcp_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('lcp_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('cls', models.FloatField(blank=True, null=True)),
+                ('tbt_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('ttfb_ms', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'webdoctor_speed_measurements',
+                'ordering': ['-measured_at'],
+                'indexes': [models.Index(fields=['url_hash', 'measured_at'], name='webdoctor_s_url_has_4b17a9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webdoctor', '0002_speedmeasurement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosticreport',
+            name='email_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='diagnosticreport',
+            name='email_subject',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='diagnosticreport',
+            name='last_email_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='diagnosticreport',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosticreport',
+            index=models.Index(fields=['email_sent', 'next_attempt_at'], name='webdoctor_r_email_s_13c99c_idx'),
+        ),
+    ]
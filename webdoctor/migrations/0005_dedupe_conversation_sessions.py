@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:36
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_sessions(apps, schema_editor):
+    """Keep the oldest conversation per session_id and move the others' messages onto it"""
+    Conversation = apps.get_model('webdoctor', 'Conversation')
+    Message = apps.get_model('webdoctor', 'Message')
+
+    duplicates = (
+        Conversation.objects.exclude(session_id=None)
+        .values('session_id')
+        .annotate(rows=Count('id'), keep_id=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in list(duplicates):
+        others = Conversation.objects.filter(session_id=duplicate['session_id']).exclude(id=duplicate['keep_id'])
+        Message.objects.filter(conversation__in=others).update(conversation_id=duplicate['keep_id'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webdoctor', '0004_message_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webdoctor', '0005_dedupe_conversation_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -3,7 +3,7 @@ from django.db import models
 from django.core.validators import EmailValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
 import hashlib
 import logging
 
@@ -20,7 +20,7 @@ class BaseModel(models.Model):
 
 class Conversation(BaseModel):
     """✅ Enhanced conversation model"""
-    session_id = models.CharField(max_length=255, db_index=True, blank=True, null=True)
+    session_id = models.CharField(max_length=255, unique=True, blank=True, null=True)  # ✅ One row per transcript
     name = models.CharField(max_length=100, blank=True, null=True)
     email = models.EmailField(validators=[EmailValidator()], blank=True, null=True, db_index=True)
     subject = models.CharField(max_length=255, blank=True, null=True)
@@ -43,6 +43,36 @@ class Conversation(BaseModel):
     @property
     def message_count(self):
         return self.messages.count()
+
+    @classmethod
+    @transaction.atomic
+    def append_transcripts(cls, transcripts):
+        """
+        ✅ Bulk transcript write: transcripts maps a chat's transcript id (stored as
+        session_id) to [(sender, content, created_at), ...]. Missing conversations are
+        created with the first user message as subject. Returns messages written.
+        """
+        # ✅ Upsert on the unique session_id - concurrent flushes of one transcript share its row
+        cls.objects.bulk_create(
+            [
+                cls(session_id=transcript_id, subject=next(
+                    (content[:255] for sender, content, _ in messages if sender == 'user'), None
+                ))
+                for transcript_id, messages in transcripts.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['session_id'],
+            update_fields=['updated_at'],
+        )
+        known = dict(cls.objects.filter(session_id__in=list(transcripts)).values_list('session_id', 'id'))
+
+        rows = [
+            Message(conversation_id=known[transcript_id], sender=sender, content=content[:2000], created_at=created_at)
+            for transcript_id, messages in transcripts.items()
+            for sender, content, created_at in messages
+        ]
+        Message.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
     
     class Meta:
         db_table = 'webdoctor_conversations'
@@ -67,7 +97,7 @@ class Message(BaseModel):
     )
     sender = models.CharField(max_length=20, choices=SENDER_CHOICES, db_index=True)
     content = models.TextField(max_length=2000)  # ✅ Limit content length
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)  # ✅ Settable, so buffered writes keep the real time
     
     def __str__(self):
         return f"{self.get_sender_display()} - {self.content[:50]}..." if len(self.content) > 50 else f"{self.get_sender_display()} - {self.content}"
@@ -121,6 +151,45 @@ class AgentResponse(BaseModel):
             response.refresh_from_db()
         
         return response, created
+
+    @classmethod
+    @transaction.atomic
+    def add_usage(cls, counts):
+        """
+        ✅ Bulk version of get_or_create_response: counts maps response_hash to
+        (response_text, times seen). New responses start at times seen - 1, like
+        get_or_create_response. Returns the number of new responses.
+        """
+        existing = set(cls.objects.filter(response_hash__in=counts).values_list('response_hash', flat=True))
+        missing = [response_hash for response_hash in counts if response_hash not in existing]
+
+        created = 0
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([
+                    cls(response_hash=response_hash, response_text=counts[response_hash][0], usage_count=counts[response_hash][1] - 1)
+                    for response_hash in missing
+                ])
+            created = len(missing)
+        except IntegrityError:
+            # ✅ Another worker inserted some of them since the SELECT - one by one, and count onto theirs
+            for response_hash in missing:
+                text, seen = counts[response_hash]
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(response_hash=response_hash, response_text=text, usage_count=seen - 1)
+                    created += 1
+                except IntegrityError:
+                    existing.add(response_hash)
+
+        # One UPDATE per distinct increment rather than per response
+        by_increment = {}
+        for response_hash in existing:
+            by_increment.setdefault(counts[response_hash][1], []).append(response_hash)
+        for increment, hashes in by_increment.items():
+            cls.objects.filter(response_hash__in=hashes).update(usage_count=models.F('usage_count') + increment)
+
+        return created
     
     class Meta:
         db_table = 'webdoctor_responses'
@@ -167,6 +236,11 @@ class DiagnosticReport(BaseModel):
     report_content = models.TextField(max_length=5000)
     email_sent = models.BooleanField(default=False, db_index=True)  # ✅ Track email status
     email_sent_at = models.DateTimeField(null=True, blank=True)
+    # ✅ Outbox state - unsent reports are delivered by webdoctor.outbox, not the request
+    email_subject = models.CharField(max_length=255, blank=True, default='')
+    email_attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_email_error = models.TextField(blank=True, default='')
     
     def __str__(self):
         status = "✅ Sent" if self.email_sent else "⏳ Pending"
@@ -186,4 +260,34 @@ class DiagnosticReport(BaseModel):
         indexes = [
             models.Index(fields=['user_email', 'created_at']),
             models.Index(fields=['email_sent', 'created_at']),
-        ]
\ No newline at end of file
+            models.Index(fields=['email_sent', 'next_attempt_at']),
+        ]
+
+
+class SpeedMeasurement(models.Model):
+    """✅ One PageSpeed result per URL and strategy - compact time series for repeat checks and trends"""
+    STRATEGY_CHOICES = [
+        ('mobile', 'Mobile'),
+        ('desktop', 'Desktop'),
+    ]
+    
+    url_hash = models.CharField(max_length=32)  # md5 of the canonical URL
+    url = models.URLField(max_length=500)
+    strategy = models.CharField(max_length=7, choices=STRATEGY_CHOICES)
+    measured_at = models.DateTimeField(default=timezone.now)
+    score = models.FloatField()
+    fcp_ms = models.PositiveIntegerField(null=True, blank=True)
+    lcp_ms = models.PositiveIntegerField(null=True, blank=True)
+    cls = models.FloatField(null=True, blank=True)
+    tbt_ms = models.PositiveIntegerField(null=True, blank=True)
+    ttfb_ms = models.PositiveIntegerField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.url} [{self.strategy}] {self.score} ({self.measured_at.strftime('%Y-%m-%d %H:%M')})"
+    
+    class Meta:
+        db_table = 'webdoctor_speed_measurements'
+        ordering = ['-measured_at']
+        indexes = [
+            models.Index(fields=['url_hash', 'measured_at']),
+        ]
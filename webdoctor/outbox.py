@@ -0,0 +1,137 @@
+# webdoctor/outbox.py - DiagnosticReport as a transactional outbox: requests enqueue, a worker sends
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction, connection as db_connection
+from django.utils import timezone
+from agentsuite import metrics
+from webdoctor.models import DiagnosticReport
+
+logger = logging.getLogger('webdoctor')
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE = 60      # 1 min, 2, 4, 8 ... between attempts
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_CLAIM_SECONDS = 300    # A claimed report is left alone this long by other drainers
+
+def get_max_attempts():
+    return getattr(settings, "WEBDOCTOR_OUTBOX_MAX_ATTEMPTS", OUTBOX_MAX_ATTEMPTS)
+
+def kick_enabled():
+    """Also drain right after a report is committed (so mail goes out even without the worker running)"""
+    return getattr(settings, "WEBDOCTOR_OUTBOX_KICK", True)
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1))))
+
+def enqueue_report(interaction, email, issue, report_content, subject):
+    """
+    Store the report as an unsent outbox entry. Call inside the request's transaction -
+    delivery happens after commit, never while the write lock is held.
+    """
+    report = DiagnosticReport.objects.create(
+        user_interaction=interaction,
+        user_email=email,
+        issue_details=issue,
+        report_content=report_content,
+        email_subject=subject[:255],
+        next_attempt_at=timezone.now(),
+    )
+    metrics.incr("outbox.enqueued")
+    if kick_enabled():
+        transaction.on_commit(kick_outbox)
+    return report
+
+def kick_outbox():
+    threading.Thread(target=_drain_in_background, name="webdoctor-outbox", daemon=True).start()
+
+def _drain_in_background():
+    try:
+        drain_outbox()
+    except Exception as e:
+        logger.error(f"OUTBOX: background drain failed: {str(e)}")
+    finally:
+        db_connection.close()
+
+def due_reports(batch_size):
+    return list(
+        DiagnosticReport.objects.filter(
+            email_sent=False,
+            is_active=True,
+            next_attempt_at__isnull=False,
+            next_attempt_at__lte=timezone.now(),
+            email_attempts__lt=get_max_attempts(),
+        ).order_by('next_attempt_at')[:batch_size]
+    )
+
+def claim(report):
+    """Conditional update so only one drainer (thread or process) sends a given report"""
+    claimed_until = timezone.now() + timedelta(seconds=OUTBOX_CLAIM_SECONDS)
+    claimed = DiagnosticReport.objects.filter(
+        pk=report.pk, email_sent=False, next_attempt_at=report.next_attempt_at
+    ).update(next_attempt_at=claimed_until)
+    return claimed == 1
+
+def report_message(report, connection):
+    subject = report.email_subject or "Website Diagnostic Report - TechWithWayne"
+    return EmailMessage(
+        subject=subject,
+        body=report.report_content,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[report.user_email],
+        connection=connection,
+    )
+
+def record_failure(report, error):
+    attempts = report.email_attempts + 1
+    DiagnosticReport.objects.filter(pk=report.pk).update(
+        email_attempts=attempts,
+        next_attempt_at=timezone.now() + retry_delay(attempts),
+        last_email_error=str(error)[:1000],
+    )
+    metrics.incr("outbox.failed")
+    if attempts >= get_max_attempts():
+        logger.error(f"OUTBOX: giving up on report {report.id} to {report.user_email} after {attempts} attempts: {str(error)}")
+    else:
+        logger.warning(f"OUTBOX: report {report.id} to {report.user_email} failed (attempt {attempts}): {str(error)}")
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """Send due reports over one SMTP connection - returns (sent, failed)"""
+    reports = [report for report in due_reports(batch_size) if claim(report)]
+    if not reports:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # No connection at all - every claimed report backs off
+        for report in reports:
+            record_failure(report, e)
+        return 0, len(reports)
+
+    try:
+        for report in reports:
+            try:
+                report_message(report, connection).send()
+                DiagnosticReport.objects.filter(pk=report.pk).update(email_attempts=report.email_attempts + 1)
+                report.mark_email_sent()
+                metrics.incr("outbox.sent")
+                sent += 1
+            except Exception as e:
+                record_failure(report, e)
+                failed += 1
+    finally:
+        connection.close()
+
+    logger.info(f"OUTBOX: sent {sent}, failed {failed}")
+    return sent, failed
+
+def pending_count():
+    return DiagnosticReport.objects.filter(
+        email_sent=False, next_attempt_at__isnull=False, email_attempts__lt=get_max_attempts()
+    ).count()
@@ -0,0 +1,177 @@
+# webdoctor/page_weight.py - Local page-weight estimate: a fast first answer / fallback for PageSpeed
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from html.parser import HTMLParser
+from typing import Dict, Any
+from urllib.parse import urljoin, urlsplit
+from django.conf import settings
+from django.utils import timezone
+from agentsuite import http_client
+from webdoctor.deadline import Deadline
+
+logger = logging.getLogger('webdoctor')
+
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+MAX_RESOURCES = 40
+RESOURCE_TIMEOUT = 5
+RESOURCE_WORKERS = 8
+
+_resource_executor = None
+_executor_lock = threading.Lock()
+
+def get_resource_executor() -> ThreadPoolExecutor:
+    global _resource_executor
+    if _resource_executor is None:
+        with _executor_lock:
+            if _resource_executor is None:
+                _resource_executor = ThreadPoolExecutor(max_workers=RESOURCE_WORKERS, thread_name_prefix="webdoctor-page-weight")
+    return _resource_executor
+
+def get_estimate_budget():
+    """Seconds a page-weight estimate may take in total"""
+    return getattr(settings, "WEBDOCTOR_PAGE_WEIGHT_BUDGET", 8)
+
+class ResourceCollector(HTMLParser):
+    """Collects stylesheets, scripts and images referenced by a page, noting render-blocking ones"""
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.in_head = True
+        self.resources = []
+        self.seen = set()
+
+    def add(self, kind, src, blocking=False):
+        if not src or src.startswith(("data:", "#", "javascript:")):
+            return
+        url = urljoin(self.base_url, src.strip())
+        if urlsplit(url).scheme not in ("http", "https") or url in self.seen:
+            return
+        self.seen.add(url)
+        self.resources.append({"url": url, "kind": kind, "blocking": blocking})
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "body":
+            self.in_head = False
+        elif tag == "link" and "stylesheet" in (attrs.get("rel") or "").lower():
+            # Stylesheets block rendering unless scoped to a non-matching media query
+            media = (attrs.get("media") or "all").lower()
+            self.add("css", attrs.get("href"), blocking=media in ("all", "screen"))
+        elif tag == "script" and attrs.get("src"):
+            deferred = "async" in attrs or "defer" in attrs or attrs.get("type") == "module"
+            self.add("js", attrs.get("src"), blocking=self.in_head and not deferred)
+        elif tag == "img":
+            self.add("image", attrs.get("src") or attrs.get("data-src"))
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+
+def fetch_page(url, deadline):
+    """(html, bytes, ttfb seconds, final url) for the page itself"""
+    with http_client.stream("GET", url, timeout=deadline.timeout(15), deadline=deadline) as response:
+        # Timed by the client from the request send - not the wait for the host's turn
+        ttfb = http_client.time_to_headers(response)
+        response.raise_for_status()
+        body = bytearray()
+        for chunk in response.iter_bytes():
+            body.extend(chunk)
+            if len(body) >= MAX_PAGE_BYTES or deadline.expired():
+                break
+        html = bytes(body).decode(response.encoding or "utf-8", errors="replace")
+        return html, len(body), ttfb, str(response.url)
+
+def resource_size(resource, deadline):
+    """Content-Length from a HEAD request (None when the server does not say)"""
+    try:
+        response = http_client.head(resource["url"], timeout=deadline.timeout(RESOURCE_TIMEOUT), retries=0, deadline=deadline)
+        if response.status_code >= 400:
+            return None
+        length = response.headers.get("content-length")
+        return int(length) if length and length.isdigit() else None
+    except Exception as e:
+        logger.debug(f"Size check failed for {resource['url']}: {str(e)}")
+        return None
+
+def estimate_score(total_bytes, request_count, blocking_count, ttfb):
+    """Rough 0-100 score from the things that dominate load time on a typical connection"""
+    score = 100.0
+    score -= min(35, max(0, total_bytes - 1_000_000) / 100_000)      # -1 per 100 KB above 1 MB
+    score -= min(20, max(0, request_count - 30) * 0.5)               # -0.5 per request above 30
+    score -= min(20, max(0, blocking_count - 2) * 3)                 # -3 per blocking file above 2
+    score -= min(25, max(0, ttfb - 0.6) * 25)                        # -25 per second of TTFB above 0.6s
+    return round(max(0.0, score), 1)
+
+def estimate_page_weight(url: str, budget=None) -> Dict[str, Any]:
+    """
+    Fetch the page, HEAD its CSS/JS/images concurrently and estimate performance.
+    Same shape as handle_measure_speed (lab metrics are 'N/A'), plus the raw numbers
+    and "estimated": True. Errors come back as {"error": ...}.
+    """
+    deadline = Deadline(budget or get_estimate_budget())
+    try:
+        html, page_bytes, ttfb, final_url = fetch_page(url, deadline)
+    except http_client.HostBusy:
+        return {"error": "This website is busy with other scans right now. Please try again in a minute.", "transient": True}
+    except Exception as e:
+        logger.error(f"Page weight estimate failed for {url}: {str(e)}")
+        return {"error": "Unable to load the website for a quick speed check."}
+
+    collector = ResourceCollector(final_url)
+    collector.feed(html)
+    resources = collector.resources[:MAX_RESOURCES]
+
+    executor = get_resource_executor()
+    futures = {executor.submit(resource_size, resource, deadline): resource for resource in resources}
+    done, pending = futures_wait(futures, timeout=deadline.remaining())
+    for future in pending:
+        future.cancel()
+
+    bytes_by_kind = {"html": page_bytes, "css": 0, "js": 0, "image": 0}
+    unsized = 0
+    for future, resource in futures.items():
+        size = future.result() if future in done else None
+        if size is None:
+            unsized += 1
+        else:
+            bytes_by_kind[resource["kind"]] += size
+
+    total_bytes = sum(bytes_by_kind.values())
+    request_count = 1 + len(collector.resources)
+    render_blocking = [resource["url"] for resource in collector.resources if resource["blocking"]]
+    score = estimate_score(total_bytes, request_count, len(render_blocking), ttfb)
+
+    if score >= 90:
+        assessment = "Lightweight page - likely fast (quick local estimate)."
+    elif score >= 70:
+        assessment = "Reasonable page weight with room for improvement (quick local estimate)."
+    elif score >= 50:
+        assessment = "Heavy page. Consider optimization (quick local estimate)."
+    else:
+        assessment = "Very heavy or slow page. Optimization needed (quick local estimate)."
+
+    logger.info(f"Page weight estimate for {url}: {total_bytes} bytes, {request_count} requests, score {score}")
+    return {
+        'performance_score': score,
+        'fcp': 'N/A',
+        'lcp': 'N/A',
+        'cls': 'N/A',
+        'tbt': 'N/A',
+        'fid': 'N/A',
+        'ttfb': f"{round(ttfb * 1000):,} ms",
+        'strategy': 'estimate',    # A plain server fetch - no mobile/desktop emulation
+        'tested_url': url,
+        'test_timestamp': timezone.now().isoformat(),
+        'assessment': assessment,
+        'estimated': True,
+        'total_bytes': total_bytes,
+        'bytes_by_type': bytes_by_kind,
+        'request_count': request_count,
+        'resources_checked': len(resources),
+        'unsized_resources': unsized,
+        'render_blocking': render_blocking[:10],
+        'render_blocking_count': len(render_blocking),
+        'ttfb_ms': round(ttfb * 1000),
+    }
@@ -0,0 +1,108 @@
+# webdoctor/prefetch.py - Warm the speed and plugin tools for URLs users paste into the chat
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection as db_connection
+from agentsuite import metrics
+from webdoctor.utils import canonical_url
+
+logger = logging.getLogger('webdoctor')
+
+# Full URLs, or bare host names such as "www.example.com" / "example.co.uk/shop" (not e-mail domains)
+URL_PATTERN = re.compile(
+    r'(?<![@\w.-])((?:https?://)?(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,24}(?::\d{2,5})?(?:/[^\s<>"\']*)?)',
+    re.IGNORECASE
+)
+TRAILING_PUNCTUATION = '.,;:!?)]}\'"'
+# A bare host name counts when it starts with www., or ends in one of these and has a path -
+# otherwise "ASP.NET", "index.php" or "Node.js" in a message would be scanned as sites
+KNOWN_TLDS = {
+    "com", "net", "org", "info", "biz", "io", "co", "app", "dev", "site", "online", "shop", "store",
+    "blog", "tech", "xyz", "me", "us", "uk", "ca", "au", "nz", "ie", "de", "fr", "nl", "es", "it", "in",
+}
+MAX_PREFETCH_URLS = 2
+PREFETCH_DEDUPE_TTL = 600
+
+_prefetch_executor = None
+_executor_lock = threading.Lock()
+
+def prefetch_enabled():
+    return getattr(settings, "WEBDOCTOR_PREFETCH_TOOLS", True)
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        with _executor_lock:
+            if _prefetch_executor is None:
+                _prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webdoctor-prefetch")
+    return _prefetch_executor
+
+def looks_like_site(bare_url):
+    """A scheme-less match is only taken for www.<host> or <host>.<known tld>/<path>"""
+    host, _, path = bare_url.partition("/")
+    host = host.split(":")[0].lower()
+    return host.startswith("www.") or (host.rsplit(".", 1)[-1] in KNOWN_TLDS and bool(path))
+
+def extract_urls(message):
+    """http(s) URLs mentioned in a chat message (bare host names get https://), in order, deduplicated"""
+    urls = []
+    seen = set()
+    for match in URL_PATTERN.finditer(message or ""):
+        url = match.group(1).rstrip(TRAILING_PUNCTUATION)
+        if not re.match(r'^https?://', url, re.IGNORECASE):
+            if not looks_like_site(url):
+                continue
+            url = f"https://{url}"
+        key = canonical_url(url)
+        if key not in seen:
+            seen.add(key)
+            urls.append(url)
+    return urls
+
+def claim_prefetch(url):
+    """True for the first worker to prefetch url within PREFETCH_DEDUPE_TTL"""
+    key = f"webdoctor_prefetch_{hashlib.md5(canonical_url(url).encode()).hexdigest()}"
+    return cache.add(key, True, timeout=PREFETCH_DEDUPE_TTL)
+
+def prefetch_url(url):
+    """Executor entry point: claim url and start its speed job and plugin scan"""
+    from webdoctor.ai_agent import fetch_plugin_report
+    from webdoctor.jobs import submit_speed_job
+    from webdoctor.tool_cache import plugin_cache
+
+    try:
+        if not claim_prefetch(url):
+            return False
+        submit_speed_job(url)
+        plugin_cache.prefetch(url, fetch_plugin_report)
+        metrics.incr("prefetch.urls")
+        logger.info(f"PREFETCH: warming speed and plugin tools for {url}")
+        return True
+    except Exception as e:
+        logger.warning(f"Tool prefetch failed for {url}: {str(e)}")
+        return False
+    finally:
+        db_connection.close()
+
+def prefetch_tools_for_message(message):
+    """
+    Start background speed and plugin scans for URLs in message so the results are
+    already cached when the assistant calls the tools. Only the URL match runs on the
+    caller's thread (sync view or event loop) - the cache and database work is queued.
+    Returns the URLs queued. Never raises.
+    """
+    if not prefetch_enabled():
+        return []
+
+    queued = []
+    try:
+        for url in extract_urls(message)[:MAX_PREFETCH_URLS]:
+            get_prefetch_executor().submit(prefetch_url, url)
+            queued.append(url)
+    except Exception as e:
+        logger.warning(f"Tool prefetch failed: {str(e)}")
+    return queued
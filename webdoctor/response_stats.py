@@ -0,0 +1,64 @@
+# webdoctor/response_stats.py - Write-behind AgentResponse usage counts: aggregate in memory, flush in bulk
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from agentsuite.write_behind import BackgroundWorker
+from agentsuite import metrics
+
+logger = logging.getLogger('webdoctor')
+
+FLUSH_INTERVAL = 15     # Seconds - also the most counts a crashed worker can lose
+FLUSH_SIZE = 200        # Distinct pending responses that trigger an early flush
+
+_pending = {}           # response_hash -> [response_text, times seen]
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+def get_flush_interval():
+    return getattr(settings, "WEBDOCTOR_RESPONSE_STATS_FLUSH_INTERVAL", FLUSH_INTERVAL)
+
+def get_flush_size():
+    return getattr(settings, "WEBDOCTOR_RESPONSE_STATS_FLUSH_SIZE", FLUSH_SIZE)
+
+def record_response(response_text):
+    """Count one use of an assistant response - no database work on the caller's thread"""
+    response_hash = hashlib.sha256(response_text.encode('utf-8')).hexdigest()
+    with _pending_lock:
+        entry = _pending.get(response_hash)
+        if entry is None:
+            _pending[response_hash] = [response_text, 1]
+        else:
+            entry[1] += 1
+        pending = len(_pending)
+    flusher.ensure_started()
+    if pending >= get_flush_size():
+        flusher.wake()
+
+def flush():
+    """Write pending counts with AgentResponse.add_usage - returns the number of responses flushed"""
+    from webdoctor.models import AgentResponse
+
+    with _flush_lock:
+        with _pending_lock:
+            if not _pending:
+                return 0
+            batch = {response_hash: tuple(entry) for response_hash, entry in _pending.items()}
+            _pending.clear()
+        try:
+            created = AgentResponse.add_usage(batch)
+        except Exception as e:
+            # Put the counts back so the next flush retries them
+            with _pending_lock:
+                for response_hash, (text, seen) in batch.items():
+                    entry = _pending.setdefault(response_hash, [text, 0])
+                    entry[1] += seen
+            logger.error(f"RESPONSE STATS: flush of {len(batch)} responses failed: {str(e)}")
+            return 0
+
+    metrics.incr("response_stats.flushes")
+    logger.info(f"RESPONSE STATS: flushed {len(batch)} responses ({created} new)")
+    return len(batch)
+
+# Flushes every FLUSH_INTERVAL, early past FLUSH_SIZE, and once more at exit
+flusher = BackgroundWorker("webdoctor-response-stats", flush, get_flush_interval)
@@ -0,0 +1,61 @@
+# webdoctor/speed_history.py - Stored PageSpeed measurements: repeat checks and trends without another API call
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from webdoctor.models import SpeedMeasurement
+from webdoctor.utils import canonical_url
+
+logger = logging.getLogger('webdoctor')
+
+HISTORY_POINTS = 6
+MEASUREMENT_FIELDS = ("score", "fcp_ms", "lcp_ms", "cls", "tbt_ms", "ttfb_ms")
+
+def get_history_reuse_seconds():
+    """A stored measurement younger than this answers a repeat check on its own"""
+    return getattr(settings, "WEBDOCTOR_SPEED_HISTORY_REUSE", 3600)
+
+def url_hash(url):
+    return hashlib.md5(canonical_url(url).encode()).hexdigest()
+
+def record_measurements(url, numbers_by_strategy):
+    """Store one row per strategy ({"mobile": {score, fcp_ms, ...}, ...}) - never raises"""
+    measured_at = timezone.now()
+    try:
+        SpeedMeasurement.objects.bulk_create([
+            SpeedMeasurement(
+                url_hash=url_hash(url), url=url[:500], strategy=strategy, measured_at=measured_at,
+                **{field: numbers.get(field) for field in MEASUREMENT_FIELDS}
+            )
+            for strategy, numbers in numbers_by_strategy.items()
+        ])
+    except Exception as e:
+        logger.warning(f"Could not store speed measurements for {url}: {str(e)}")
+
+def latest_measurements(url, max_age=None):
+    """{strategy: SpeedMeasurement} from the most recent test of url (empty when none is young enough)"""
+    rows = SpeedMeasurement.objects.filter(url_hash=url_hash(url))
+    if max_age is not None:
+        rows = rows.filter(measured_at__gte=timezone.now() - timedelta(seconds=max_age))
+    latest = rows.order_by('-measured_at').first()
+    if latest is None:
+        return {}
+    batch = rows.filter(measured_at=latest.measured_at)
+    return {row.strategy: row for row in batch}
+
+def speed_history(url, limit=HISTORY_POINTS):
+    """Recent mobile/desktop scores for url, newest first - what the assistant uses for trend questions"""
+    try:
+        rows = (
+            SpeedMeasurement.objects.filter(url_hash=url_hash(url))
+            .order_by('-measured_at')
+            .values('measured_at', 'strategy', 'score', 'lcp_ms', 'ttfb_ms')[:limit * 2]
+        )
+        return [
+            {**row, 'measured_at': row['measured_at'].isoformat()}
+            for row in rows
+        ]
+    except Exception as e:
+        logger.warning(f"Could not load speed history for {url}: {str(e)}")
+        return []
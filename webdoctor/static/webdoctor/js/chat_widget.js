@@ -155,6 +155,8 @@ class WebDoctorChat {
       this.bindEvents();
       console.log("✅ Events bound successfully");
 
+      this.prewarmSession();
+
       this.showInitialGreeting();
       console.log("✅ Initial greeting scheduled");
 
@@ -165,6 +167,23 @@ class WebDoctorChat {
     }
   }
 
+  // ✅ Set up the session conversation (and OpenAI thread) before the first message
+  prewarmSession() {
+    const prewarmUrl = window.webdoctorUrls?.prewarm;
+    if (!prewarmUrl) return;
+
+    fetch(prewarmUrl, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": this.getCsrfToken(),
+      },
+      body: "{}",
+    })
+      .then((response) => console.log("🔥 Session pre-warm:", response.status))
+      .catch((error) => console.warn("⚠️ Session pre-warm failed:", error));
+  }
+
   bindEvents() {
     console.log("🔗 Binding events...");
 
@@ -607,8 +626,9 @@ class WebDoctorChat {
     const typingIndicator = this.showTypingIndicator();
 
     try {
+      const streamUrl = window.webdoctorUrls?.handleMessageStream;
       const targetUrl =
-        window.webdoctorUrls?.handleMessage || "/agent/handle_message/";
+        streamUrl || window.webdoctorUrls?.handleMessage || "/agent/handle_message/";
       console.log("🌐 Making fetch request to:", targetUrl);
 
       const csrfToken = this.getCsrfToken();
@@ -617,51 +637,53 @@ class WebDoctorChat {
       const controller = new AbortController();
       const timeoutId = setTimeout(() => controller.abort(), 30000);
 
-      const response = await fetch(targetUrl, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": csrfToken,
-        },
-        body: JSON.stringify({
+      // ✅ Streamed replies are written into this bubble as they arrive
+      let streamSpan = null;
+
+      const data = await this.fetchReply(
+        targetUrl,
+        {
           message: message,
           lang: "en",
-        }),
-        signal: controller.signal,
-      });
+        },
+        csrfToken,
+        controller.signal,
+        (text) => {
+          if (!streamSpan) {
+            this.removeTypingIndicator();
+            streamSpan = this.startStreamingBotMessage();
+          }
+          streamSpan.textContent += text;
+          this.scrollToBottom();
+        }
+      );
 
       clearTimeout(timeoutId);
 
-      console.log("📡 Response status:", response.status);
-      console.log("📡 Response ok:", response.ok);
-
-      if (!response.ok) {
-        throw new Error(`Server error: ${response.status}`);
-      }
-
-      let data;
-      try {
-        data = await response.json();
-      } catch (jsonError) {
-        console.error("❌ JSON parsing error:", jsonError);
-        throw new Error("Invalid response format from server");
-      }
-
       console.log("📦 Response data:", data);
 
       this.removeTypingIndicator();
 
-      if (data.response && data.response.trim()) {
+      const showFormIfAccepted = () => {
+        // ✅ Show form AFTER the AI response is fully shown
+        if (isAcceptingReport) {
+          console.log("✅ Showing form after AI response");
+          setTimeout(() => this.showForm(), 500);
+        }
+      };
+
+      if (data && data.response && data.response.trim()) {
         this.currentStage = data.stage || this.currentStage;
 
-        // ✅ Add bot message with callback to show form after typing animation
-        this.addBotMessage(data.response, true, () => {
-          // ✅ Show form AFTER the AI response is fully typed out
-          if (isAcceptingReport) {
-            console.log("✅ Showing form after AI response");
-            setTimeout(() => this.showForm(), 500);
-          }
-        });
+        if (streamSpan) {
+          // ✅ Final event is authoritative (server may have overridden the text)
+          streamSpan.textContent = data.response;
+          this.finishStreamingBotMessage(data.response);
+          showFormIfAccepted();
+        } else {
+          // ✅ Add bot message with callback to show form after typing animation
+          this.addBotMessage(data.response, true, showFormIfAccepted);
+        }
 
         console.log("✅ Bot response added");
       } else {
@@ -703,6 +725,97 @@ class WebDoctorChat {
     this.focusInput();
   }
 
+  // ✅ POST a chat message; consumes Server-Sent Events when the server streams
+  async fetchReply(targetUrl, payload, csrfToken, signal, onDelta) {
+    const response = await fetch(targetUrl, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        Accept: "text/event-stream, application/json",
+        "X-CSRFToken": csrfToken,
+      },
+      body: JSON.stringify(payload),
+      signal: signal,
+    });
+
+    console.log("📡 Response status:", response.status);
+    console.log("📡 Response ok:", response.ok);
+
+    if (!response.ok) {
+      throw new Error(`Server error: ${response.status}`);
+    }
+
+    const contentType = response.headers.get("Content-Type") || "";
+    if (!contentType.includes("text/event-stream") || !response.body) {
+      try {
+        return await response.json();
+      } catch (jsonError) {
+        console.error("❌ JSON parsing error:", jsonError);
+        throw new Error("Invalid response format from server");
+      }
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let finalData = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let eventName = "message";
+        let eventData = "";
+        frame.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) eventName = line.slice(6).trim();
+          else if (line.startsWith("data:")) eventData += line.slice(5).trim();
+        });
+        if (!eventData) continue;
+
+        const parsed = JSON.parse(eventData);
+        if (eventName === "delta" && parsed.text) {
+          onDelta(parsed.text);
+        } else if (eventName === "final") {
+          finalData = parsed;
+        }
+      }
+    }
+
+    if (!finalData) {
+      throw new Error("Stream ended before the final event");
+    }
+    return finalData;
+  }
+
+  // ✅ Create an empty bot bubble that streamed text is appended to
+  startStreamingBotMessage() {
+    const chatBody = document.getElementById("chat-body");
+    const messageDiv = document.createElement("div");
+    messageDiv.className = "chat-bubble bot";
+    messageDiv.innerHTML =
+      '<strong>Shirley:</strong> <span class="typing-text"></span>';
+    chatBody.appendChild(messageDiv);
+    this.playTypingSound();
+    return messageDiv.querySelector(".typing-text");
+  }
+
+  finishStreamingBotMessage(message) {
+    this.isTyping = false;
+    this.scrollToBottom();
+
+    if (window.iframeHeightManager) {
+      window.iframeHeightManager.triggerHeightUpdate();
+    }
+
+    this.checkForFormTrigger(message);
+  }
+
   async submitForm() {
     console.log("📋 Submit form called");
 
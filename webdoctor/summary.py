@@ -0,0 +1,97 @@
+# webdoctor/summary.py - Rolling conversation summary that bounds prompt and session size
+import logging
+import re
+from django.conf import settings
+from agentsuite import metrics
+
+logger = logging.getLogger('webdoctor')
+
+SUMMARY_KEEP_ENTRIES = 4      # Last 2 turns (user + assistant) stay verbatim
+SUMMARY_MAX_CHARS = 1200      # Running summary budget
+LEGACY_WINDOW_ENTRIES = 8     # What prompts used to replay (last 8 entries, 1500 chars each)
+LEGACY_ENTRY_CHARS = 1500
+
+def get_keep_entries():
+    return getattr(settings, "WEBDOCTOR_SUMMARY_KEEP_ENTRIES", SUMMARY_KEEP_ENTRIES)
+
+def get_summary_max_chars():
+    return getattr(settings, "WEBDOCTOR_SUMMARY_MAX_CHARS", SUMMARY_MAX_CHARS)
+
+def estimate_tokens(text):
+    """Rough token count (~4 chars per token) - good enough for before/after logging"""
+    return (len(text or "") + 3) // 4
+
+def compact_text(text, limit):
+    """Collapse whitespace and cut at a word boundary"""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "..."
+
+def summarize_entry(entry):
+    """One summary line per history entry - the user's words matter more than Shirley's"""
+    if entry.get("role") == "user":
+        return f"- User: {compact_text(entry.get('content', ''), 200)}"
+    return f"- Shirley: {compact_text(entry.get('content', ''), 100)}"
+
+def trim_summary(lines, max_chars):
+    """Keep the opening line (the original problem) plus as many recent lines as fit"""
+    if not lines:
+        return lines
+    head, tail = lines[0], lines[1:]
+    budget = max_chars - len(head) - 1
+    kept = []
+    for line in reversed(tail):
+        if budget - len(line) - 1 < 0:
+            break
+        kept.append(line)
+        budget -= len(line) + 1
+    return [head] + list(reversed(kept))
+
+def conversation_length(conversation_data):
+    """Total messages in the conversation, including ones folded into the summary"""
+    return conversation_data.get("history_offset", 0) + len(conversation_data.get("history", []))
+
+def legacy_window_tokens(conversation_data):
+    """Tokens the old 8-entry replay would have spent on entries that now only live in the summary"""
+    missing = LEGACY_WINDOW_ENTRIES - len(conversation_data.get("history", []))
+    if missing <= 0:
+        return 0
+    return sum(conversation_data.get("folded_token_sizes", [])[-missing:])
+
+def fold_history(conversation_data):
+    """
+    Fold everything but the last SUMMARY_KEEP_ENTRIES history entries into the
+    running summary and drop them from the session. Returns the number folded.
+    """
+    history = conversation_data.get("history", [])
+    keep = get_keep_entries()
+    if len(history) <= keep:
+        return 0
+
+    folded, conversation_data["history"] = history[:-keep], history[-keep:]
+
+    existing = [line for line in (conversation_data.get("summary") or "").split("\n") if line]
+    lines = trim_summary(existing + [summarize_entry(entry) for entry in folded], get_summary_max_chars())
+    conversation_data["summary"] = "\n".join(lines)
+    conversation_data["history_offset"] = conversation_data.get("history_offset", 0) + len(folded)
+
+    # Remember what the folded entries would have cost in the legacy prompt window
+    sizes = conversation_data.get("folded_token_sizes", [])
+    sizes += [estimate_tokens(entry.get("content", "")[:LEGACY_ENTRY_CHARS]) for entry in folded]
+    conversation_data["folded_token_sizes"] = sizes[-LEGACY_WINDOW_ENTRIES:]
+
+    folded_tokens = sum(estimate_tokens(entry.get("content", "")) for entry in folded)
+    logger.info(f"SUMMARY FOLD: {len(folded)} entries (~{folded_tokens} tokens) folded, summary now ~{estimate_tokens(conversation_data['summary'])} tokens")
+    return len(folded)
+
+def record_prompt_size(history, system_message, summary_section="", summarized_tokens=0):
+    """Log estimated prompt tokens for this turn, with and without summarization"""
+    window = history[-LEGACY_WINDOW_ENTRIES:]
+    recent_tokens = sum(estimate_tokens(entry.get("content", "")[:LEGACY_ENTRY_CHARS]) for entry in window)
+    after = estimate_tokens(system_message) + recent_tokens
+    before = after - estimate_tokens(summary_section) + summarized_tokens
+
+    metrics.observe("prompt_tokens.summarized", after)
+    metrics.observe("prompt_tokens.verbatim", before)
+    logger.info(f"PROMPT SIZE: ~{after} tokens (~{before} without summarization, {len(window)} recent entries)")
@@ -1,3 +1,661 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from agentsuite.session_store import SessionStore
+from agentsuite.tests import SharedCacheTestCase
+from webdoctor import jobs, outbox, response_stats, threads, views
+from webdoctor.ai_agent import collect_tool_outputs, execute_run
+from webdoctor.async_agent import apoll_run, astream_run
+from webdoctor.backends import AssistantsBackend, ChatCompletionsBackend
+from webdoctor.deadline import Deadline, DeadlineExceeded
+from webdoctor.models import AgentResponse, Conversation, DiagnosticReport
+from webdoctor.page_weight import estimate_page_weight
+from webdoctor.plugin_detector import ComponentScanner, detect_components
+from webdoctor.prefetch import extract_urls, prefetch_tools_for_message
+from webdoctor.summary import conversation_length, fold_history
+from webdoctor.tool_cache import ToolCache
+from webdoctor.transcripts import TranscriptBuffer
+from webdoctor.utils import canonical_url, normalize_url
 
-# Create your tests here.
+@override_settings(WEBDOCTOR_THREAD_SWEEPER=False)
+class ThreadRegistryTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(threads, "delete_thread", return_value=True)
+        self.delete_thread = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_thread_keeps_its_own_entry(self):
+        threads.touch_thread("thread_a")
+        threads.touch_thread("thread_b")
+        threads.touch_thread("thread_a")
+
+        self.assertEqual(threads.sweep_abandoned_threads(max_idle=-1), 2)
+        self.assertEqual({call.args[0] for call in self.delete_thread.call_args_list}, {"thread_a", "thread_b"})
+        self.assertEqual(threads.sweep_abandoned_threads(max_idle=-1), 0)
+
+    def test_recently_used_threads_survive_the_sweep(self):
+        threads.touch_thread("thread_a")
+        self.assertEqual(threads.sweep_abandoned_threads(max_idle=3600), 0)
+        self.delete_thread.assert_not_called()
+
+    def test_prewarmed_thread_is_promoted_by_its_first_turn(self):
+        threads.register_prewarmed_thread("thread_a")
+        threads.register_prewarmed_thread("thread_b")
+        threads.touch_thread("thread_a")
+
+        self.assertEqual(threads.sweep_prewarmed_threads(max_age=-1), 1)
+        self.delete_thread.assert_called_once_with("thread_b")
+
+    def test_forgotten_threads_leave_the_index(self):
+        for name in ("thread_a", "thread_b", "thread_c"):
+            threads.touch_thread(name)
+        threads.forget_thread("thread_a")
+        threads.forget_thread("thread_b")
+
+        self.assertEqual(list(threads._indexed_threads()), ["thread_c"])
+        self.assertEqual(threads.cache.get(threads.INDEX_LOW_KEY), 3)
+
+    def test_unwritten_slot_stops_pinning_the_scan_after_the_grace_period(self):
+        threads.touch_thread("thread_a")
+        threads.cache.incr(threads.INDEX_SEQ_KEY)  # a worker claimed slot 2 and died before writing it
+        threads.touch_thread("thread_c")
+        threads.forget_thread("thread_a")
+        threads.forget_thread("thread_c")
+
+        self.assertEqual(threads._indexed_threads(), {})
+        self.assertEqual(threads.cache.get(threads.INDEX_LOW_KEY), 2)
+
+        later = threads.time.time() + threads.get_thread_idle_ttl() + 1
+        with mock.patch.object(threads.time, "time", return_value=later):
+            self.assertEqual(threads._indexed_threads(), {})
+        self.assertEqual(threads.cache.get(threads.INDEX_LOW_KEY), 4)
+
+class RunOptionsTests(SimpleTestCase):
+    history = [
+        {"role": "user", "content": "My site is slow"},
+        {"role": "assistant", "content": "When did it start?"},
+        {"role": "user", "content": "Yesterday"},
+        {"role": "assistant", "content": "Which pages?"},
+        {"role": "user", "content": "All of them"},
+    ]
+
+    def run_options(self, thread_id, thread_sync):
+        backend = AssistantsBackend()
+        return backend.build_run_options(self.history, "stage prompt", *backend.sync_state(self.history, thread_id, thread_sync))
+
+    def test_turns_missing_from_the_thread_are_appended(self):
+        # The previous turn was answered locally and never reached the thread
+        options, on_thread = self.run_options("thread_a", {"pending": 3, "messages": 6})
+        self.assertEqual([m["content"] for m in options["additional_messages"]], ["Yesterday", "Which pages?", "All of them"])
+        self.assertEqual(on_thread, 9)
+        self.assertEqual(options["truncation_strategy"]["last_messages"], 5)
+
+    def test_new_thread_counts_its_seed_messages(self):
+        options, on_thread = self.run_options(None, {"pending": 5, "messages": 0})
+        self.assertEqual([m["content"] for m in options["additional_messages"]], ["All of them"])
+        self.assertEqual(on_thread, 5)
+
+    def test_truncation_never_reaches_past_a_short_thread(self):
+        options, on_thread = self.run_options("thread_a", {"pending": 1, "messages": 1})
+        self.assertEqual(on_thread, 2)
+        self.assertEqual(options["truncation_strategy"]["last_messages"], 2)
+
+@override_settings(WEBDOCTOR_STREAM_RUNS=True)
+class ExecuteRunFallbackTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.runs = self.client.beta.threads.runs
+        self.runs.create.side_effect = [ConnectionError("stream reset"), SimpleNamespace(id="run_2", status="queued")]
+        self.runs.retrieve.side_effect = lambda thread_id, run_id: SimpleNamespace(id=run_id, status="completed")
+        patcher = mock.patch("webdoctor.ai_agent.time.sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_broken_stream_resumes_the_run_it_started(self):
+        self.runs.list.return_value = SimpleNamespace(data=[SimpleNamespace(id="run_1", status="in_progress")])
+
+        run, raw_text = execute_run(self.client, "thread_a", "asst_a")
+
+        self.assertEqual(run.id, "run_1")
+        self.assertIsNone(raw_text)
+        self.assertEqual(self.runs.create.call_count, 1)
+
+    def test_polling_run_is_created_when_none_is_active(self):
+        self.runs.list.return_value = SimpleNamespace(data=[SimpleNamespace(id="run_0", status="completed")])
+
+        run, raw_text = execute_run(self.client, "thread_a", "asst_a")
+
+        self.assertEqual(run.id, "run_2")
+        self.assertEqual(self.runs.create.call_count, 2)
+        self.assertNotIn("stream", self.runs.create.call_args.kwargs)
+
+@override_settings(WEBDOCTOR_TOOL_TIMEOUTS={"fast": 2, "slow": 0.3})
+class ToolCallConcurrencyTests(SimpleTestCase):
+
+    def tool_call(self, call_id, name):
+        return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments="{}"))
+
+    def test_tools_run_together_and_a_slow_one_times_out_alone(self):
+        def handle_tool_call(tool_call, deadline=None):
+            time.sleep(1 if tool_call.function.name == "slow" else 0.2)
+            return {"ran": tool_call.id}
+
+        started = time.monotonic()
+        with mock.patch("webdoctor.ai_agent.handle_tool_call", side_effect=handle_tool_call):
+            outputs = collect_tool_outputs([self.tool_call("a", "fast"), self.tool_call("b", "slow"), self.tool_call("c", "fast")])
+
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual([output["tool_call_id"] for output in outputs], ["a", "b", "c"])
+        self.assertEqual(json.loads(outputs[0]["output"]), {"ran": "a"})
+        self.assertIn("took too long", json.loads(outputs[1]["output"])["error"])
+        self.assertEqual(json.loads(outputs[2]["output"]), {"ran": "c"})
+
+class AsyncRunDeadlineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.runs = self.client.beta.threads.runs
+        self.runs.retrieve = mock.AsyncMock(side_effect=lambda thread_id, run_id: SimpleNamespace(id=run_id, status="in_progress"))
+
+    def test_polling_stops_at_the_deadline(self):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(apoll_run(self.client, "thread_a", SimpleNamespace(id="run_1", status="queued"), deadline=Deadline(0.1)))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_stream_is_abandoned_once_the_deadline_passes(self):
+        deltas = []
+
+        class EndlessStream:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+            async def __aiter__(self):
+                while True:
+                    await asyncio.sleep(0.02)
+                    yield SimpleNamespace(event="thread.message.delta", data=SimpleNamespace(
+                        delta=SimpleNamespace(content=[SimpleNamespace(text=SimpleNamespace(value="x"))])))
+
+        self.runs.create = mock.AsyncMock(return_value=EndlessStream())
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(astream_run(self.client, "thread_a", "asst_a", on_text_delta=deltas.append, deadline=Deadline(0.1)))
+        self.assertLess(len(deltas), 10)
+
+class AsyncMessageHandlerTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reply = {"response": "Hello there", "next_stage": "diagnosing", "category": "speed", "clarifications": 1}
+        self.agent_turn = mock.AsyncMock(return_value=reply)
+        for patcher in (mock.patch.object(views, "arun_agent_turn", self.agent_turn),
+                        mock.patch.object(views, "record_turn"),
+                        mock.patch.object(views, "record_response")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_turn_is_answered_and_kept_in_the_session(self):
+        async def post():
+            return await self.async_client.post("/agent/handle_message/async/", data={"message": "My site is slow"},
+                                                content_type="application/json")
+
+        response = asyncio.run(post())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["response"], response.json()["stage"]), ("Hello there", "diagnosing"))
+        self.assertIsInstance(self.agent_turn.call_args.kwargs["deadline"], Deadline)
+        session = SessionStore(session_key=self.async_client.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.assertEqual([message["role"] for message in session["conversation"]["history"]], ["user", "assistant"])
+
+@override_settings(WEBDOCTOR_OUTBOX_KICK=False, EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class OutboxTests(TestCase):
+
+    def enqueue(self, email):
+        return outbox.enqueue_report(None, email, "Slow site", "Report body", "Your report")
+
+    def test_drain_marks_sent_reports_and_backs_off_failed_ones(self):
+        delivered = self.enqueue("ok@example.com")
+        failing = self.enqueue("fails@example.com")
+        build_message = outbox.report_message
+
+        def report_message(report, connection):
+            message = build_message(report, connection)
+            if report.user_email == "fails@example.com":
+                message.send = mock.Mock(side_effect=OSError("mailbox unavailable"))
+            return message
+
+        with mock.patch.object(outbox, "report_message", side_effect=report_message):
+            self.assertEqual(outbox.drain_outbox(), (1, 1))
+
+        self.assertEqual([message.to for message in mail.outbox], [["ok@example.com"]])
+        delivered.refresh_from_db()
+        self.assertTrue(delivered.email_sent)
+        self.assertIsNotNone(delivered.email_sent_at)
+
+        failing.refresh_from_db()
+        self.assertFalse(failing.email_sent)
+        self.assertEqual((failing.email_attempts, failing.last_email_error), (1, "mailbox unavailable"))
+        self.assertGreater(failing.next_attempt_at, timezone.now() + outbox.retry_delay(1) - timedelta(seconds=5))
+
+        # Nothing is due again until the backoff passes
+        self.assertEqual(outbox.drain_outbox(), (0, 0))
+        self.assertEqual(outbox.pending_count(), 1)
+
+    def test_claimed_report_is_not_sent_twice(self):
+        report = self.enqueue("ok@example.com")
+        self.assertTrue(outbox.claim(report))
+        self.assertFalse(outbox.claim(report))
+        self.assertEqual(outbox.drain_outbox(), (0, 0))
+        self.assertEqual(DiagnosticReport.objects.filter(email_sent=True).count(), 0)
+
+class FoldHistoryTests(SimpleTestCase):
+
+    def conversation(self, turns):
+        history = []
+        for turn in range(turns):
+            history += [{"role": "user", "content": f"question {turn}"}, {"role": "assistant", "content": f"answer {turn}"}]
+        return {"history": history, "summary": "", "history_offset": 0, "folded_token_sizes": []}
+
+    def test_older_turns_move_into_the_summary(self):
+        conversation_data = self.conversation(3)
+
+        self.assertEqual(fold_history(conversation_data), 2)
+        self.assertEqual([entry["content"] for entry in conversation_data["history"]],
+                         ["question 1", "answer 1", "question 2", "answer 2"])
+        self.assertEqual(conversation_data["summary"], "- User: question 0\n- Shirley: answer 0")
+        self.assertEqual(conversation_length(conversation_data), 6)
+        self.assertEqual(len(conversation_data["folded_token_sizes"]), 2)
+
+        conversation_data["history"].append({"role": "user", "content": "question 3"})
+        self.assertEqual(fold_history(conversation_data), 1)
+        self.assertEqual(conversation_data["summary"].split("\n")[-1], "- User: question 1")
+        self.assertEqual(conversation_data["history_offset"], 3)
+
+    @override_settings(WEBDOCTOR_SUMMARY_MAX_CHARS=60)
+    def test_summary_keeps_the_opening_line_within_budget(self):
+        conversation_data = self.conversation(8)
+        fold_history(conversation_data)
+
+        lines = conversation_data["summary"].split("\n")
+        self.assertEqual(lines[0], "- User: question 0")
+        self.assertEqual(lines[-1], "- Shirley: answer 5")
+        self.assertLessEqual(len(conversation_data["summary"]), 60)
+
+    def test_short_history_is_left_alone(self):
+        conversation_data = self.conversation(2)
+        self.assertEqual(fold_history(conversation_data), 0)
+        self.assertEqual(len(conversation_data["history"]), 4)
+
+class TranscriptTests(TestCase):
+
+    def test_flushes_of_one_transcript_share_its_conversation(self):
+        now = timezone.now()
+        Conversation.append_transcripts({"chat_a": [("user", "My site is slow", now)]})
+        written = Conversation.append_transcripts({
+            "chat_a": [("agent", "When did it start?", now)],
+            "chat_b": [("user", "Checkout is broken", now)],
+        })
+
+        self.assertEqual(written, 2)
+        self.assertEqual(Conversation.objects.count(), 2)
+        conversation = Conversation.objects.get(session_id="chat_a")
+        self.assertEqual(conversation.subject, "My site is slow")
+        self.assertEqual(list(conversation.messages.order_by("id").values_list("sender", flat=True)), ["user", "agent"])
+
+    def test_buffer_writes_pending_turns_in_one_flush(self):
+        buffer = TranscriptBuffer()
+        with mock.patch.object(buffer.flusher, "ensure_started"):
+            buffer.record("chat_a", [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi!"}])
+            buffer.record("chat_a", [{"role": "user", "content": "My site is down"}])
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(Conversation.objects.get(session_id="chat_a").messages.count(), 3)
+
+class ResponseUsageTests(TestCase):
+
+    def usage(self):
+        return dict(AgentResponse.objects.values_list("response_text", "usage_count"))
+
+    def test_counts_accumulate_across_flushes(self):
+        self.assertEqual(AgentResponse.add_usage({"hash_a": ("Hello", 3)}), 1)
+        self.assertEqual(AgentResponse.add_usage({"hash_a": ("Hello", 2), "hash_b": ("Bye", 1)}), 1)
+        self.assertEqual(self.usage(), {"Hello": 4, "Bye": 0})
+
+    def test_row_inserted_by_another_worker_keeps_this_flush_counts(self):
+        AgentResponse.objects.create(response_hash="hash_a", response_text="Hello")
+        real_filter = AgentResponse.objects.filter
+        calls = []
+
+        def stale_filter(*args, **kwargs):
+            # The first lookup ran before the other worker's insert
+            calls.append(kwargs)
+            return AgentResponse.objects.none() if len(calls) == 1 else real_filter(*args, **kwargs)
+
+        with mock.patch.object(AgentResponse.objects, "filter", side_effect=stale_filter):
+            created = AgentResponse.add_usage({"hash_a": ("Hello", 2), "hash_b": ("Bye", 1)})
+
+        self.assertEqual(created, 1)
+        self.assertEqual(self.usage(), {"Hello": 2, "Bye": 0})
+
+    def test_recorded_responses_reach_the_table_on_flush(self):
+        with mock.patch.object(response_stats.flusher, "ensure_started"):
+            response_stats.record_response("Hello")
+            response_stats.record_response("Hello")
+
+        self.assertEqual(response_stats.flush(), 1)
+        self.assertEqual(self.usage(), {"Hello": 1})
+
+class PageWeightTests(SimpleTestCase):
+
+    @contextmanager
+    def slow_turn_stream(self, method, url, **kwargs):
+        # Whatever the governor queueing took, the client timed headers at 250 ms
+        response = mock.Mock(url=url, encoding="utf-8", extensions={"time_to_headers": 0.25})
+        response.iter_bytes.return_value = [b"<html><head><title>Hi</title></head><body></body></html>"]
+        yield response
+
+    def test_estimate_has_the_pagespeed_keys_and_excludes_queueing_from_ttfb(self):
+        with mock.patch("agentsuite.http_client.stream", self.slow_turn_stream):
+            result = estimate_page_weight("https://example.com/", budget=5)
+
+        self.assertEqual(result["ttfb_ms"], 250)
+        self.assertEqual(result["ttfb"], "250 ms")
+        self.assertEqual(result["strategy"], "estimate")
+
+class ComponentScannerTests(SimpleTestCase):
+    page = (
+        b'<html><head><link rel="stylesheet" href="/wp-content/plugins/contact-form-7/style.css?ver=5.9">'
+        b'</head><body><script src="/WP-Content/Themes/Astra/main.js"></script></body></html>'
+    )
+
+    def scan(self, chunk_size, **options):
+        scanner = ComponentScanner(max_bytes=10_000, after_head_bytes=10_000, **options)
+        for start in range(0, len(self.page), chunk_size):
+            scanner.feed(self.page[start:start + chunk_size])
+        return scanner, scanner.finish()
+
+    def test_same_components_at_every_chunk_size(self):
+        for chunk_size in (1, 2, 3, 7, 16, len(self.page)):
+            with self.subTest(chunk_size=chunk_size):
+                scanner, found = self.scan(chunk_size)
+                self.assertEqual(found["plugin"]["contact-form-7"]["version"], "5.9")
+                self.assertEqual(found["theme"]["astra"]["slug"], "Astra")
+                self.assertIsNotNone(scanner.head_end_at)
+
+    def test_other_casings_are_found_once(self):
+        found = detect_components('<img src="/WP-CONTENT/plugins/Akismet/a.png"> \u0130 <a href="/Wp-Content/Themes/astra/">')
+        self.assertEqual(set(found["plugin"]), {"akismet"})
+        self.assertEqual(set(found["theme"]), {"astra"})
+
+    def test_head_end_split_across_chunks_allows_early_stop(self):
+        head_end = self.page.index(b"</head>")
+        scanner = ComponentScanner(max_bytes=10_000, after_head_bytes=10)
+        self.assertFalse(scanner.feed(self.page[:head_end + 3]))    # "</h"
+        self.assertFalse(scanner.feed(self.page[head_end + 3:head_end + 7]))
+        self.assertEqual(scanner.head_end_at, head_end + 7)
+        self.assertTrue(scanner.feed(self.page[head_end + 7:]))
+        self.assertEqual(scanner.stop_reason, "early_stop")
+
+class PrefetchTests(SimpleTestCase):
+
+    def test_only_site_like_mentions_are_taken(self):
+        message = "My ASP.NET site at www.example.com is slow, see https://shop.example.org and example.co.uk/cart or index.php"
+        self.assertEqual(extract_urls(message), ["https://www.example.com", "https://shop.example.org", "https://example.co.uk/cart"])
+        self.assertEqual(extract_urls("Built with Node.js and Vue.js"), [])
+
+    def test_scans_are_queued_off_the_calling_thread(self):
+        with mock.patch("webdoctor.prefetch.prefetch_url") as prefetch_url, \
+                mock.patch("webdoctor.prefetch.get_prefetch_executor") as get_executor:
+            queued = prefetch_tools_for_message("Please check https://example.com")
+
+        self.assertEqual(queued, ["https://example.com"])
+        get_executor.return_value.submit.assert_called_once_with(prefetch_url, "https://example.com")
+
+class CanonicalUrlTests(SimpleTestCase):
+
+    def test_variants_of_a_page_share_one_identity(self):
+        variants = [
+            "https://www.Example.com/blog/?utm_source=mail&page=2",
+            "http://example.com:80/blog?page=2&gclid=abc",
+            "https://example.com/blog#comments?page=2",
+        ]
+        self.assertEqual({canonical_url(url) for url in variants[:2]}, {"example.com/blog?page=2"})
+        self.assertEqual(canonical_url(variants[2]), "example.com/blog")
+
+    def test_invalid_port_is_dropped(self):
+        self.assertEqual(normalize_url("https://example.com:99999/a/"), "https://example.com/a")
+        self.assertEqual(normalize_url("https://example.com:abc"), "https://example.com/")
+        self.assertEqual(normalize_url("https://example.com:8443"), "https://example.com:8443/")
+
+class SpeedJobTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch.object(jobs.speed_cache, "lookup", return_value=(None, "miss")),
+                        mock.patch.object(jobs, "latest_measurements", return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(jobs, "get_job_executor")
+        self.executor = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.addCleanup(jobs._inflight.clear)
+        self.addCleanup(jobs._futures.clear)
+
+    def test_www_and_tracking_variants_attach_to_one_job(self):
+        first = jobs.submit_speed_job("https://www.example.com/?utm_source=newsletter")
+        second = jobs.submit_speed_job("http://example.com")
+
+        self.assertEqual(second["job_id"], first["job_id"])
+        self.executor.submit.assert_called_once()
+
+    def test_other_process_job_is_attached_through_the_claim(self):
+        first = jobs.submit_speed_job("https://example.com")
+        jobs._inflight.clear()  # as seen from another process
+
+        self.assertEqual(jobs.submit_speed_job("https://www.example.com/")["job_id"], first["job_id"])
+        self.executor.submit.assert_called_once()
+
+    def test_claim_of_a_finished_job_is_taken_over(self):
+        first = jobs.submit_speed_job("https://example.com")
+        jobs._inflight.clear()
+        jobs._save_job({**jobs.get_job(first["job_id"]), "status": "done"})
+
+        second = jobs.submit_speed_job("https://example.com")
+        self.assertNotEqual(second["job_id"], first["job_id"])
+        self.assertEqual(jobs.cache.get(jobs._inflight_key("https://example.com")), second["job_id"])
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+class MessageStreamTests(SharedCacheTestCase):
+    reply = {"response": "Hello there", "next_stage": "diagnosing", "category": "speed", "clarifications": 1}
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.workers = []
+        for patcher in (mock.patch.object(views, "run_agent_turn", side_effect=self.fake_turn),
+                        mock.patch.object(views, "record_turn"),
+                        mock.patch.object(views, "record_response")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_turn(self, request, conversation_data, lang, client_ip, on_text_delta=None, deadline=None):
+        self.release.wait(5)
+        on_text_delta('{"response": "Hello ')
+        on_text_delta('there", "next_stage": "diagnosing"}')
+        return dict(self.reply)
+
+    def post(self):
+        real_thread = threading.Thread
+
+        def spawn(*args, **kwargs):
+            self.workers.append(real_thread(*args, **kwargs))
+            return self.workers[-1]
+
+        with mock.patch.object(views.threading, "Thread", side_effect=spawn):
+            return self.client.post("/agent/handle_message/stream/", data=json.dumps({"message": "My site is slow"}),
+                                    content_type="application/json")
+
+    def test_deltas_then_final_event(self):
+        response = self.post()
+        self.release.set()
+        body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        frames = [frame.split("\n") for frame in body.strip().split("\n\n")]
+        self.assertEqual([frame[0] for frame in frames], ["event: delta", "event: delta", "event: final"])
+        self.assertEqual("".join(json.loads(frame[1][6:])["text"] for frame in frames[:2]), "Hello there")
+        final = json.loads(frames[2][1][6:])
+        self.assertEqual((final["response"], final["stage"]), ("Hello there", "diagnosing"))
+
+    def test_turn_is_saved_when_the_client_disconnects(self):
+        response = self.post()
+        response.close()  # the stream is never read
+        self.release.set()
+        self.workers[0].join(5)
+
+        history = self.client.session["conversation"]["history"]
+        self.assertEqual([(message["role"], message["content"]) for message in history],
+                         [("user", "My site is slow"), ("assistant", "Hello there")])
+        self.assertEqual(self.client.session["conversation"]["stage"], "diagnosing")
+
+class ChatCompletionsBackendTests(SimpleTestCase):
+
+    class Stream(list):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    def chunk(self, content=None, tool_calls=None):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+    def fragment(self, index, call_id=None, name=None, arguments=None):
+        return SimpleNamespace(index=index, id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+    def test_tool_round_then_streamed_reply(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = [
+            self.Stream([
+                self.chunk(tool_calls=[self.fragment(0, "call_1", "measure_", '{"url": ')]),
+                self.chunk(tool_calls=[self.fragment(0, name="speed", arguments='"https://example.com"}')]),
+            ]),
+            self.Stream([self.chunk('{"response": "Your site '), self.chunk('is fast"}'), SimpleNamespace(choices=[])]),
+        ]
+        outputs = [{"tool_call_id": "call_1", "output": '{"score": 90}'}]
+        deltas = []
+
+        with mock.patch("webdoctor.backends.get_openai_client", return_value=client), \
+                mock.patch("webdoctor.backends.collect_tool_outputs", return_value=outputs) as collect:
+            result = ChatCompletionsBackend().run_turn([{"role": "user", "content": "Is my site slow?"}], "Stage: initial",
+                                                       on_text_delta=deltas.append)
+
+        self.assertEqual(result, {"status": "completed", "raw_text": '{"response": "Your site is fast"}', "thread_id": None})
+        self.assertEqual("".join(deltas), result["raw_text"])
+        tool_call = collect.call_args.args[0][0]
+        self.assertEqual((tool_call.id, tool_call.function.name, tool_call.function.arguments),
+                         ("call_1", "measure_speed", '{"url": "https://example.com"}'))
+
+        messages = client.chat.completions.create.call_args.kwargs["messages"]
+        self.assertEqual([message["role"] for message in messages[-2:]], ["assistant", "tool"])
+        self.assertEqual(messages[-1], {"role": "tool", "tool_call_id": "call_1", "content": '{"score": 90}'})
+
+    def test_tool_loop_is_cut_off(self):
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = lambda **options: self.Stream([
+            self.chunk(tool_calls=[self.fragment(0, "call_1", "measure_speed", "{}")])
+        ])
+
+        with mock.patch("webdoctor.backends.get_openai_client", return_value=client), \
+                mock.patch("webdoctor.backends.collect_tool_outputs", return_value=[]):
+            result = ChatCompletionsBackend().run_turn([{"role": "user", "content": "Hi"}], "Stage: initial")
+
+        self.assertEqual(result["status"], "timeout")
+        self.assertEqual(client.chat.completions.create.call_count, ChatCompletionsBackend.max_tool_rounds + 1)
+
+class PrewarmTests(SharedCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("webdoctor.backends.get_conversation_backend")
+        self.backend = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.backend.prewarm.return_value = "thread_warm"
+
+    def test_widget_open_creates_the_thread_once(self):
+        first = self.client.post("/agent/prewarm/")
+        second = self.client.post("/agent/prewarm/")
+
+        self.assertEqual((first.json()["prewarmed"], second.json()["prewarmed"]), (True, False))
+        self.backend.prewarm.assert_called_once_with()
+        conversation_data = self.client.session["conversation"]
+        self.assertEqual((conversation_data["thread_id"], conversation_data["thread_messages"]), ("thread_warm", 0))
+
+    def test_backend_without_threads_still_prepares_the_session(self):
+        self.backend.prewarm.return_value = None
+
+        response = self.client.post("/agent/prewarm/")
+
+        self.assertEqual(response.json(), {"success": True, "prewarmed": False, "stage": "initial"})
+        self.assertIsNone(self.client.session["conversation"]["thread_id"])
+
+class ToolCacheTests(SharedCacheTestCase):
+    url = "https://example.com"
+
+    def setUp(self):
+        super().setUp()
+        self.tool_cache = ToolCache("test", fresh_ttl=60, stale_ttl=600, negative_ttl=30)
+        patcher = mock.patch("webdoctor.tool_cache.get_refresh_executor")
+        self.executor = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def make_stale(self):
+        entry = cache.get(self.tool_cache.key(self.url))
+        cache.set(self.tool_cache.key(self.url), {**entry, "fresh_until": time.time() - 1}, timeout=600)
+
+    def test_stale_result_is_served_while_one_refresh_runs(self):
+        self.tool_cache.set(self.url, {"score": 50})
+        self.make_stale()
+        refresh = mock.Mock(return_value={"score": 90})
+
+        self.assertEqual(self.tool_cache.lookup(self.url, refresh=refresh), ({"score": 50}, "stale"))
+        self.assertEqual(self.tool_cache.lookup("https://www.example.com/", refresh=refresh), ({"score": 50}, "stale"))
+        self.executor.submit.assert_called_once()
+
+        self.tool_cache._refresh(*self.executor.submit.call_args.args[1:])
+        self.assertEqual(self.tool_cache.lookup(self.url, refresh=refresh), ({"score": 90}, "hit"))
+
+    def test_failed_refresh_keeps_the_stale_result(self):
+        self.tool_cache.set(self.url, {"score": 50})
+        self.make_stale()
+
+        self.tool_cache._refresh(self.url, mock.Mock(return_value={"error": "timed out"}))
+        self.assertEqual(self.tool_cache.lookup(self.url), ({"score": 50}, "stale"))
+
+    def test_errors_are_remembered_briefly(self):
+        self.tool_cache.set(self.url, {"error": "Site unreachable"})
+        self.assertEqual(self.tool_cache.lookup(self.url), ({"error": "Site unreachable"}, "negative"))
+
+        with mock.patch.object(cache, "set") as cache_set:
+            self.tool_cache.set(self.url, {"error": "Site unreachable"})
+        self.assertEqual(cache_set.call_args.kwargs["timeout"], 30)
+
+    def test_transient_errors_are_not_cached(self):
+        self.tool_cache.set(self.url, {"error": "Host busy", "transient": True})
+        self.assertEqual(self.tool_cache.lookup(self.url), (None, "miss"))
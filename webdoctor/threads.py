@@ -0,0 +1,209 @@
+# webdoctor/threads.py - Persistent OpenAI thread bookkeeping for chat sessions
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from agentsuite.write_behind import BackgroundWorker
+
+logger = logging.getLogger('webdoctor')
+
+# One key per thread, so workers never rewrite each other's entries:
+#   THREAD_KEY_PREFIX + id   -> last time a turn used the thread
+#   PREWARM_KEY_PREFIX + id  -> when a not-yet-used pre-warmed thread was created
+# The sweepers find threads through an index of write-once slots numbered by an atomic counter.
+THREAD_KEY_PREFIX = "webdoctor_thread_used_"
+PREWARM_KEY_PREFIX = "webdoctor_thread_prewarmed_"
+INDEXED_KEY_PREFIX = "webdoctor_thread_indexed_"
+INDEX_SLOT_PREFIX = "webdoctor_thread_slot_"
+INDEX_SEQ_KEY = "webdoctor_thread_slot_seq"
+INDEX_LOW_KEY = "webdoctor_thread_slot_low"
+INDEX_SCAN_BATCH = 500
+
+
+def get_thread_idle_ttl():
+    """Seconds a thread may sit unused before the sweeper deletes it"""
+    return getattr(settings, "WEBDOCTOR_THREAD_IDLE_TTL", getattr(settings, "SESSION_COOKIE_AGE", 3600))
+
+def get_sweep_interval():
+    return getattr(settings, "WEBDOCTOR_THREAD_SWEEP_INTERVAL", 300)
+
+def get_prewarm_ttl():
+    """Seconds a pre-warmed thread may wait for its first message before it is deleted"""
+    return getattr(settings, "WEBDOCTOR_PREWARM_TTL", 600)
+
+def _index_thread(thread_id):
+    """Give the thread a slot in the sweep index (once - add() decides which caller does it)"""
+    if not cache.add(f"{INDEXED_KEY_PREFIX}{thread_id}", True, timeout=None):
+        return
+    if not cache.add(INDEX_SEQ_KEY, 1, timeout=None):
+        slot = cache.incr(INDEX_SEQ_KEY)
+    else:
+        slot = 1
+    cache.set(f"{INDEX_SLOT_PREFIX}{slot}", thread_id, timeout=None)
+
+def touch_thread(thread_id):
+    """Record that a session thread was just used"""
+    if not thread_id:
+        return
+    cache.set(f"{THREAD_KEY_PREFIX}{thread_id}", time.time(), timeout=None)
+    markers = cache.get_many([f"{PREWARM_KEY_PREFIX}{thread_id}", f"{INDEXED_KEY_PREFIX}{thread_id}"])
+    # A pre-warmed thread that carried a real turn is no longer speculative
+    if f"{PREWARM_KEY_PREFIX}{thread_id}" in markers:
+        cache.delete(f"{PREWARM_KEY_PREFIX}{thread_id}")
+    if f"{INDEXED_KEY_PREFIX}{thread_id}" not in markers:
+        _index_thread(thread_id)
+    ensure_thread_sweeper()
+
+def register_prewarmed_thread(thread_id):
+    """Track a thread created before the session's first message (deleted after WEBDOCTOR_PREWARM_TTL if unused)"""
+    cache.add(f"{PREWARM_KEY_PREFIX}{thread_id}", time.time(), timeout=None)
+    _index_thread(thread_id)
+    ensure_thread_sweeper()
+
+def forget_thread(thread_id):
+    """Drop a thread from the registry without deleting it (its index slot is cleared by the next sweep)"""
+    if not thread_id:
+        return
+    cache.delete_many([
+        f"{THREAD_KEY_PREFIX}{thread_id}",
+        f"{PREWARM_KEY_PREFIX}{thread_id}",
+        f"{INDEXED_KEY_PREFIX}{thread_id}",
+    ])
+
+def delete_thread(thread_id):
+    """Delete a thread on OpenAI's side - returns True when it is gone"""
+    from webdoctor.ai_agent import get_openai_client
+    from openai import NotFoundError
+
+    try:
+        get_openai_client().beta.threads.delete(thread_id)
+        logger.info(f"THREAD SWEEP: deleted thread {thread_id}")
+        return True
+    except NotFoundError:
+        return True
+    except Exception as e:
+        logger.warning(f"THREAD SWEEP: could not delete thread {thread_id}: {str(e)}")
+        return False
+
+def discard_thread(thread_id):
+    """Delete an abandoned thread (e.g. after a conversation reset) off the request path"""
+    if not thread_id:
+        return
+    forget_thread(thread_id)
+    threading.Thread(target=delete_thread, args=(thread_id,), daemon=True).start()
+
+def cancel_active_run(thread_id):
+    """Cancel the thread's newest run if it is still going - returns True when one was cancelled"""
+    from webdoctor.ai_agent import get_openai_client, RUN_ACTIVE_STATUSES
+
+    try:
+        client = get_openai_client().with_options(timeout=10.0, max_retries=1)
+        runs = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
+        for run in runs.data:
+            if run.status in RUN_ACTIVE_STATUSES:
+                client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                logger.info(f"TURN DEADLINE: cancelled run {run.id} on thread {thread_id}")
+                return True
+    except Exception as e:
+        logger.warning(f"TURN DEADLINE: could not cancel run on thread {thread_id}: {str(e)}")
+    return False
+
+def cancel_active_run_later(thread_id):
+    """Cancel an over-deadline run off the request path so the fallback goes out immediately"""
+    if not thread_id:
+        return
+    threading.Thread(target=cancel_active_run, args=(thread_id,), daemon=True).start()
+
+def _indexed_threads():
+    """
+    {thread_id: {"slots": [...], "used": ts or None, "prewarmed": ts or None}} for every
+    indexed thread. Slots of forgotten threads are cleared and the scan start moves past them.
+    A slot claimed but never written (its worker died between incr() and set()) is stamped
+    with the time it was first seen empty and counts as dead after the thread idle TTL.
+    """
+    now = time.time()
+    claim_grace = get_thread_idle_ttl()
+    low = cache.get(INDEX_LOW_KEY, 1)
+    high = cache.get(INDEX_SEQ_KEY, 0)
+    threads = {}
+    dead_slots = []
+    lowest_live = high + 1
+
+    for start in range(low, high + 1, INDEX_SCAN_BATCH):
+        slots = range(start, min(start + INDEX_SCAN_BATCH, high + 1))
+        ids = cache.get_many([f"{INDEX_SLOT_PREFIX}{slot}" for slot in slots])
+        by_slot = {slot: ids.get(f"{INDEX_SLOT_PREFIX}{slot}") for slot in slots}
+        thread_ids = {thread_id for thread_id in by_slot.values() if isinstance(thread_id, str) and thread_id}
+        used = cache.get_many([f"{THREAD_KEY_PREFIX}{thread_id}" for thread_id in thread_ids])
+        prewarmed = cache.get_many([f"{PREWARM_KEY_PREFIX}{thread_id}" for thread_id in thread_ids])
+
+        for slot, thread_id in by_slot.items():
+            if thread_id is None and cache.add(f"{INDEX_SLOT_PREFIX}{slot}", now, timeout=None):
+                thread_id = now
+            if not isinstance(thread_id, str):
+                # Claimed but not written yet (None: written since the scan read it) - keep the
+                # scan start at or below it until the claim is too old to still be in progress
+                if thread_id is not None and thread_id < now - claim_grace:
+                    dead_slots.append(slot)
+                else:
+                    lowest_live = min(lowest_live, slot)
+                continue
+            entry = {
+                "used": used.get(f"{THREAD_KEY_PREFIX}{thread_id}"),
+                "prewarmed": prewarmed.get(f"{PREWARM_KEY_PREFIX}{thread_id}"),
+            }
+            if entry["used"] is None and entry["prewarmed"] is None:
+                # "" marks a slot already found dead
+                if thread_id:
+                    dead_slots.append(slot)
+                continue
+            lowest_live = min(lowest_live, slot)
+            threads.setdefault(thread_id, {**entry, "slots": []})["slots"].append(slot)
+
+    # Dead slots below the new scan start go away; ones above it are marked until it passes them
+    cache.delete_many([f"{INDEX_SLOT_PREFIX}{slot}" for slot in range(low, lowest_live)])
+    cache.set_many({f"{INDEX_SLOT_PREFIX}{slot}": "" for slot in dead_slots if slot >= lowest_live}, timeout=None)
+    if lowest_live > low:
+        cache.set(INDEX_LOW_KEY, lowest_live, timeout=None)
+    return threads
+
+def _sweep(field, cutoff, kind):
+    expired = [thread_id for thread_id, entry in _indexed_threads().items()
+               if entry[field] is not None and entry[field] < cutoff
+               and (field == "prewarmed" or entry["prewarmed"] is None)]
+
+    deleted = []
+    for thread_id in expired:
+        # Skip threads a turn touched since the scan
+        if (cache.get(f"{THREAD_KEY_PREFIX}{thread_id}") or 0) >= cutoff:
+            continue
+        if delete_thread(thread_id):
+            forget_thread(thread_id)
+            deleted.append(thread_id)
+
+    if expired:
+        logger.info(f"THREAD SWEEP: {len(deleted)}/{len(expired)} {kind} threads deleted")
+    return len(deleted)
+
+def sweep_abandoned_threads(max_idle=None):
+    """Delete every registered thread idle for longer than max_idle seconds"""
+    max_idle = get_thread_idle_ttl() if max_idle is None else max_idle
+    return _sweep("used", time.time() - max_idle, "abandoned")
+
+def sweep_prewarmed_threads(max_age=None):
+    """Delete pre-warmed threads whose session never sent a message"""
+    max_age = get_prewarm_ttl() if max_age is None else max_age
+    return _sweep("prewarmed", time.time() - max_age, "unused pre-warmed")
+
+def sweep_threads():
+    sweep_prewarmed_threads()
+    sweep_abandoned_threads()
+
+sweeper = BackgroundWorker("webdoctor-thread-sweeper", sweep_threads, get_sweep_interval, flush_at_exit=False)
+
+def ensure_thread_sweeper():
+    """Start the background sweeper once per process"""
+    if not getattr(settings, "WEBDOCTOR_THREAD_SWEEPER", True):
+        return
+    sweeper.ensure_started()
@@ -0,0 +1,133 @@
+# webdoctor/tool_cache.py - Stale-while-revalidate + negative caching for tool results
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection as db_connection
+from agentsuite import metrics
+from webdoctor.utils import canonical_url
+
+logger = logging.getLogger('webdoctor')
+
+_refresh_executor = None
+_refresh_lock = threading.Lock()
+
+def get_refresh_executor() -> ThreadPoolExecutor:
+    global _refresh_executor
+    if _refresh_executor is None:
+        with _refresh_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webdoctor-cache-refresh")
+    return _refresh_executor
+
+class ToolCache:
+    """
+    Cache for one tool's per-URL results.
+
+    fresh_ttl    - served as-is
+    stale_ttl    - after that, still served while one background refresh runs
+    negative_ttl - how long an error result (timeout, dead site) is remembered
+
+    Lookups are counted as tool_cache.<name>.hit / .stale / .negative / .miss
+    (see agentsuite.metrics / debug_metrics).
+    """
+
+    def __init__(self, name, fresh_ttl, stale_ttl, negative_ttl):
+        self.name = name
+        self.defaults = {"fresh_ttl": fresh_ttl, "stale_ttl": stale_ttl, "negative_ttl": negative_ttl}
+
+    def ttl(self, kind):
+        overrides = getattr(settings, "WEBDOCTOR_TOOL_CACHE_TTLS", {}).get(self.name, {})
+        return overrides.get(kind, self.defaults[kind])
+
+    def key(self, url):
+        return f"tool_{self.name}_{hashlib.md5(canonical_url(url).encode()).hexdigest()}"
+
+    def set(self, url, value):
+        """Store a result - results carrying "error" become short-lived negative entries"""
+        if isinstance(value, dict) and value.get("transient"):
+            # Says nothing about the site (e.g. our own per-host budget was full)
+            return
+        negative = isinstance(value, dict) and "error" in value
+        # Stand-in results (e.g. a local estimate instead of PageSpeed) are kept only briefly
+        short_lived = negative or (isinstance(value, dict) and value.get("estimated"))
+        fresh_for = self.ttl("negative_ttl") if short_lived else self.ttl("fresh_ttl")
+        stale_for = 0 if short_lived else self.ttl("stale_ttl")
+        entry = {"value": value, "fresh_until": time.time() + fresh_for, "negative": negative}
+        cache.set(self.key(url), entry, timeout=fresh_for + stale_for)
+
+    def lookup(self, url, refresh=None):
+        """
+        Returns (value, state) with state "hit", "stale", "negative" or "miss".
+        A stale entry schedules refresh(url) in the background (once across callers).
+        """
+        entry = cache.get(self.key(url))
+        if not isinstance(entry, dict):
+            state, value = "miss", None
+        elif entry["negative"]:
+            state, value = "negative", entry["value"]
+        elif entry["fresh_until"] >= time.time():
+            state, value = "hit", entry["value"]
+        else:
+            state, value = "stale", entry["value"]
+            if refresh is not None:
+                self.refresh_in_background(url, refresh)
+
+        metrics.incr(f"tool_cache.{self.name}.{state}")
+        if state != "miss":
+            logger.info(f"TOOL CACHE {self.name}: {state} for {url}")
+        return value, state
+
+    def refresh_in_background(self, url, refresh):
+        # One refresh per entry at a time, across processes sharing the cache
+        if not cache.add(f"{self.key(url)}_refreshing", True, timeout=120):
+            return False
+        get_refresh_executor().submit(self._refresh, url, refresh)
+        return True
+
+    def prefetch(self, url, compute):
+        """Fill the entry for url in the background unless something is cached already (not counted as a lookup)"""
+        if cache.get(self.key(url)) is not None:
+            return False
+        scheduled = self.refresh_in_background(url, compute)
+        if scheduled:
+            metrics.incr(f"tool_cache.{self.name}.prefetch")
+        return scheduled
+
+    def _refresh(self, url, refresh):
+        try:
+            value = refresh(url)
+            # A failed refresh keeps serving the stale value instead of replacing it with an error
+            if not (isinstance(value, dict) and "error" in value):
+                self.set(url, value)
+                metrics.incr(f"tool_cache.{self.name}.refreshed")
+        except Exception as e:
+            logger.warning(f"TOOL CACHE {self.name}: background refresh failed for {url}: {str(e)}")
+        finally:
+            cache.delete(f"{self.key(url)}_refreshing")
+            db_connection.close()
+
+    def fetch(self, url, compute, **compute_kwargs):
+        """Cached compute(url, **compute_kwargs); stale entries are refreshed with compute(url)"""
+        value, state = self.lookup(url, refresh=compute)
+        if state != "miss":
+            return value
+        value = compute(url, **compute_kwargs)
+        self.set(url, value)
+        return value
+
+    async def afetch(self, url, acompute, refresh, **compute_kwargs):
+        """Async fetch: misses run acompute on the loop, stale refreshes run refresh in a thread"""
+        value, state = await sync_to_async(self.lookup)(url, refresh)
+        if state != "miss":
+            return value
+        value = await acompute(url, **compute_kwargs)
+        await sync_to_async(self.set)(url, value)
+        return value
+
+speed_cache = ToolCache("speed", fresh_ttl=3600, stale_ttl=86400, negative_ttl=300)
+plugin_cache = ToolCache("plugins", fresh_ttl=21600, stale_ttl=7 * 86400, negative_ttl=300)
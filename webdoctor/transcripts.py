@@ -0,0 +1,102 @@
+# webdoctor/transcripts.py - Write-behind chat transcripts into Conversation/Message, off the request path
+import logging
+import threading
+import uuid
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from agentsuite.write_behind import BackgroundWorker
+from agentsuite import metrics
+
+logger = logging.getLogger('webdoctor')
+
+FLUSH_INTERVAL = 30      # Seconds - also the most transcript a crashed worker can lose
+FLUSH_SIZE = 100         # Pending messages that trigger an early flush
+MAX_PENDING = 5000       # Beyond this (database down) the oldest pending messages are dropped
+SENDERS = {"user": "user", "assistant": "agent"}
+
+def transcripts_enabled():
+    return getattr(settings, "WEBDOCTOR_TRANSCRIPTS", True)
+
+def get_flush_interval():
+    return getattr(settings, "WEBDOCTOR_TRANSCRIPT_FLUSH_INTERVAL", FLUSH_INTERVAL)
+
+def get_flush_size():
+    return getattr(settings, "WEBDOCTOR_TRANSCRIPT_FLUSH_SIZE", FLUSH_SIZE)
+
+def transcript_id(conversation_data):
+    """Stable id of the session conversation's transcript (a reset starts a new one)"""
+    if not conversation_data.get("transcript_id"):
+        conversation_data["transcript_id"] = uuid.uuid4().hex
+    return conversation_data["transcript_id"]
+
+def message_time(entry):
+    try:
+        return datetime.fromisoformat(entry["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return timezone.now()
+
+class TranscriptBuffer:
+    """Chat messages queued in memory and written in bulk by a per-process flusher thread"""
+
+    def __init__(self):
+        self.pending = []          # (transcript id, sender, content, created_at)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flusher = BackgroundWorker("webdoctor-transcripts", self.flush, get_flush_interval)
+
+    def record(self, transcript, entries, flush_soon=False):
+        """Queue history entries ({"role", "content", "timestamp"}) - no database work on the caller's thread"""
+        rows = [
+            (transcript, SENDERS.get(entry.get("role"), "system"), entry.get("content", ""), message_time(entry))
+            for entry in entries
+        ]
+        with self.lock:
+            self.pending.extend(rows)
+            self._bound()
+            pending = len(self.pending)
+        self.flusher.ensure_started()
+        if flush_soon or pending >= get_flush_size():
+            self.flusher.wake()
+
+    def _bound(self):
+        overflow = len(self.pending) - MAX_PENDING
+        if overflow > 0:
+            del self.pending[:overflow]
+            logger.warning(f"TRANSCRIPTS: buffer full, dropped {overflow} oldest messages")
+
+    def flush(self):
+        """Write everything pending in one transaction - returns the number of messages written"""
+        from webdoctor.models import Conversation
+
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch, self.pending = self.pending, []
+
+            transcripts = {}
+            for transcript, sender, content, created_at in batch:
+                transcripts.setdefault(transcript, []).append((sender, content, created_at))
+            try:
+                written = Conversation.append_transcripts(transcripts)
+            except Exception as e:
+                # Requeue ahead of newer messages so order is kept on the next try
+                with self.lock:
+                    self.pending[:0] = batch
+                    self._bound()
+                logger.error(f"TRANSCRIPTS: flush of {len(batch)} messages failed: {str(e)}")
+                return 0
+
+        metrics.incr("transcripts.flushes")
+        metrics.incr("transcripts.messages", written)
+        logger.info(f"TRANSCRIPTS: wrote {written} messages for {len(transcripts)} conversations")
+        return written
+
+transcripts = TranscriptBuffer()
+
+def record_turn(conversation_data, entries, stage_changed=False):
+    """Queue a chat turn's history entries; a stage change gets the conversation written soon"""
+    if not transcripts_enabled():
+        return
+    transcripts.record(transcript_id(conversation_data), entries, flush_soon=stage_changed)
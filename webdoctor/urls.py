@@ -8,7 +8,10 @@ urlpatterns = [
     
     # ✅ Core API endpoints
     path('handle_message/', views.handle_message, name='handle_message'),
+    path('handle_message/stream/', views.handle_message_stream, name='handle_message_stream'),
+    path('handle_message/async/', views.handle_message_async, name='handle_message_async'),  # ASGI deployments
     path('ask/', views.handle_message, name='ask_agent'),  # Backward compatibility
+    path('prewarm/', views.prewarm, name='prewarm'),  # Called when the widget opens
     path('submit_form/', views.submit_form, name='submit_form'),
     
     # ✅ NEW: Conversation reset endpoint
@@ -18,8 +21,10 @@ urlpatterns = [
     path('send_email_diagnostic/', views.send_email_diagnostic, name='send_email_diagnostic'),
     path('recommend_fixes/', views.recommend_fixes, name='recommend_fixes'), 
     path('measure_speed/', views.measure_speed, name='measure_speed'),
+    path('measure_speed/<str:job_id>/', views.measure_speed_status, name='measure_speed_status'),
     path('get_plugin_list/', views.get_plugin_list, name='get_plugin_list'),
     
     # ✅ Debug endpoint (if needed)
     path('debug_conversation/', views.debug_conversation, name='debug_conversation'),
+    path('debug_metrics/', views.debug_metrics, name='debug_metrics'),
 ]
\ No newline at end of file
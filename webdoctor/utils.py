@@ -0,0 +1,52 @@
+# webdoctor/utils.py - Small shared helpers
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+def is_valid_port(url: str) -> bool:
+    """False when url has a port that is not a number in 0-65535"""
+    try:
+        urlsplit(url.strip()).port
+    except ValueError:
+        return False
+    return True
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL so variants of the same page share caches and jobs:
+    lower-case scheme and host, no default port, no fragment, sorted query,
+    no trailing slash (except the root path). An invalid port (":abc", ":99999")
+    is dropped; views reject such URLs up front with is_valid_port().
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+
+    try:
+        port = str(parts.port) if parts.port else ""
+    except ValueError:
+        port = ""
+    netloc = host if not port or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+# Query parameters that never change what a page returns
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "ref"}
+
+def canonical_url(url: str) -> str:
+    """
+    Cache identity of a URL: normalized, scheme-less, without "www." and
+    without tracking parameters (utm_*, gclid, fbclid, ...).
+    """
+    parts = urlsplit(normalize_url(url))
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    ])
+    return f"{host}{parts.path}" + (f"?{query}" if query else "")
@@ -1,53 +1,34 @@
 # webdoctor/views.py - SESSION-BASED Views with Unicode fix and conversation reset
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
-from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.db import transaction
-from django.core.cache import cache
-from webdoctor.models import UserInteraction, AgentResponse, DiagnosticReport
-from webdoctor.ai_agent import get_agent_response
+from django.db import transaction, connection as db_connection
+from asgiref.sync import sync_to_async
+from webdoctor.models import UserInteraction
+from webdoctor.ai_agent import get_agent_response, ResponseTextStreamer
+from webdoctor.async_agent import aget_agent_response
+from webdoctor.threads import discard_thread
+from webdoctor.deadline import Deadline
+from webdoctor.prefetch import prefetch_tools_for_message
+from webdoctor.outbox import enqueue_report
+from webdoctor.response_stats import record_response
+from webdoctor.transcripts import record_turn
+from webdoctor.utils import is_valid_port
+from webdoctor.summary import fold_history, conversation_length, legacy_window_tokens
+from agentsuite.ratelimit import rate_limit, client_ip as get_client_ip
 import json
 import re
 import logging
+import queue
+import threading
 import time
-from functools import wraps
 
 logger = logging.getLogger('webdoctor')
 
-def get_client_ip(request):
-    """Get client IP address"""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
-
-def rate_limit(max_requests=10, window=60):
-    """Simple rate limiting decorator"""
-    def decorator(view_func):
-        @wraps(view_func)
-        def wrapper(request, *args, **kwargs):
-            ip = get_client_ip(request)
-            cache_key = f"rate_limit_{ip}_{view_func.__name__}"
-            
-            current_requests = cache.get(cache_key, 0)
-            if current_requests >= max_requests:
-                logger.warning(f"Rate limit exceeded for {ip}")
-                return JsonResponse({
-                    'error': 'Too many requests. Please wait a moment before trying again.'
-                }, status=429)
-            
-            cache.set(cache_key, current_requests + 1, timeout=window)
-            return view_func(request, *args, **kwargs)
-        return wrapper
-    return decorator
-
 @ensure_csrf_cookie
 def webdoctor_home(request):
     """Enhanced home view with CSRF cookie"""
@@ -75,12 +56,12 @@ def get_or_initialize_conversation(session, force_reset=False):
         force_reset or
         not conversation_data or
         not isinstance(conversation_data, dict) or
-        not conversation_data.get("history") or
         not isinstance(conversation_data.get("history"), list)
     )
     
     if needs_reset:
         logger.info("SESSION-ONLY: Initializing new conversation state (no database check)")
+        discard_conversation_thread(conversation_data)
         conversation_data = {
             "history": [],
             "stage": "initial", 
@@ -89,6 +70,13 @@ def get_or_initialize_conversation(session, force_reset=False):
             "start_time": timezone.now().isoformat(),
             "last_updated": timezone.now().isoformat(),
             "session_based": True,  # Flag to indicate this is session-only
+            "thread_id": None,  # Persistent OpenAI thread, created on the first agent call
+            "thread_synced": 0,  # Conversation length already on the thread
+            "thread_messages": 0,  # Messages on the thread (seeded, appended and replies)
+            "summary": "",  # Rolling summary of turns folded out of history
+            "history_offset": 0,  # Number of messages folded into the summary
+            "folded_token_sizes": [],
+            "transcript_id": None,  # Conversation.session_id of the stored transcript (webdoctor.transcripts)
             "reset_count": conversation_data.get("reset_count", 0) + 1 if conversation_data else 1
         }
         session["conversation"] = conversation_data
@@ -97,6 +85,11 @@ def get_or_initialize_conversation(session, force_reset=False):
     
     return conversation_data
 
+def discard_conversation_thread(conversation_data):
+    """Schedule deletion of the OpenAI thread behind a conversation being thrown away"""
+    if isinstance(conversation_data, dict) and conversation_data.get("thread_id"):
+        discard_thread(conversation_data["thread_id"])
+
 def update_conversation_state(session, new_stage, new_category, new_clarifications):
     """Safely update conversation state - SESSION-ONLY"""
     conversation_data = session.get("conversation", {})
@@ -116,27 +109,241 @@ def update_conversation_state(session, new_stage, new_category, new_clarificatio
     # ✅ Fix Unicode logging issue - use ASCII arrows
     logger.info(f"SESSION-ONLY UPDATE: {old_stage} -> {new_stage}, clarifications={new_clarifications} (NO DATABASE)")
 
+PROHIBITED_MESSAGE_PATTERNS = [
+    r'<script.*?>.*?</script>',
+    r'javascript:',
+    r'eval\s*\(',
+    r'onclick\s*='
+]
+
+RESTART_INDICATORS = [
+    'my site', 'my website', 'website is', 'site is', 'having trouble',
+    'problem with', 'issue with', 'help with', 'slow', 'broken', 'down',
+    'not working', 'error', 'loading'
+]
+
+def parse_chat_request(request, client_ip):
+    """Decode the chat payload - returns (data, error_response)"""
+    try:
+        raw_body = request.body.decode("utf-8").strip()
+        if not raw_body:
+            logger.warning(f"Empty request body from {client_ip}")
+            return None, JsonResponse({'error': 'Empty request body'}, status=400)
+        return json.loads(raw_body), None
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        logger.warning(f"Invalid JSON from {client_ip}: {str(e)}")
+        return None, JsonResponse({'error': 'Invalid JSON payload'}, status=400)
+
+def force_reset_response(request, client_ip):
+    """Clear the session conversation and report the fresh state"""
+    logger.info(f"FORCE RESET triggered from {client_ip}")
+
+    # Clear session completely
+    if 'conversation' in request.session:
+        discard_conversation_thread(request.session['conversation'])
+        del request.session['conversation']
+    request.session.modified = True
+
+    # Initialize fresh conversation
+    conversation_data = get_or_initialize_conversation(request.session, force_reset=True)
+
+    return JsonResponse({
+        "response": "Conversation reset successfully",
+        "stage": "initial",
+        "success": True,
+        "reset": True,
+        "debug": {
+            "action": "force_reset",
+            "new_state": conversation_data
+        }
+    })
+
+def validate_chat_message(message, client_ip):
+    """Basic length and content checks - returns an error response or None"""
+    if not message:
+        return JsonResponse({'error': 'Message cannot be empty'}, status=400)
+    if len(message) > 500:
+        return JsonResponse({'error': 'Message too long (max 500 characters)'}, status=400)
+
+    # Basic content filtering
+    message_lower = message.lower()
+    for pattern in PROHIBITED_MESSAGE_PATTERNS:
+        if re.search(pattern, message_lower, re.IGNORECASE):
+            logger.warning(f"Prohibited content from {client_ip}: {pattern}")
+            return JsonResponse({'error': 'Invalid message content'}, status=400)
+
+    return None
+
+def begin_conversation_turn(request, message, client_ip):
+    """Load session state and record the user's message - SESSION-ONLY"""
+    message_lower = message.lower()
+
+    # Get existing conversation
+    conversation_data = get_or_initialize_conversation(request.session)
+
+    # ✅ DETECT CONVERSATION RESTART PATTERNS
+    # If we have a long conversation and user seems to be starting over
+    if (conversation_length(conversation_data) > 6 and 
+        any(indicator in message_lower for indicator in RESTART_INDICATORS)):
+        
+        logger.info(f"CONVERSATION RESTART detected from {client_ip}: '{message}'")
+        conversation_data = get_or_initialize_conversation(request.session, force_reset=True)
+
+    # Log current session state for debugging
+    logger.info(f"SESSION STATE: stage={conversation_data['stage']}, clarifications={conversation_data['clarifications']}, history_length={conversation_length(conversation_data)}")
+
+    # Add user message to session history
+    user_message = {
+        "role": "user",
+        "content": message,
+        "timestamp": timezone.now().isoformat()
+    }
+    conversation_data["history"].append(user_message)
+
+    # Special handling for very first message (greeting) - SESSION-BASED
+    if conversation_length(conversation_data) == 1:
+        logger.info("SESSION: First user message - ensuring initial stage")
+        conversation_data["stage"] = "initial"
+        conversation_data["clarifications"] = 0
+
+    # Start the speed/plugin scans for any pasted URL now, so they are warm when the assistant asks
+    prefetch_tools_for_message(message)
+
+    return conversation_data
+
+def fallback_ai_response(conversation_data):
+    """Generic reply used when the agent call itself blew up"""
+    return {
+        "response": "I'm having trouble processing your request right now. Please try again in a moment.",
+        "next_stage": conversation_data["stage"],
+        "category": conversation_data["category"],
+        "clarifications": conversation_data["clarifications"],
+        "typing_delay": 4,
+        "processing_time": 0
+    }
+
+def thread_sync_state(conversation_data):
+    """What the session's thread is missing - sessions from before the tracking assume all but the newest entry"""
+    length = conversation_length(conversation_data)
+    return {
+        "pending": length - conversation_data.get("thread_synced", length - 1),
+        "messages": conversation_data.get("thread_messages", len(conversation_data["history"]) - 1),
+    }
+
+def agent_turn_arguments(request, conversation_data, lang, on_text_delta=None, deadline=None):
+    """Keyword arguments for get_agent_response / aget_agent_response from the session state"""
+    logger.info(f"SESSION-BASED AI CALL: stage={conversation_data['stage']}, clarifications={conversation_data['clarifications']}")
+    return {
+        "history": conversation_data["history"],
+        "stage": conversation_data["stage"],
+        "category": conversation_data["category"],
+        "clarifications": conversation_data["clarifications"],
+        "lang": lang,
+        "request": request,
+        "on_text_delta": on_text_delta,
+        "thread_id": conversation_data.get("thread_id"),
+        "thread_sync": thread_sync_state(conversation_data),
+        "summary": conversation_data.get("summary"),
+        "summarized_tokens": legacy_window_tokens(conversation_data),
+        "deadline": deadline,
+    }
+
+def check_ai_response(ai_response, conversation_data):
+    """Sanity-check the agent's reply structure (raises ValueError when unusable)"""
+    # Validate AI response structure
+    required_fields = ['response', 'next_stage', 'category', 'clarifications']
+    for field in required_fields:
+        if field not in ai_response:
+            logger.error(f"Missing field {field} in AI response")
+            ai_response[field] = None
+    
+    # Ensure response is not empty
+    if not ai_response.get("response", "").strip():
+        raise ValueError("Empty AI response")
+        
+    # Log the AI response for debugging
+    logger.info(f"SESSION AI RESPONSE: {conversation_data['stage']} -> {ai_response.get('next_stage')}, clarifications={conversation_data['clarifications']} -> {ai_response.get('clarifications')}")
+    return ai_response
+
+def run_agent_turn(request, conversation_data, lang, client_ip, on_text_delta=None, deadline=None):
+    """Call the agent for the current session state and sanity-check its reply"""
+    try:
+        ai_response = get_agent_response(**agent_turn_arguments(request, conversation_data, lang, on_text_delta, deadline))
+        return check_ai_response(ai_response, conversation_data)
+    except Exception as ai_error:
+        logger.error(f"SESSION-BASED AI response failed for {client_ip}: {str(ai_error)}")
+        return fallback_ai_response(conversation_data)
+
+async def arun_agent_turn(request, conversation_data, lang, client_ip, deadline=None):
+    """Async twin of run_agent_turn - the OpenAI wait happens on the event loop"""
+    try:
+        ai_response = await aget_agent_response(**agent_turn_arguments(request, conversation_data, lang, deadline=deadline))
+        return check_ai_response(ai_response, conversation_data)
+    except Exception as ai_error:
+        logger.error(f"SESSION-BASED AI response failed for {client_ip}: {str(ai_error)}")
+        return fallback_ai_response(conversation_data)
+
+def complete_conversation_turn(request, conversation_data, ai_response):
+    """Record the assistant reply and advance the session state"""
+    history = conversation_data["history"]
+    turn = [history[-1]] if history and history[-1].get("role") == "user" else []
+    old_stage = conversation_data["stage"]
+
+    # Add assistant message to session history
+    assistant_message = {
+        "role": "assistant",
+        "content": ai_response["response"],
+        "timestamp": timezone.now().isoformat()
+    }
+    conversation_data["history"].append(assistant_message)
+
+    # Older turns collapse into the rolling summary; only the last 2 stay verbatim
+    fold_history(conversation_data)
+
+    # Keep the persistent thread for the next turn
+    if ai_response.get("thread_id"):
+        conversation_data["thread_id"] = ai_response["thread_id"]
+    if ai_response.get("thread_messages") is not None:
+        # The whole conversation, this reply included, is on the thread now
+        conversation_data["thread_synced"] = conversation_length(conversation_data)
+        conversation_data["thread_messages"] = ai_response["thread_messages"]
+
+    # Update session conversation state (NO DATABASE)
+    update_conversation_state(
+        request.session,
+        ai_response.get("next_stage", conversation_data["stage"]),
+        ai_response.get("category", conversation_data["category"]),
+        ai_response.get("clarifications", conversation_data["clarifications"])
+    )
+
+    # Queue the turn for the Conversation/Message transcript - written in bulk off the request
+    try:
+        record_turn(conversation_data, turn + [assistant_message], stage_changed=ai_response.get("next_stage", old_stage) != old_stage)
+    except Exception as transcript_error:
+        logger.error(f"Transcript record failed (non-critical): {str(transcript_error)}")
+
+    # Count unique responses for analytics - buffered in memory and written in bulk off the request
+    try:
+        record_response(ai_response["response"])
+    except Exception as stats_error:
+        logger.error(f"Analytics record failed (non-critical): {str(stats_error)}")
+
 @csrf_exempt
-@rate_limit(max_requests=30, window=60)  # 30 requests per minute
+@rate_limit(max_requests=30, window=60, scope="chat")  # 30 requests per minute
 @require_http_methods(["POST"])
 def handle_message(request):
     """
     SESSION-BASED message handler with FORCE RESET capability
     """
     start_time = time.time()
+    deadline = Deadline.for_turn()  # Answer (or fall back) before the widget gives up on us
     client_ip = get_client_ip(request)
 
     try:
         # Parse and validate JSON
-        try:
-            raw_body = request.body.decode("utf-8").strip()
-            if not raw_body:
-                logger.warning(f"Empty request body from {client_ip}")
-                return JsonResponse({'error': 'Empty request body'}, status=400)
-            data = json.loads(raw_body)
-        except (UnicodeDecodeError, json.JSONDecodeError) as e:
-            logger.warning(f"Invalid JSON from {client_ip}: {str(e)}")
-            return JsonResponse({'error': 'Invalid JSON payload'}, status=400)
+        data, error_response = parse_chat_request(request, client_ip)
+        if error_response:
+            return error_response
 
         # Extract and validate input
         message = data.get('message', '').strip()
@@ -145,160 +352,94 @@ def handle_message(request):
 
         # ✅ HANDLE SPECIAL FORCE RESET MESSAGE
         if message == '__FORCE_RESET__' or force_reset:
-            logger.info(f"FORCE RESET triggered from {client_ip}")
-            
-            # Clear session completely
-            if 'conversation' in request.session:
-                del request.session['conversation']
-            request.session.modified = True
-            
-            # Initialize fresh conversation
-            conversation_data = get_or_initialize_conversation(request.session, force_reset=True)
-            
-            return JsonResponse({
-                "response": "Conversation reset successfully",
-                "stage": "initial",
-                "success": True,
-                "reset": True,
-                "debug": {
-                    "action": "force_reset",
-                    "new_state": conversation_data
-                }
-            })
+            return force_reset_response(request, client_ip)
 
-        if not message:
-            return JsonResponse({'error': 'Message cannot be empty'}, status=400)
-        if len(message) > 500:
-            return JsonResponse({'error': 'Message too long (max 500 characters)'}, status=400)
-
-        # Basic content filtering
-        prohibited_patterns = [
-            r'<script.*?>.*?</script>',
-            r'javascript:',
-            r'eval\s*\(',
-            r'onclick\s*='
-        ]
-
-        message_lower = message.lower()
-        for pattern in prohibited_patterns:
-            if re.search(pattern, message_lower, re.IGNORECASE):
-                logger.warning(f"Prohibited content from {client_ip}: {pattern}")
-                return JsonResponse({'error': 'Invalid message content'}, status=400)
-
-        # ✅ DETECT CONVERSATION RESTART PATTERNS
-        restart_indicators = [
-            'my site', 'my website', 'website is', 'site is', 'having trouble',
-            'problem with', 'issue with', 'help with', 'slow', 'broken', 'down',
-            'not working', 'error', 'loading'
-        ]
-        
-        # Get existing conversation
-        conversation_data = get_or_initialize_conversation(request.session)
-        
-        # If we have a long conversation and user seems to be starting over
-        if (len(conversation_data.get("history", [])) > 6 and 
-            any(indicator in message_lower for indicator in restart_indicators)):
-            
-            logger.info(f"CONVERSATION RESTART detected from {client_ip}: '{message}'")
-            conversation_data = get_or_initialize_conversation(request.session, force_reset=True)
-
-        # Log current session state for debugging
-        logger.info(f"SESSION STATE: stage={conversation_data['stage']}, clarifications={conversation_data['clarifications']}, history_length={len(conversation_data['history'])}")
-
-        # Add user message to session history
-        user_message = {
-            "role": "user",
-            "content": message,
-            "timestamp": timezone.now().isoformat()
-        }
-        conversation_data["history"].append(user_message)
+        error_response = validate_chat_message(message, client_ip)
+        if error_response:
+            return error_response
 
-        # Special handling for very first message (greeting) - SESSION-BASED
-        if len(conversation_data["history"]) == 1:
-            logger.info("SESSION: First user message - ensuring initial stage")
-            conversation_data["stage"] = "initial"
-            conversation_data["clarifications"] = 0
+        conversation_data = begin_conversation_turn(request, message, client_ip)
+        previous_stage = conversation_data['stage']
 
         # Get AI response - COMPLETELY SESSION-BASED (NO DATABASE LOOKUPS)
-        try:
-            logger.info(f"SESSION-BASED AI CALL: stage={conversation_data['stage']}, clarifications={conversation_data['clarifications']}")
-            
-            ai_response = get_agent_response(
-                history=conversation_data["history"],
-                stage=conversation_data["stage"],
-                category=conversation_data["category"],
-                clarifications=conversation_data["clarifications"],
-                lang=lang,
-                request=request
-            )
-            
-            # Validate AI response structure
-            required_fields = ['response', 'next_stage', 'category', 'clarifications']
-            for field in required_fields:
-                if field not in ai_response:
-                    logger.error(f"Missing field {field} in AI response")
-                    ai_response[field] = None
-            
-            # Ensure response is not empty
-            if not ai_response.get("response", "").strip():
-                raise ValueError("Empty AI response")
-                
-            # Log the AI response for debugging
-            logger.info(f"SESSION AI RESPONSE: {conversation_data['stage']} -> {ai_response.get('next_stage')}, clarifications={conversation_data['clarifications']} -> {ai_response.get('clarifications')}")
-
-        except Exception as ai_error:
-            logger.error(f"SESSION-BASED AI response failed for {client_ip}: {str(ai_error)}")
-            ai_response = {
-                "response": "I'm having trouble processing your request right now. Please try again in a moment.",
-                "next_stage": conversation_data["stage"],
-                "category": conversation_data["category"],
-                "clarifications": conversation_data["clarifications"],
-                "typing_delay": 4,
-                "processing_time": 0
-            }
-
-        # Add assistant message to session history
-        assistant_message = {
-            "role": "assistant",
-            "content": ai_response["response"],
-            "timestamp": timezone.now().isoformat()
-        }
-        conversation_data["history"].append(assistant_message)
-
-        # Update session conversation state (NO DATABASE)
-        update_conversation_state(
-            request.session,
-            ai_response.get("next_stage", conversation_data["stage"]),
-            ai_response.get("category", conversation_data["category"]),
-            ai_response.get("clarifications", conversation_data["clarifications"])
-        )
+        ai_response = run_agent_turn(request, conversation_data, lang, client_ip, deadline=deadline)
 
-        # Store unique responses for analytics (optional - this doesn't affect conversation flow)
-        try:
-            # This is just for analytics and doesn't affect the conversation logic
-            AgentResponse.get_or_create_response(ai_response["response"])
-        except Exception as db_error:
-            logger.error(f"Analytics save failed (non-critical): {str(db_error)}")
-            # Continue anyway - this doesn't affect conversation flow
+        complete_conversation_turn(request, conversation_data, ai_response)
 
         # Log successful interaction
         processing_time = time.time() - start_time
         logger.info(f"SESSION-BASED message processed for {client_ip} in {processing_time:.2f}s - Final state: stage={ai_response.get('next_stage')}, clarifications={ai_response.get('clarifications')}")
 
+        return chat_turn_response(ai_response, previous_stage, conversation_data, processing_time)
+
+    except ValidationError as ve:
+        logger.warning(f"Validation error from {client_ip}: {str(ve)}")
+        return JsonResponse({'error': 'Invalid input data'}, status=400)
+    except Exception as e:
+        processing_time = time.time() - start_time
+        logger.error(f"Unexpected error from {client_ip} after {processing_time:.2f}s: {str(e)}")
         return JsonResponse({
-            "response": ai_response["response"],
-            "typing_delay": ai_response.get("typing_delay", 4),
-            "stage": ai_response.get("next_stage", "initial"),
-            "processing_time": processing_time,
-            "success": True,
-            # Debug info
-            "debug": {
-                "stage_transition": f"{conversation_data['stage']} -> {ai_response.get('next_stage')}",
-                "clarifications": ai_response.get('clarifications'),
-                "history_length": len(conversation_data["history"]),
-                "session_based": True
-            }
-        })
+            'error': 'An unexpected error occurred. Please try again.',
+            'success': False
+        }, status=500)
+
+def chat_turn_response(ai_response, previous_stage, conversation_data, processing_time):
+    """JSON reply shared by the sync and async message handlers"""
+    return JsonResponse({
+        "response": ai_response["response"],
+        "typing_delay": ai_response.get("typing_delay", 4),
+        "stage": ai_response.get("next_stage", "initial"),
+        "processing_time": processing_time,
+        "success": True,
+        # Debug info
+        "debug": {
+            "stage_transition": f"{previous_stage} -> {ai_response.get('next_stage')}",
+            "clarifications": ai_response.get('clarifications'),
+            "history_length": conversation_length(conversation_data),
+            "session_based": True
+        }
+    })
+
+@csrf_exempt
+@rate_limit(max_requests=30, window=60, scope="chat")  # Same budget as handle_message
+@require_http_methods(["POST"])
+async def handle_message_async(request):
+    """
+    ASGI message handler - same contract as handle_message, but the wait on OpenAI
+    and the HTTP tools yields the event loop instead of holding a worker thread.
+    Session and database work runs through sync_to_async.
+    """
+    start_time = time.time()
+    deadline = Deadline.for_turn()
+    client_ip = get_client_ip(request)
+
+    try:
+        data, error_response = parse_chat_request(request, client_ip)
+        if error_response:
+            return error_response
+
+        message = data.get('message', '').strip()
+        lang = data.get('lang', 'en')
+        force_reset = data.get('force_reset', False)
+
+        if message == '__FORCE_RESET__' or force_reset:
+            return await sync_to_async(force_reset_response)(request, client_ip)
+
+        error_response = validate_chat_message(message, client_ip)
+        if error_response:
+            return error_response
+
+        conversation_data = await sync_to_async(begin_conversation_turn)(request, message, client_ip)
+        previous_stage = conversation_data['stage']
+
+        ai_response = await arun_agent_turn(request, conversation_data, lang, client_ip, deadline=deadline)
+
+        await sync_to_async(complete_conversation_turn)(request, conversation_data, ai_response)
+
+        processing_time = time.time() - start_time
+        logger.info(f"SESSION-BASED async message processed for {client_ip} in {processing_time:.2f}s - Final state: stage={ai_response.get('next_stage')}, clarifications={ai_response.get('clarifications')}")
+
+        return chat_turn_response(ai_response, previous_stage, conversation_data, processing_time)
 
     except ValidationError as ve:
         logger.warning(f"Validation error from {client_ip}: {str(ve)}")
@@ -311,6 +452,146 @@ def handle_message(request):
             'success': False
         }, status=500)
 
+def sse_event(event, payload):
+    """Format one Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@csrf_exempt
+@rate_limit(max_requests=30, window=60, scope="chat")  # Shares the chat budget with handle_message
+@require_http_methods(["POST"])
+def handle_message_stream(request):
+    """
+    SESSION-BASED message handler that streams Shirley's reply as Server-Sent Events.
+    Emits "delta" events with partial response text, then one "final" event
+    carrying the authoritative response, stage, category and clarifications.
+    """
+    start_time = time.time()
+    deadline = Deadline.for_turn()
+    client_ip = get_client_ip(request)
+
+    try:
+        data, error_response = parse_chat_request(request, client_ip)
+        if error_response:
+            return error_response
+
+        message = data.get('message', '').strip()
+        lang = data.get('lang', 'en')
+        force_reset = data.get('force_reset', False)
+
+        if message == '__FORCE_RESET__' or force_reset:
+            return force_reset_response(request, client_ip)
+
+        error_response = validate_chat_message(message, client_ip)
+        if error_response:
+            return error_response
+
+        conversation_data = begin_conversation_turn(request, message, client_ip)
+        previous_stage = conversation_data['stage']
+
+    except Exception as e:
+        logger.error(f"Stream setup failed for {client_ip}: {str(e)}")
+        return JsonResponse({
+            'error': 'An unexpected error occurred. Please try again.',
+            'success': False
+        }, status=500)
+
+    events = queue.Queue()
+    streamer = ResponseTextStreamer()
+
+    def on_text_delta(chunk):
+        text = streamer.feed(chunk)
+        if text:
+            events.put(("delta", text))
+
+    def agent_worker():
+        # The turn is recorded here rather than in event_stream, so a client that
+        # disconnects before the "final" event does not lose it
+        ai_response = None
+        try:
+            ai_response = run_agent_turn(request, conversation_data, lang, client_ip, on_text_delta=on_text_delta, deadline=deadline)
+        finally:
+            ai_response = ai_response or fallback_ai_response(conversation_data)
+            try:
+                complete_conversation_turn(request, conversation_data, ai_response)
+                # The session middleware already ran when the response started - persist explicitly
+                request.session.save()
+            except Exception as session_error:
+                logger.error(f"Saving streamed turn failed for {client_ip}: {str(session_error)}")
+            events.put(("final", ai_response))
+            db_connection.close()
+
+    threading.Thread(target=agent_worker, daemon=True).start()
+
+    def event_stream():
+        while True:
+            kind, payload = events.get()
+            if kind == "delta":
+                yield sse_event("delta", {"text": payload})
+                continue
+
+            ai_response = payload
+            processing_time = time.time() - start_time
+            logger.info(f"SESSION-BASED stream processed for {client_ip} in {processing_time:.2f}s - Final state: stage={ai_response.get('next_stage')}, clarifications={ai_response.get('clarifications')}")
+
+            yield sse_event("final", {
+                "response": ai_response["response"],
+                "stage": ai_response.get("next_stage", "initial"),
+                "category": ai_response.get("category"),
+                "clarifications": ai_response.get("clarifications"),
+                "processing_time": processing_time,
+                "success": True,
+                "debug": {
+                    "stage_transition": f"{previous_stage} -> {ai_response.get('next_stage')}",
+                    "history_length": conversation_length(conversation_data),
+                    "session_based": True
+                }
+            })
+            return
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Don't let proxies buffer the stream
+    return response
+
+@csrf_exempt
+@rate_limit(max_requests=10, window=60)
+@require_http_methods(["POST"])
+def prewarm(request):
+    """
+    Called when the widget opens: create the session conversation and, on the
+    Assistants backend, its OpenAI thread so the first message skips that setup.
+    Unused pre-warmed threads are deleted after WEBDOCTOR_PREWARM_TTL.
+    """
+    from webdoctor.backends import get_conversation_backend
+
+    client_ip = get_client_ip(request)
+
+    try:
+        conversation_data = get_or_initialize_conversation(request.session)
+
+        # Only a conversation that has not started yet can use an empty thread
+        prewarmed = False
+        if not conversation_data.get("thread_id") and not conversation_length(conversation_data):
+            thread_id = get_conversation_backend().prewarm()
+            if thread_id:
+                conversation_data["thread_id"] = thread_id
+                conversation_data["thread_synced"] = 0
+                conversation_data["thread_messages"] = 0
+                request.session["conversation"] = conversation_data
+                request.session.modified = True
+                prewarmed = True
+
+        logger.info(f"PREWARM: session ready for {client_ip} (new thread: {prewarmed})")
+        return JsonResponse({
+            'success': True,
+            'prewarmed': prewarmed,
+            'stage': conversation_data['stage']
+        })
+
+    except Exception as e:
+        logger.error(f"Prewarm failed for {client_ip}: {str(e)}")
+        return JsonResponse({'success': False, 'prewarmed': False}, status=500)
+
 # ✅ IMPROVED RESET ENDPOINT - AVAILABLE IN PRODUCTION
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -322,6 +603,7 @@ def reset_conversation(request):
         # Clear session conversation data
         if 'conversation' in request.session:
             old_conversation = request.session['conversation']
+            discard_conversation_thread(old_conversation)
             del request.session['conversation']
             request.session.modified = True
             logger.info(f"CONVERSATION RESET: Session cleared for {client_ip}")
@@ -485,41 +767,19 @@ TechWithWayne Digital Solutions
 This report is confidential and intended only for {name} at {email}.
                 """.strip()
 
-                # Create report record - FINAL DATABASE WRITE
-                report = DiagnosticReport.objects.create(
-                    user_interaction=interaction,
-                    user_email=email,
-                    issue_details=issue,
-                    report_content=report_content
+                # Queue the report - delivered by webdoctor.outbox once this transaction commits
+                enqueue_report(
+                    interaction, email, issue, report_content,
+                    subject=f'Website Diagnostic Report for {name} - TechWithWayne',
                 )
 
-                # Send email with enhanced error handling
-                try:
-                    send_mail(
-                        subject=f'Website Diagnostic Report for {name} - TechWithWayne',
-                        message=report_content,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[email],
-                        fail_silently=False,
-                    )
-
-                    # Mark as sent
-                    report.mark_email_sent()
-
-                    logger.info(f"DATABASE SUCCESS: Report sent to {email} from {client_ip}")
-
-                    return JsonResponse({
-                        'message': f'Perfect! Your diagnostic report has been sent to {email}. Check your inbox (and spam folder) in the next few minutes.',
-                        'success': True,
-                        'report_id': interaction.id
-                    })
-
-                except Exception as email_error:
-                    logger.error(f"Email failed for {email}: {str(email_error)}")
-                    return JsonResponse({
-                        'error': 'I created your report but had trouble sending the email. Please verify your email address is correct and try again.',
-                        'success': False
-                    }, status=500)
+            logger.info(f"DATABASE SUCCESS: Report queued for {email} from {client_ip}")
+
+            return JsonResponse({
+                'message': f'Perfect! Your diagnostic report is on its way to {email}. Check your inbox (and spam folder) in the next few minutes.',
+                'success': True,
+                'report_id': interaction.id
+            })
 
         except Exception as db_error:
             logger.error(f"Database operation failed for {email}: {str(db_error)}")
@@ -573,11 +833,28 @@ def recommend_fixes(request):
         logger.error(f"Recommend fixes failed: {str(e)}")
         return JsonResponse({'error': 'Failed to get recommendations'}, status=500)
 
+SPEED_JOB_MAX_VIEW_WAIT = 25  # Seconds a caller may ask the submit endpoint to wait
+
+def speed_job_response(job):
+    """Job record as JSON - 200 once finished, 202 while still running"""
+    status = 200 if job["status"] in ("done", "failed") else 202
+    return JsonResponse({
+        'job_id': job["job_id"],
+        'status': job["status"],
+        'url': job["url"],
+        'result': job.get("result"),
+        'status_url': f"/agent/measure_speed/{job['job_id']}/",
+    }, status=status)
+
 @csrf_exempt
 @rate_limit(max_requests=10, window=300)  # Limit speed tests
 @require_http_methods(["POST"])
 def measure_speed(request):
-    """Enhanced API endpoint for measuring website speed - NO DATABASE"""
+    """
+    Submit a website speed test as a background job.
+    Requests for a URL already being tested join that job. Returns the job id
+    (and the result once finished); pass "wait" (seconds) to block briefly for it.
+    """
     try:
         # Decode + check for empty body
         raw_body = request.body.decode("utf-8").strip()
@@ -594,11 +871,21 @@ def measure_speed(request):
         # Basic URL validation
         if not re.match(r'^https?:\/\/.+', url):
             return JsonResponse({'error': 'Please provide a valid URL starting with http:// or https://'}, status=400)
+        if not is_valid_port(url):
+            return JsonResponse({'error': 'Please provide a valid port number (0-65535)'}, status=400)
 
-        from webdoctor.ai_agent import handle_measure_speed
-        result = handle_measure_speed({"url": url})
+        # Run as a shared background job; optionally wait a little for the result
+        from webdoctor.jobs import submit_speed_job, wait_for_speed_job, JOB_FINISHED_STATUSES
+        job = submit_speed_job(url)
 
-        return JsonResponse(result)
+        try:
+            wait = min(max(float(data.get('wait', 0) or 0), 0), SPEED_JOB_MAX_VIEW_WAIT)
+        except (TypeError, ValueError):
+            return JsonResponse({'error': '"wait" must be a number of seconds'}, status=400)
+        if wait and job["status"] not in JOB_FINISHED_STATUSES:
+            job = wait_for_speed_job(job["job_id"], wait) or job
+
+        return speed_job_response(job)
 
     except (UnicodeDecodeError, json.JSONDecodeError) as e:
         logger.warning(f"JSON decode error in measure_speed: {str(e)}")
@@ -607,6 +894,16 @@ def measure_speed(request):
         logger.error(f"Speed measurement failed: {str(e)}")
         return JsonResponse({'error': 'Speed test failed'}, status=500)
 
+@require_http_methods(["GET"])
+def measure_speed_status(request, job_id):
+    """Status / result lookup for a speed test job"""
+    from webdoctor.jobs import get_job
+
+    job = get_job(job_id)
+    if not job:
+        return JsonResponse({'error': 'Unknown or expired speed test job'}, status=404)
+    return speed_job_response(job)
+
 @csrf_exempt
 @rate_limit(max_requests=15, window=300)  # Limit plugin scans
 @require_http_methods(["POST"])
@@ -657,4 +954,19 @@ def debug_conversation(request):
         'session_age': request.session.get_expiry_age() if hasattr(request.session, 'get_expiry_age') else 'unknown',
         'database_independent': True,
         'session_based_only': conversation_data.get('session_based', False)
-    }, indent=2)
\ No newline at end of file
+    }, indent=2)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def debug_metrics(request):
+    """Debug endpoint exposing per-backend turn latency, API-call counters and this worker's cache hit rates"""
+    if not settings.DEBUG:
+        return JsonResponse({'error': 'Debug endpoint not available in production'}, status=404)
+
+    from agentsuite import metrics
+    from agentsuite.cache import cache_stats
+    return JsonResponse({
+        'backend': getattr(settings, 'WEBDOCTOR_AGENT_BACKEND', 'assistants'),
+        'metrics': metrics.snapshot(request.GET.get('prefix', '')),
+        'cache': cache_stats(),
+    }, json_dumps_params={'indent': 2})
@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from .forms import URLScanForm
 from .models import WebsiteScan
-import requests
+from agentsuite import http_client
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import os
@@ -81,15 +81,26 @@ def generate_layout_suggestions(title, headings, url):
 
     return layout_suggestions
 
+def link_status(full_url):
+    """"ok", "broken" or "skipped" (the host had no request budget - not evidence either way)"""
+    try:
+        resp = http_client.head(full_url, follow_redirects=True, timeout=5, retries=0)
+        return "broken" if resp.status_code >= 400 else "ok"
+    except http_client.HostBusy:
+        return "skipped"
+    except:
+        return "broken"
+
 def scan_website(url):
     general_issues = []
     recommendations = []
     missing_alt_images = []
     broken_links = []
+    skipped_links = []
     headings_found = {f'h{i}': [] for i in range(1, 7)}
 
     try:
-        response = requests.get(url, timeout=15)
+        response = http_client.get(url, timeout=15)
         soup = BeautifulSoup(response.text, 'html.parser')
 
         # Title check
@@ -186,12 +197,22 @@ def scan_website(url):
             if full_url in checked:
                 continue
             checked.add(full_url)
-            try:
-                resp = requests.head(full_url, allow_redirects=True, timeout=5)
-                if resp.status_code >= 400:
-                    broken_links.append(full_url)
-            except:
+            status = link_status(full_url)
+            if status == "broken":
+                broken_links.append(full_url)
+            elif status == "skipped":
+                skipped_links.append(full_url)
+
+        # Links whose host was busy get one more try once the rest are done
+        retried, skipped_links = skipped_links, []
+        for full_url in retried:
+            status = link_status(full_url)
+            if status == "broken":
                 broken_links.append(full_url)
+            elif status == "skipped":
+                skipped_links.append(full_url)
+        if skipped_links:
+            general_issues.append(f"{len(skipped_links)} links could not be checked (host busy).")
         if broken_links:
             general_issues.append(f"{len(broken_links)} broken links found.")
             recommendations.append({
@@ -239,6 +260,7 @@ def scan_website(url):
         "missing_alt_images": missing_alt_images[:6],
         "headings_found": headings_found,
         "broken_links": broken_links,
+        "skipped_links": skipped_links,
     }
 
 def home(request):
@@ -251,7 +273,7 @@ def home(request):
 
             title = ""
             try:
-                response = requests.get(url, timeout=15)
+                response = http_client.get(url, timeout=15)
                 soup = BeautifulSoup(response.text, 'html.parser')
                 title_tag = soup.find('title')
                 if title_tag: